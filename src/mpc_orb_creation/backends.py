@@ -0,0 +1,388 @@
+"""
+mpc_orb_creation/backends.py
+ - Pluggable backends for the services that construction depends on:
+   (a) the orbfit_results table: fetching the orbfit dictionaries & writing back the mpc_orb json
+   (b) the designation-identifier: cross-identification of the designation(s) of an object
+ - The Postgres / HTTP backends wrap the internal MPC services and, as such, are only
+   expected to work on internal MPC machines
+ - The SQLite backends are local stand-ins that allow the whole fetch -> construct -> write
+   pipeline to be run (and profiled) on a laptop or CI box
+"""
+
+# Standard imports
+# -----------------------
+import json
+import sqlite3
+import sys
+from datetime import datetime
+
+# local imports
+# -----------------------
+from mpc_orb_creation import io
+
+
+# -------------------------------------------------------------------
+# Backend interfaces
+# -------------------------------------------------------------------
+
+class OrbfitResultsBackend():
+    '''
+    Interface to a store of orbfit results (i.e. something that looks like the orbfit_results table)
+
+    The methods mirror the functions in utility_fetch_orbit_results & utility_popn
+    '''
+
+    def query_unpacked_orbfit_results(self, n_max=None):
+        ''' List of the unpacked designations in the store '''
+        raise NotImplementedError
+
+    def query_desig(self, unpacked=None, packed=None):
+        ''' Dictionary of the row for a particular designation ({} if not found) '''
+        raise NotImplementedError
+
+    def get_dictionaries(self, unpacked=None, packed=None):
+        ''' gets the 3 main dictionaries ... rwo_dict , mid_epoch_dict,  standard_epoch_dict ...
+            also returns the updated_at & ele220 fields
+        '''
+        row = self.query_desig(unpacked=unpacked, packed=packed)
+        if row:
+            return row['rwo_json'], row['mid_epoch_json'], row['standard_epoch_json'], row['updated_at'], row['ele220']
+        else:
+            return {}, {}, {}, None, None
+
+    def get_quality_dict(self, unpacked=None, packed=None):
+        ''' orbfit's quality output for a particular designation (the quality_json field: {} if there is none) '''
+        return self.query_desig(unpacked=unpacked, packed=packed).get('quality_json') or {}
+
+    def insert_mpc_orb_dict(self, unpacked, updated_at, mpc_orb_dict):
+        ''' Write the mpc_orb dict back to the store
+            NB: At point of insert, the row is only updated if "updated_at" is unchanged
+
+            returns:
+            --------
+            the number of rows updated (0 if "updated_at" has changed)
+        '''
+        raise NotImplementedError
+
+    def get_mpc_orb_dict(self, unpacked):
+        ''' The stored mpc_orb dict (None if there is none) '''
+        return self.query_desig(unpacked=unpacked).get('mpc_orb_jsonb')
+
+    def get_mpc_orb_hash(self, unpacked):
+        ''' io.semantic_hash of the stored mpc_orb dict (None if there is none) '''
+        mpc_orb_dict = self.get_mpc_orb_dict(unpacked)
+        return io.semantic_hash(mpc_orb_dict) if mpc_orb_dict else None
+
+    def write_if_changed(self, unpacked, updated_at, mpc_orb_dict, mpc_orb_hash):
+        ''' As per insert_mpc_orb_dict, but the row is also only updated if its stored hash differs from mpc_orb_hash
+            NB: This default is a separate check & write: the SQL backends compare the hashes within the UPDATE
+
+            returns:
+            --------
+            the number of rows updated
+        '''
+        if self.get_mpc_orb_hash(unpacked) == mpc_orb_hash:
+            return 0
+        return self.insert_mpc_orb_dict(unpacked, updated_at, mpc_orb_dict)
+
+    def write_mpc_orb_dict(self, unpacked, updated_at, mpc_orb_dict, change_feed=None):
+        ''' As per insert_mpc_orb_dict, but the write is skipped if the stored document is semantically identical
+            (i.e. only differs in the io.VOLATILE_FIELDS)
+             - If a changefeed.ChangeFeed is supplied, a record of each write (a JSON patch against the stored document) is appended to it
+
+            returns:
+            --------
+            True if a row was updated, False if the write was skipped (unchanged document, or "updated_at" has changed)
+        '''
+        mpc_orb_hash = io.semantic_hash(mpc_orb_dict)
+        previous = None
+        if change_feed is not None:
+            # NB: The stored document is only fetched for the change feed, & only if it has changed
+            if self.get_mpc_orb_hash(unpacked) == mpc_orb_hash:
+                return False
+            previous = self.get_mpc_orb_dict(unpacked)
+
+        if not self.write_if_changed(unpacked, updated_at, mpc_orb_dict, mpc_orb_hash):
+            return False
+        if change_feed is not None:
+            change_feed.append(unpacked, previous, mpc_orb_dict)
+        return True
+
+
+class DesignationBackend():
+    '''
+    Interface to a designation-identifier service
+
+    get_ids() returns a dict of the same form as Nora's designation-identifier, i.e.
+    {'status':'Found', 'results':{...designation_data...}} or {'status':'Not Found', ...}
+    '''
+
+    def get_ids(self, label):
+        raise NotImplementedError
+
+
+# -------------------------------------------------------------------
+# Internal MPC backends
+# -------------------------------------------------------------------
+
+class PostgresOrbfitResultsBackend(OrbfitResultsBackend):
+    '''
+    The orbfit_results table in the MPC's (vmsops) postgres database
+    NB: Requires mpc_psql (& hence internal MPC machines)
+    NB: The semantic hash of the mpc_orb json is stored in the mpc_orb_hash column (see *add_hash_column*),
+        so that unchanged documents can be skipped within the UPDATE itself
+    NB: A single connection is opened on first use (& dropped when pickled), see *close*
+    '''
+
+    def __init__(self):
+        self._cnx = None
+
+    def _connect(self):
+        sys.path.append('/sa/python_libs')
+        import mpc_psql
+        return mpc_psql.connect_to_vmsops()
+
+    @property
+    def cnx(self):
+        if self._cnx is None or self._cnx.closed:
+            self._cnx = self._connect()
+        return self._cnx
+
+    def close(self):
+        if self._cnx is not None:
+            self._cnx.close()
+            self._cnx = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_cnx'] = None
+        return state
+
+    def add_hash_column(self):
+        ''' One-off migration: add the mpc_orb_hash column to the orbfit_results table (existing rows have a null hash) '''
+        with self.cnx as cnx, cnx.cursor() as cursor:
+            cursor.execute("ALTER TABLE orbfit_results ADD COLUMN IF NOT EXISTS mpc_orb_hash TEXT;")
+
+    def query_unpacked_orbfit_results(self, n_max=None):
+        from mpc_orb_creation import utility_fetch_orbit_results as fetch
+        return fetch.query_unpacked_orbfit_results(n_max=n_max)
+
+    def query_desig(self, unpacked=None, packed=None):
+        from mpc_orb_creation import utility_fetch_orbit_results as fetch
+        return fetch.query_desig(unpacked=unpacked, packed=packed)
+
+    def get_mpc_orb_dict(self, unpacked):
+        ''' Only fetches the mpc_orb_jsonb column '''
+        with self.cnx as cnx, cnx.cursor() as cursor:
+            cursor.execute("SELECT mpc_orb_jsonb FROM orbfit_results WHERE unpacked_primary_provisional_designation = %s;", (unpacked,))
+            result = cursor.fetchone()
+        return result[0] if result else None
+
+    def get_mpc_orb_hash(self, unpacked):
+        ''' Reads the stored hash (rather than fetching & re-hashing the stored document) '''
+        with self.cnx as cnx, cnx.cursor() as cursor:
+            cursor.execute("SELECT mpc_orb_hash FROM orbfit_results WHERE unpacked_primary_provisional_designation = %s;", (unpacked,))
+            result = cursor.fetchone()
+        return result[0] if result else None
+
+    def insert_mpc_orb_dict(self, unpacked, updated_at, mpc_orb_dict):
+        ''' NB: The semantic hash is stored alongside the document '''
+        sql_str = "UPDATE orbfit_results SET mpc_orb_jsonb = %s, mpc_orb_hash = %s WHERE unpacked_primary_provisional_designation = %s and updated_at = %s;"
+        with self.cnx as cnx, cnx.cursor() as cursor:
+            cursor.execute(sql_str, (json.dumps(mpc_orb_dict), io.semantic_hash(mpc_orb_dict), unpacked, updated_at))
+            return cursor.rowcount
+
+    def write_if_changed(self, unpacked, updated_at, mpc_orb_dict, mpc_orb_hash):
+        ''' The comparison with the stored hash is part of the (atomic) UPDATE '''
+        sql_str = "UPDATE orbfit_results SET mpc_orb_jsonb = %s, mpc_orb_hash = %s WHERE unpacked_primary_provisional_designation = %s and updated_at = %s " \
+                  "and mpc_orb_hash IS DISTINCT FROM %s;"
+        with self.cnx as cnx, cnx.cursor() as cursor:
+            cursor.execute(sql_str, (json.dumps(mpc_orb_dict), mpc_orb_hash, unpacked, updated_at, mpc_orb_hash))
+            return cursor.rowcount
+
+
+class PostgresDesignationBackend(DesignationBackend):
+    '''
+    Nora's designation-identifier, querying the designation tables in postgres
+    NB: Requires designation_identifier & db_client (& hence internal MPC machines)
+    '''
+
+    def __init__(self, host='localhost', port='5432', database='vmsops', user='postgres'):
+        self.connection_kwargs = {'host': host, 'port': port, 'database': database, 'user': user}
+
+    def get_ids(self, label):
+        from designation_identifier import identifier
+        from db_client import DatabaseClient
+        with DatabaseClient.PostgresClient(**self.connection_kwargs) as db:
+            return identifier.get_ids(label, db, verbose=True, use_materialized_view=False)
+
+
+class HTTPDesignationBackend(DesignationBackend):
+    '''
+    The designation-identifier flask endpoint (see desig.py)
+    '''
+
+    def __init__(self, url='http://mpcweb1:8001/api/query-identifier'):
+        self.url = url
+
+    def get_ids(self, label):
+        import requests
+        r = requests.post(self.url, data=label)
+        r.raise_for_status()
+        return r.json()
+
+
+# -------------------------------------------------------------------
+# Local (SQLite) stand-in backends
+# -------------------------------------------------------------------
+
+class _SQLiteBackend():
+    '''
+    Common connection handling for the SQLite backends
+     - The connection is only opened on first use, and is dropped when pickled,
+       so that backends can be passed to worker processes
+     - NB: An in-memory database (":memory:") is private to the process that opened it
+     - NB: The connection may be used from a thread other than the one that opened it
+           (e.g. the I/O thread in pipeline.py), but access must be serialised
+    '''
+    _schema = ""
+
+    def __init__(self, db_path=':memory:'):
+        self.db_path = db_path
+        self._cnx = None
+
+    @property
+    def cnx(self):
+        if self._cnx is None:
+            self._cnx = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._cnx.executescript(self._schema)
+        return self._cnx
+
+    def close(self):
+        if self._cnx is not None:
+            self._cnx.close()
+            self._cnx = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_cnx'] = None
+        return state
+
+
+def _timestamp_str(t):
+    ''' Timestamps are stored as text: make sure that datetimes & strings compare consistently '''
+    return io.timestamp_str(t) if isinstance(t, datetime) else t
+
+
+class SQLiteOrbfitResultsBackend(_SQLiteBackend, OrbfitResultsBackend):
+    '''
+    SQLite table that mimics the orbfit_results table
+    E.g.
+    >>> backend = SQLiteOrbfitResultsBackend('orbfit_results.db')
+    >>> backend.add_orbfit_result('2005 SG8D', 'K05SG8D', rwo_dict, mid_epoch_dict, standard_epoch_dict)
+    '''
+    _schema = """
+        CREATE TABLE IF NOT EXISTS orbfit_results (
+            id                                       INTEGER PRIMARY KEY AUTOINCREMENT,
+            packed_primary_provisional_designation   TEXT NOT NULL,
+            unpacked_primary_provisional_designation TEXT NOT NULL UNIQUE,
+            rwo_json                                 TEXT NOT NULL,
+            standard_epoch_json                      TEXT NOT NULL,
+            mid_epoch_json                           TEXT NOT NULL,
+            quality_json                             TEXT,
+            ele220                                   TEXT,
+            mpc_orb_jsonb                            TEXT,
+            mpc_orb_hash                             TEXT,
+            created_at                               TEXT,
+            updated_at                               TEXT
+        );
+    """
+    _json_columns = ['rwo_json', 'standard_epoch_json', 'mid_epoch_json', 'quality_json', 'mpc_orb_jsonb']
+
+    def add_orbfit_result(self, unpacked, packed, rwo_json, mid_epoch_json, standard_epoch_json,
+                          quality_json=None, ele220=None, updated_at=None):
+        ''' Insert (or replace) the orbfit results for a single designation '''
+        now = io.utc_now()
+        updated_at = updated_at if updated_at is not None else now
+        self.cnx.execute(
+            """INSERT OR REPLACE INTO orbfit_results (
+                    packed_primary_provisional_designation, unpacked_primary_provisional_designation,
+                    rwo_json, standard_epoch_json, mid_epoch_json, quality_json, ele220, created_at, updated_at)
+               VALUES (?,?,?,?,?,?,?,?,?);""",
+            (packed, unpacked, json.dumps(rwo_json), json.dumps(standard_epoch_json), json.dumps(mid_epoch_json),
+             json.dumps(quality_json if quality_json is not None else {}), ele220,
+             _timestamp_str(now), _timestamp_str(updated_at)))
+        self.cnx.commit()
+
+    def query_unpacked_orbfit_results(self, n_max=None):
+        limit_str = f"LIMIT {int(n_max)}" if isinstance(n_max, int) else ""
+        results = self.cnx.execute(f"SELECT unpacked_primary_provisional_designation FROM orbfit_results ORDER BY id {limit_str};").fetchall()
+        return [_[0] for _ in results]
+
+    def query_desig(self, unpacked=None, packed=None):
+        if unpacked is not None:
+            where, value = 'unpacked_primary_provisional_designation', unpacked
+        elif packed is not None:
+            where, value = 'packed_primary_provisional_designation', packed
+        else:
+            return {}
+
+        cur = self.cnx.execute(f"SELECT * FROM orbfit_results WHERE {where} = ?;", (value,))
+        result = cur.fetchone()
+        if not result:
+            return {}
+
+        row = dict(zip([_[0] for _ in cur.description], result))
+        for key in self._json_columns:
+            row[key] = json.loads(row[key]) if row[key] is not None else None
+        for key in ['created_at', 'updated_at']:
+            row[key] = datetime.fromisoformat(row[key]) if row[key] else None
+        return row
+
+    def insert_mpc_orb_dict(self, unpacked, updated_at, mpc_orb_dict):
+        ''' NB: The semantic hash is stored alongside the document '''
+        cur = self.cnx.execute(
+            "UPDATE orbfit_results SET mpc_orb_jsonb = ?, mpc_orb_hash = ? WHERE unpacked_primary_provisional_designation = ? and updated_at = ?;",
+            (json.dumps(mpc_orb_dict), io.semantic_hash(mpc_orb_dict), unpacked, _timestamp_str(updated_at)))
+        self.cnx.commit()
+        return cur.rowcount
+
+    def write_if_changed(self, unpacked, updated_at, mpc_orb_dict, mpc_orb_hash):
+        ''' The comparison with the stored hash is part of the (atomic) UPDATE '''
+        cur = self.cnx.execute(
+            "UPDATE orbfit_results SET mpc_orb_jsonb = ?, mpc_orb_hash = ? WHERE unpacked_primary_provisional_designation = ? and updated_at = ? "
+            "and mpc_orb_hash IS NOT ?;",
+            (json.dumps(mpc_orb_dict), mpc_orb_hash, unpacked, _timestamp_str(updated_at), mpc_orb_hash))
+        self.cnx.commit()
+        return cur.rowcount
+
+    def get_mpc_orb_hash(self, unpacked):
+        ''' Reads the stored hash (rather than re-hashing the stored document) '''
+        result = self.cnx.execute("SELECT mpc_orb_hash FROM orbfit_results WHERE unpacked_primary_provisional_designation = ?;", (unpacked,)).fetchone()
+        return result[0] if result else None
+
+
+class SQLiteDesignationBackend(_SQLiteBackend, DesignationBackend):
+    '''
+    SQLite stand-in for the designation-identifier
+     - Maps any label (e.g. the orbfit name of an object) to a dict of designation_data
+    '''
+    _schema = """
+        CREATE TABLE IF NOT EXISTS designations (
+            label        TEXT PRIMARY KEY,
+            results_json TEXT NOT NULL
+        );
+    """
+
+    def add_designation(self, label, results):
+        ''' Store the designation_data ("results") to be returned for the supplied label '''
+        self.cnx.execute("INSERT OR REPLACE INTO designations (label, results_json) VALUES (?,?);",
+                         (label, json.dumps(results)))
+        self.cnx.commit()
+
+    def get_ids(self, label):
+        result = self.cnx.execute("SELECT results_json FROM designations WHERE label = ?;", (label,)).fetchone()
+        if result:
+            return {'status': 'Found', 'results': json.loads(result[0])}
+        else:
+            return {'status': 'Not Found', 'results': {}}
@@ -0,0 +1,255 @@
+"""
+mpc_orb_creation/binary.py
+ - Compact binary encoding of mpc_orb dicts, e.g. for returning constructed documents from the worker processes of
+   pipeline.py, in which the numeric parts are held as a fixed-layout float64 array
+ - split(doc) -> (skeleton, codes, values) & join(skeleton, codes, values) -> doc
+   * the numeric blocks at the paths in LAYOUT (the element lists, covariances & fit statistics) are taken out of the
+     document & concatenated into a list of floats, values; their place in the (shallow-copied) skeleton is held by None
+   * codes has one byte per block of LAYOUT: 0 if the block was not taken (e.g. missing, or not all floats), otherwise
+     the form of the block (high nibble) & its length / numparams, n (low nibble), which together fix its size:
+     scalar (1), vector (n), or covariance dict (n(n+1)/2) with the keys of the mpc_orb template (cov00 ... cov99, nulls
+     for the unused parameters), the packed keys (covariance.cov_keys) or the older sequential keys
+ - encode(doc) -> bytes & decode(data) -> doc
+   Layout: header (MAGIC, VERSION, codes, LAYOUT_HASH, length of the skeleton), zero-padded to a multiple of 8 bytes,
+   then the values (little-endian float64, read back with np.frombuffer), then the pickled skeleton
+ - Lossless round-trip: decode(encode(d)) == d, including the order of the keys & the types of the values
+ - NB: The booleans & the key names of the skeleton are not bit-packed / interned by this module: in pure python, doing so
+       made encoding ~13x slower than pickle, whose C implementation already writes booleans as single-byte opcodes &
+       memoises repeated strings
+ - NB: UNSAFE for untrusted data: the skeleton is pickled, & unpickling can execute arbitrary code, so decode must only be
+       given data that was written by *encode* in a trusted process of the same deployment (e.g. the worker processes of
+       the pipeline); it is not a storage or interchange format
+ - LAYOUT_HASH (a hash of LAYOUT & of the covariance keys) is written into the header & checked by decode, so that data
+   written with a different layout (i.e. a different version of the package) is refused rather than mis-read
+"""
+
+# Standard imports
+# -----------------------
+import functools
+import hashlib
+import operator
+import pickle
+import struct
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+# local imports
+# -----------------------
+from mpc_orb_creation import covariance
+
+
+MAGIC   = b'MPCB'
+VERSION = 2
+
+# The numeric blocks, (section, key), in the order in which their values are concatenated
+LAYOUT = tuple( (section, key) for section in ['CAR', 'COM']
+                for key in ['coefficient_values', 'coefficient_uncertainties', 'eigenvalues', 'covariance'] ) + \
+         tuple( ('orbit_fit_statistics', key)
+                for key in ['sig_to_noise_ratio', 'normalized_RMS', 'not_normalized_RMS', 'U_param', 'score1', 'score2'] )
+
+# The blocks of each section, (section, ((index in LAYOUT, key), ...))
+_SECTIONS = tuple( (section, tuple( (i, key) for i, (_, key) in enumerate(LAYOUT) if _ == section ))
+                   for section in dict.fromkeys( section for section, _ in LAYOUT ) )
+
+# Forms of a block (high nibble of its code)
+SCALAR, VECTOR, COVARIANCE, COVARIANCE_PACKED, COVARIANCE_SEQUENTIAL = range(1, 6)
+
+# The keys of a covariance dict in the mpc_orb template, in order (cov00, cov01, ..., cov99)
+COVARIANCE_KEYS = covariance.cov_keys(covariance.MAX_NUMPARAMS)
+
+LAYOUT_HASH = hashlib.sha256( repr((LAYOUT, COVARIANCE_KEYS)).encode() ).digest()[:8]
+
+# MAGIC, VERSION, codes, LAYOUT_HASH, length of the skeleton [bytes]
+_HEADER = struct.Struct('<4sB%ds8sI' % len(LAYOUT))
+HEADER_SIZE = -(-_HEADER.size // 8) * 8
+
+_FLOAT = {float}
+
+# packed size -> numparams, & numparams -> getter of the packed values from the values of a template-form covariance dict
+_NUMPARAMS = { covariance.packed_size(n): n for n in range(1, covariance.MAX_NUMPARAMS + 1) }
+_COVARIANCE_GET = { n: operator.itemgetter( *[ COVARIANCE_KEYS.index(key) for key in covariance.cov_keys(n) ] )
+                    for n in range(2, covariance.MAX_NUMPARAMS + 1) }
+_COVARIANCE_GET[1] = lambda values: values[:1]
+
+# A template-form covariance dict with only nulls (copied & updated by *_decoder*)
+_NULL_COVARIANCE = dict.fromkeys(COVARIANCE_KEYS)
+
+# code -> (number of values, function that makes the block from its values), see *_decoder*
+_decoders = {}
+
+
+# -------------------------------------------------------------------
+# Numeric blocks
+# -------------------------------------------------------------------
+
+def _decoder(code):
+    ''' The number of values in a block & the function that makes it from its values (cached) '''
+    if code not in _decoders:
+        form, n = code >> 4, code & 0xf
+        if form == SCALAR:
+            _decoders[code] = 1, operator.itemgetter(0)
+        elif form == VECTOR:
+            _decoders[code] = n, list
+        elif form == COVARIANCE:
+            keys = covariance.cov_keys(n)
+            def make(values):
+                padded = _NULL_COVARIANCE.copy()
+                padded.update( zip(keys, values) )
+                return padded
+            _decoders[code] = covariance.packed_size(n), make
+        elif form in (COVARIANCE_PACKED, COVARIANCE_SEQUENTIAL) and 0 < n <= covariance.MAX_NUMPARAMS:
+            keys = covariance.cov_keys(n) if form == COVARIANCE_PACKED else covariance.sequential_cov_keys(n)
+            _decoders[code] = covariance.packed_size(n), lambda values: dict( zip(keys, values) )
+        else:
+            raise Exception(f"Unknown block code {code}")
+    return _decoders[code]
+
+def _take(value):
+    '''
+    The code & the values of a numeric block
+
+    returns:
+    --------
+    code, list of floats (code = 0 & None if the value does not have one of the forms of a numeric block)
+    '''
+    t = type(value)
+    if t is float:
+        return SCALAR << 4, [value]
+    if t is list:
+        if 0 < len(value) < 16 and set(map(type, value)) == _FLOAT:
+            return VECTOR << 4 | len(value), value
+    elif t is dict:
+        values = list(value.values())
+        if len(values) == len(COVARIANCE_KEYS):
+            # Template form: the packed keys of the first n parameters are floats, the others are null
+            n = _NUMPARAMS.get( len(values) - values.count(None) )
+            if n and tuple(value) == COVARIANCE_KEYS:
+                packed = list( _COVARIANCE_GET[n](values) )
+                if set(map(type, packed)) == _FLOAT:
+                    return COVARIANCE << 4 | n, packed
+        else:
+            n = _NUMPARAMS.get( len(values) )
+            if n and set(map(type, values)) == _FLOAT:
+                keys = tuple(value)
+                form = COVARIANCE_PACKED if keys == covariance.cov_keys(n) else \
+                       COVARIANCE_SEQUENTIAL if keys == covariance.sequential_cov_keys(n) else 0
+                if form:
+                    return form << 4 | n, values
+    return 0, None
+
+def split(doc):
+    '''
+    Take the numeric blocks (see LAYOUT) out of an mpc_orb dict
+
+    inputs:
+    -------
+    doc: dict
+     - not modified: the sections from which blocks are taken are copied
+
+    returns:
+    --------
+    skeleton: dict
+    codes: bytes, one per block of LAYOUT
+    values: list of floats
+    '''
+    if type(doc) is not dict:
+        raise Exception(f"Expected an mpc_orb dict, got {type(doc)}")
+    skeleton, codes, values = dict(doc), bytearray(len(LAYOUT)), []
+    for section, blocks in _SECTIONS:
+        parent = skeleton.get(section)
+        if type(parent) is not dict:
+            continue
+        copied = False
+        for i, key in blocks:
+            if key not in parent:
+                continue
+            code, block = _take(parent[key])
+            if not code:
+                continue
+            if not copied:
+                parent = skeleton[section] = dict(parent)
+                copied = True
+            parent[key] = None
+            codes[i] = code
+            values += block
+    return skeleton, bytes(codes), values
+
+@functools.lru_cache(maxsize=256)
+def _plan(codes):
+    ''' The blocks described by the block codes, [(section, key, start, end, make), ...] (cached, as codes rarely vary) '''
+    if len(codes) != len(LAYOUT):
+        raise Exception(f"Expected {len(LAYOUT)} block codes, got {len(codes)}")
+    plan, pos = [], 0
+    for (section, key), code in zip(LAYOUT, codes):
+        if code:
+            n, make = _decoder(code)
+            plan.append( (section, key, pos, pos + n, make) )
+            pos += n
+    return tuple(plan)
+
+def n_values(codes):
+    ''' Number of values described by the block codes '''
+    plan = _plan(bytes(codes))
+    return plan[-1][3] if plan else 0
+
+def join(skeleton, codes, values):
+    '''
+    Inverse of *split*: put the numeric blocks back into the skeleton (which is modified in place)
+
+    inputs:
+    -------
+    skeleton: dict
+    codes: bytes
+    values: sequence of floats (e.g. np.frombuffer(...).tolist())
+
+    returns:
+    --------
+    the mpc_orb dict
+    '''
+    if n_values(codes) != len(values):
+        raise Exception(f"The block codes describe {n_values(codes)} values, got {len(values)}")
+    for section, key, start, end, make in _plan(bytes(codes)):
+        skeleton[section][key] = make( values[start:end] )
+    return skeleton
+
+
+# -------------------------------------------------------------------
+# Encoding & decoding
+# -------------------------------------------------------------------
+
+def encode(doc):
+    '''
+    Encode an mpc_orb dict
+
+    returns:
+    --------
+    bytes
+    '''
+    skeleton, codes, values = split(doc)
+    skeleton = pickle.dumps(skeleton, protocol=pickle.HIGHEST_PROTOCOL)
+    header   = _HEADER.pack(MAGIC, VERSION, codes, LAYOUT_HASH, len(skeleton)).ljust(HEADER_SIZE, b'\0')
+    return b''.join([header, np.asarray(values, dtype='<f8').tobytes(), skeleton])
+
+def decode(data):
+    '''
+    Decode the output of *encode*
+
+    returns:
+    --------
+    the mpc_orb dict
+    '''
+    if len(data) < HEADER_SIZE or bytes(data[:len(MAGIC)]) != MAGIC:
+        raise Exception("Not an encoded mpc_orb document (bad magic number)")
+    magic, version, codes, layout_hash, n_skeleton = _HEADER.unpack_from(data, 0)
+    if version != VERSION:
+        raise Exception(f"Unsupported encoding version {version} (expected {VERSION})")
+    if layout_hash != LAYOUT_HASH:
+        raise Exception("The document was encoded with a different numeric layout (i.e. another version of mpc_orb_creation)")
+    n = n_values(codes)
+    if len(data) != HEADER_SIZE + 8 * n + n_skeleton:
+        raise Exception(f"Expected {HEADER_SIZE + 8 * n + n_skeleton} bytes, got {len(data)}")
+    values   = np.frombuffer(data, dtype='<f8', count=n, offset=HEADER_SIZE).tolist()
+    skeleton = pickle.loads( data[HEADER_SIZE + 8 * n:] )
+    return join(skeleton, codes, values)
@@ -0,0 +1,54 @@
+"""
+mpc_orb_creation/catalogue.py
+ - Columnar (numpy) views of a catalogue snapshot, i.e. of a collection of mpc_orb dicts
+ - Allows catalogue-wide quantities to be recomputed in vectorised calls (see e.g. quality.py),
+   without going back through orbfit output & construct
+"""
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+
+def get_snapshot(backend, designations=None, n_max=None):
+    '''
+    Get the mpc_orb dicts currently stored in an orbfit_results backend (see backends.py)
+
+    returns:
+    --------
+    list of designations, list of mpc_orb dicts
+     - NB: designations without a stored mpc_orb dict are omitted
+    '''
+    designations = designations if designations is not None else backend.query_unpacked_orbfit_results(n_max)
+    desigs, docs = [], []
+    for unpacked in designations:
+        doc = backend.query_desig(unpacked=unpacked).get('mpc_orb_jsonb')
+        if doc:
+            desigs.append(unpacked)
+            docs.append(doc)
+    return desigs, docs
+
+def to_arrays(docs, coordtype='CAR'):
+    '''
+    Extract the orbits in a list of mpc_orb dicts as arrays
+
+    inputs:
+    -------
+    docs: list of mpc_orb dicts
+    coordtype: str
+     - 'CAR' or 'COM'
+
+    returns:
+    --------
+    dict of arrays
+     - 'elements' : (N,6) best-fit elements
+     - 'rms'      : (N,6) uncertainties of the elements (non-gravs are not included)
+     - 'epoch'    : (N,)  epochs (MJD)
+    '''
+    N = len(docs)
+    elements, rms, epoch = np.empty((N, 6)), np.empty((N, 6)), np.empty(N)
+    for n, doc in enumerate(docs):
+        elements[n] = doc[coordtype]['coefficient_values'][:6]
+        rms[n]      = doc[coordtype]['coefficient_uncertainties'][:6]
+        epoch[n]    = doc['epoch_data']['epoch']
+    return {'elements': elements, 'rms': rms, 'epoch': epoch}
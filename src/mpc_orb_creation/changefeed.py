@@ -0,0 +1,286 @@
+"""
+mpc_orb_creation/changefeed.py
+ - Change feed of mpc_orb updates: for each (re-)written document, a record with an RFC 6902 JSON patch against the
+   previous version, so that downstream mirrors can apply deltas rather than re-downloading whole documents
+ - diff(old, new) -> patch & apply(doc, patch) -> new document
+   (diff emits add / remove / replace; apply supports all of the RFC 6902 operations)
+ - ChangeFeed: an append-only local JSONL file of change records, with a version counter per designation
+   {"seq": 17, "unpacked": "2005 SG8D", "version": 3, "base_hash": ..., "hash": ..., "patch": [...], "written_at": ...}
+   * seq      : position in the feed (consumers resume from the last seq they have seen)
+   * version  : 1 for the first record of a designation, then +1 per record
+   * base_hash / hash : io.content_hash of the document before / after the patch (base_hash is None for a first version)
+ - Records are written by backends.OrbfitResultsBackend.write_mpc_orb_dict(..., change_feed=feed)
+   (& hence by utility_popn.populate_orbfit_results & pipeline.run_pipeline), or by construct.update(..., change_feed=feed)
+ - NB: A feed file must only have a single writer (the versions & seq are kept in memory, after an initial scan of the file)
+"""
+
+# Standard imports
+# -----------------------
+import copy
+import json
+import os
+
+# local imports
+# -----------------------
+from mpc_orb_creation import io
+
+
+# -------------------------------------------------------------------
+# JSON pointers (RFC 6901)
+# -------------------------------------------------------------------
+
+def _escape(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+def _tokens(pointer):
+    ''' JSON pointer -> list of (unescaped) reference tokens ('' -> [], i.e. the whole document) '''
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise Exception(f"Invalid JSON pointer: {pointer!r}")
+    return [ _.replace('~1', '/').replace('~0', '~') for _ in pointer[1:].split('/') ]
+
+def _index(container, token, allow_end=False):
+    ''' List index from a reference token ('-' is the end of the list, for add) '''
+    if allow_end and token == '-':
+        return len(container)
+    if not token.isdigit() or (token != '0' and token.startswith('0')):
+        raise Exception(f"Invalid list index: {token!r}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise Exception(f"List index out of range: {index}")
+    return index
+
+def _resolve(doc, tokens):
+    ''' The value at a (tokenised) pointer '''
+    for token in tokens:
+        if isinstance(doc, dict):
+            if token not in doc:
+                raise Exception(f"Missing key: {token!r}")
+            doc = doc[token]
+        elif isinstance(doc, list):
+            doc = doc[_index(doc, token)]
+        else:
+            raise Exception(f"Cannot reference {token!r} in a {type(doc).__name__}")
+    return doc
+
+
+# -------------------------------------------------------------------
+# Diff & apply (RFC 6902)
+# -------------------------------------------------------------------
+
+def _equal(a, b):
+    ''' JSON equality: unlike ==, 1, 1.0 & True are distinct, & nan equals nan '''
+    if a is b:
+        return True
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all( _equal(a[k], b[k]) for k in a )
+    if isinstance(a, list):
+        return len(a) == len(b) and all( _equal(x, y) for x, y in zip(a, b) )
+    if isinstance(a, float) and a != a:
+        return b != b
+    return a == b
+
+def diff(old, new, path=''):
+    '''
+    RFC 6902 patch that transforms old into new
+     - dicts are compared key by key, & lists of equal length element by element
+       (lists whose length changes, & values whose type changes, are replaced as a whole)
+
+    returns:
+    --------
+    list of operations (dicts), [] if old & new are equal
+    '''
+    if _equal(old, new):
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = [ {'op': 'remove', 'path': path + '/' + _escape(k)} for k in old if k not in new ]
+        for k, v in new.items():
+            if k not in old:
+                ops.append( {'op': 'add', 'path': path + '/' + _escape(k), 'value': v} )
+            else:
+                ops += diff(old[k], v, path + '/' + _escape(k))
+        return ops
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        return [ op for i, (x, y) in enumerate(zip(old, new)) for op in diff(x, y, f'{path}/{i}') ]
+    return [ {'op': 'replace', 'path': path, 'value': new} ]
+
+def _apply_op(doc, op):
+    ''' Apply a single operation (in place, where possible): returns the (new) document '''
+    name   = op.get('op')
+    tokens = _tokens(op['path'])
+
+    if name == 'test':
+        if not _equal( _resolve(doc, tokens), op['value'] ):
+            raise Exception(f"Test failed at {op['path']!r}")
+        return doc
+    if name in ('move', 'copy'):
+        source = _tokens(op['from'])
+        if name == 'move' and tokens[:len(source)] == source and len(tokens) > len(source):
+            raise Exception(f"Cannot move {op['from']!r} into one of its children")
+        value = copy.deepcopy( _resolve(doc, source) )
+        if name == 'move':
+            doc = _apply_op(doc, {'op': 'remove', 'path': op['from']})
+        return _apply_op(doc, {'op': 'add', 'path': op['path'], 'value': value})
+    if name not in ('add', 'remove', 'replace'):
+        raise Exception(f"Unknown patch operation: {name!r}")
+
+    if not tokens:
+        if name == 'remove':
+            raise Exception("Cannot remove the whole document")
+        return copy.deepcopy(op['value'])
+
+    parent, token = _resolve(doc, tokens[:-1]), tokens[-1]
+    if isinstance(parent, dict):
+        if name != 'add' and token not in parent:
+            raise Exception(f"Missing key: {token!r}")
+        if name == 'remove':
+            del parent[token]
+        else:
+            parent[token] = copy.deepcopy(op['value'])
+    elif isinstance(parent, list):
+        index = _index(parent, token, allow_end=(name == 'add'))
+        if name == 'add':
+            parent.insert(index, copy.deepcopy(op['value']))
+        elif name == 'remove':
+            del parent[index]
+        else:
+            parent[index] = copy.deepcopy(op['value'])
+    else:
+        raise Exception(f"Cannot reference {token!r} in a {type(parent).__name__}")
+    return doc
+
+def apply(doc, patch):
+    '''
+    Apply an RFC 6902 patch
+
+    returns:
+    --------
+    the patched document (a new object: doc is not modified)
+    '''
+    doc = copy.deepcopy(doc)
+    for op in patch:
+        doc = _apply_op(doc, op)
+    return doc
+
+
+# -------------------------------------------------------------------
+# Change feed
+# -------------------------------------------------------------------
+
+def apply_record(doc, record, verify=True):
+    '''
+    Apply a change record to the previous version of a document (None for the first version)
+     - if verify, the content hashes of the document before & after the patch are checked against the record
+    '''
+    if verify and (io.content_hash(doc) if doc is not None else None) != record['base_hash']:
+        raise Exception(f"Change record {record['seq']} ({record['unpacked']} v{record['version']}) does not apply to this version of the document")
+    doc = apply(doc, record['patch'])
+    if verify and io.content_hash(doc) != record['hash']:
+        raise Exception(f"Change record {record['seq']} ({record['unpacked']} v{record['version']}) did not reproduce the expected document")
+    return doc
+
+
+class ChangeFeed():
+    '''
+    Append-only JSONL file of change records (see the module docstring)
+    E.g.
+    >>> feed = ChangeFeed('mpc_orb_changes.jsonl')
+    >>> backend.write_mpc_orb_dict(unpacked, updated_at, mpc_orb_dict, change_feed=feed)     # <<-- writer
+    >>> for record in feed.records(since=last_seq):                                         # <<-- consumer
+    ...     docs[record['unpacked']] = apply_record(docs.get(record['unpacked']), record)
+
+    inputs:
+    -------
+    path: str
+    fsync: bool
+     - if True, each record is flushed to disk (os.fsync) before append returns
+    '''
+
+    def __init__(self, path, fsync=False):
+        self.path     = path
+        self.fsync    = fsync
+        self._seq     = None
+        self._versions = None
+
+    def _scan(self):
+        ''' The last seq & the current version of each designation, from the records already in the file '''
+        if self._versions is None:
+            self._seq, self._versions = 0, {}
+            for record in self.records():
+                self._seq = record['seq']
+                self._versions[record['unpacked']] = record['version']
+
+    def version(self, unpacked):
+        ''' Current version of a designation (0 if there are no records for it) '''
+        self._scan()
+        return self._versions.get(unpacked, 0)
+
+    def versions(self):
+        ''' dict of designation -> current version '''
+        self._scan()
+        return dict(self._versions)
+
+    def __len__(self):
+        self._scan()
+        return self._seq
+
+    def append(self, unpacked, old, new, written_at=None):
+        '''
+        Append the change from old to new (the previous & the new mpc_orb dicts, old=None if there was none)
+         - written_at: datetime, optional (defaults to the current time; recorded in UTC, see io.timestamp_str)
+
+        returns:
+        --------
+        the record (None if old & new are identical, in which case nothing is appended)
+        '''
+        self._scan()
+        patch = diff(old, new) if old is not None else [ {'op': 'add', 'path': '', 'value': new} ]
+        if not patch:
+            return None
+
+        record = {
+            'seq'        : self._seq + 1,
+            'unpacked'   : unpacked,
+            'version'    : self._versions.get(unpacked, 0) + 1,
+            'base_hash'  : io.content_hash(old) if old is not None else None,
+            'hash'       : io.content_hash(new),
+            'patch'      : patch,
+            'written_at' : io.timestamp_str(written_at),
+        }
+        with open(self.path, 'a') as fh:
+            fh.write( json.dumps(record, separators=(',', ':')) + '\n' )
+            if self.fsync:
+                fh.flush()
+                os.fsync(fh.fileno())
+
+        self._seq = record['seq']
+        self._versions[unpacked] = record['version']
+        return record
+
+    def records(self, since=0, unpacked=None):
+        '''
+        The records with seq > since (optionally only those of a single designation), in order
+
+        returns:
+        --------
+        generator of dicts
+        '''
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as fh:
+            for line in fh:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record['seq'] > since and (unpacked is None or record['unpacked'] == unpacked):
+                    yield record
+
+    def replay(self, unpacked, verify=True):
+        ''' The current document of a designation, rebuilt from its records (None if there are none) '''
+        doc = None
+        for record in self.records(unpacked=unpacked):
+            doc = apply_record(doc, record, verify=verify)
+        return doc
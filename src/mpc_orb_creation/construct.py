@@ -15,25 +15,24 @@ Many contained functions: MPan
 # -----------------------
 import copy
 import json
+import math
 import sys, os
-import requests 
 from datetime import datetime
 
+# local imports
+# -----------------------
+from .  import lazy
+
 # Public-MPC Import!!!
 # -----------------------
-import mpc_orb
+# NB: These (and the MPC modules below) are only imported on first use (see lazy.py)
+mpc_orb = lazy.LazyModule('mpc_orb')
 
 # MPC module imports
 # -----------------------
-from designation_identifier import identifier
-from db_client import DatabaseClient
-try:
-    sys.path.append('/sa/python_libs')
-    import orbfit_to_dict as o2d
-    import mpc_astro as ma
-
-except:
-    raise Exception("This conversion routine is intended for internal MPC usage and requires modules that are likely to only be available on internal MPC machines")
+# NB: These conversion routines are intended for internal MPC usage and require modules that are likely to only be available on internal MPC machines
+o2d = lazy.LazyModule('orbfit_to_dict', path='/sa/python_libs')
+ma  = lazy.LazyModule('mpc_astro', path='/sa/python_libs')
 
 
 
@@ -42,12 +41,22 @@ except:
 from .  import interpret
 #from .schema import validate_orbfit_standardized , validate_mpcorb # , validate_orbfit_conversion , validate_orbfit_construction
 from .  import template
+from .  import backends
+from .  import nongrav
+
+# NB: numpy-based local modules are also only imported on first use (keeps the import of construct cheap)
+covariance  = lazy.LazyModule('mpc_orb_creation.covariance', message="Could not import local module")
+transform   = lazy.LazyModule('mpc_orb_creation.transform', message="Could not import local module")
+quality     = lazy.LazyModule('mpc_orb_creation.quality', message="Could not import local module")
+moid        = lazy.LazyModule('mpc_orb_creation.moid', message="Could not import local module")
+residuals   = lazy.LazyModule('mpc_orb_creation.residuals', message="Could not import local module")
+orbit_class = lazy.LazyModule('mpc_orb_creation.orbit_class', message="Could not import local module")
 
 # -------------------------------------------------------------------
 # Main code to run conversion/construction from orbfit-to-mpc_orb
 # -------------------------------------------------------------------
 
-def construct(eq0dict,eq1dict,rwodict,moidsdict,otherdict , output_filepath = None , VERBOSE=True):
+def construct(eq0dict,eq1dict,rwodict,moidsdict,otherdict , output_filepath = None , VERBOSE=True, designation_backend=None, dead_letter=None, unpacked=None, clock=None, qa_report=None):
     """
     Convert direct-output orbfit elements dictionary to standard format for external consumption
     
@@ -61,15 +70,29 @@ def construct(eq0dict,eq1dict,rwodict,moidsdict,otherdict , output_filepath = No
     --------
     standard_format_dict
      - mpc_orb.json compatible
+     - an empty dict is returned if construction fails
     
     optionally:
     -----------
     if an output filepath is supplied, then the output-dictionary will also be saved to file
+    designation_backend: backends.DesignationBackend
+     - service used to cross-identify designations (defaults to the postgres designation-identifier)
+    dead_letter: deadletter.DeadLetterQueue (or anything with the same *record* method)
+     - if supplied, failures are recorded (stage, exception & hash of the inputs) against "unpacked"
+    unpacked: str
+     - designation used to record failures (defaults to the orbfit name in the rwodict)
+    clock: function, datetime or str
+     - source of the mpcorb_creation_datetime (defaults to the current time; see *creation_datetime*)
+     - supplying a fixed time makes construction deterministic (identical inputs => identical output)
+    qa_report: dict
+     - if supplied, it is filled with the QA results that are not part of the mpc_orb schema: the 'bad_trk' &
+       'bad_trk_list_ids', & the 'covariance_checks_failed' (problems are also printed if VERBOSE)
     
     """
     if VERBOSE: 
       print(f"Running {__file__}.construct(...)", flush=True)
 
+    stage = 'template'
     try :
         
         # Get the template dict/json
@@ -81,12 +104,16 @@ def construct(eq0dict,eq1dict,rwodict,moidsdict,otherdict , output_filepath = No
  
         # Populate the template from the orbfit_input
         # - This is the heart of the routine
-        try:
-          mpcorb_populated = populate(eq0dict,eq1dict,rwodict,moidsdict,otherdict , mpcorb_template)
-        except Exception as e : 
-          print(f'Exception in *populate*: \n {e}')
+        stage = 'populate'
+        qa_report = qa_report if qa_report is not None else {}
+        mpcorb_populated = populate(eq0dict,eq1dict,rwodict,moidsdict,otherdict , mpcorb_template, designation_backend=designation_backend, clock=clock, qa_report=qa_report)
+        if VERBOSE and qa_report.get('bad_trk'):
+          print(f"Bad tracklets: {qa_report['bad_trk_list_ids']}", flush=True)
+        if VERBOSE and qa_report.get('covariance_checks_failed'):
+          print(f"Failed covariance checks: {qa_report['covariance_checks_failed']}", flush=True)
         
         # Check the result is valid and return
+        stage = 'validate'
         assert mpc_orb.validate_mpcorb.validate_mpcorb(mpcorb_populated) 
 
         if VERBOSE:
@@ -94,14 +121,21 @@ def construct(eq0dict,eq1dict,rwodict,moidsdict,otherdict , output_filepath = No
         return mpcorb_populated 
  
     except Exception as e :
-        print('Exception in ', __file__, '\n', e)
+        print(f'Exception in *{stage}*', __file__, '\n', e)
+        if dead_letter is not None:
+          if unpacked is None:
+            try:
+              unpacked = str(rwodict["optical_list"][0]["name"])
+            except Exception:
+              unpacked = ''
+          dead_letter.record(unpacked, stage, e, inputs=[eq0dict,eq1dict,rwodict,moidsdict,otherdict])
         return {}
         
 
 # -------------------------------------------------------------------
 # Function to populate mpcorb_dict from orbfit_dict(s)
 # -------------------------------------------------------------------
-def populate(eq0dict,eq1dict,rwodict,moidsdict,otherdict , mpcorb_template):
+def populate(eq0dict,eq1dict,rwodict,moidsdict,otherdict , mpcorb_template, designation_backend=None, clock=None, qa_report=None):
     """
     Function to populate mpcorb_dict from orbfit_dict(s)
     Replaces *std_format_els* function
@@ -133,6 +167,15 @@ def populate(eq0dict,eq1dict,rwodict,moidsdict,otherdict , mpcorb_template):
             'epoch_data'
             'moid_data'
             'categorization'
+
+    designation_backend: backends.DesignationBackend
+        - service used to cross-identify designations (defaults to the postgres designation-identifier)
+
+    clock: function, datetime or str
+        - source of the mpcorb_creation_datetime (see *creation_datetime*)
+
+    qa_report: dict
+        - if supplied, the QA results that are not part of the mpc_orb schema are added to it (see *construct*)
     
     returns:
     --------
@@ -147,23 +190,27 @@ def populate(eq0dict,eq1dict,rwodict,moidsdict,otherdict , mpcorb_template):
     moidsdict= to_nums(moidsdict)
     otherdict= to_nums(otherdict)
 
+    # If orbfit only supplied one of the CAR & COM representations, compute the other
+    eq1dict = transform.fill_missing_coordtype(eq1dict)
+
+    # NB: The steps below (and their inputs & sections) are listed in POPULATE_STEPS (used by *update*)
 
     # Populate best-fit orbit data (CAR & COM components)
     # - non-grav data is now populated within this call ...
     populate_CAR_COM( eq1dict, mpcorb_populated)
 
     # Populate software data
-    populate_software_data(otherdict, mpcorb_populated)
+    populate_software_data(otherdict, mpcorb_populated, clock=clock)
 
     # Populate system data
     populate_system_data(otherdict, mpcorb_populated)
 
     # Populate designation_data
     # - categorization:object_type also done here
-    populate_designation_data(rwodict, mpcorb_populated)
+    populate_designation_data(rwodict, mpcorb_populated, designation_backend=designation_backend)
 
     # Populate orbit_fit_statistics
-    populate_orbit_fit_statistics(eq0dict,eq1dict,rwodict,otherdict, mpcorb_populated)
+    populate_orbit_fit_statistics(eq0dict,eq1dict,rwodict,otherdict, mpcorb_populated, qa_report=qa_report)
 
     # Populate magnitude_data
     populate_magnitude_data(eq1dict , mpcorb_populated)
@@ -179,6 +226,167 @@ def populate(eq0dict,eq1dict,rwodict,moidsdict,otherdict , mpcorb_template):
 
     return mpcorb_populated
 
+# -------------------------------------------------------------------
+# Section-level (incremental) update of an existing mpcorb_dict
+# -------------------------------------------------------------------
+
+# The steps of *populate*, in order: for each step ...
+#  - the inputs it requires
+#  - the sections it fills entirely (these are reset to the template before the step is re-run)
+#  - the sections it only partly fills (these are kept & updated in place)
+POPULATE_STEPS = {
+    'CAR_COM'              : ( ['eq1dict'],                                   ['CAR','COM','non_grav_booleans'], [] ),
+    'software_data'        : ( ['otherdict'],                                 ['software_data'],                 [] ),
+    'system_data'          : ( ['otherdict'],                                 ['system_data'],                   [] ),
+    'designation_data'     : ( ['rwodict'],                                   ['designation_data'],              ['categorization'] ),
+    'orbit_fit_statistics' : ( ['eq0dict','eq1dict','rwodict','otherdict'],   ['orbit_fit_statistics'],          [] ),
+    'magnitude_data'       : ( ['eq1dict'],                                   ['magnitude_data'],                [] ),
+    'epoch_data'           : ( ['eq1dict'],                                   ['epoch_data'],                    [] ),
+    'moid_data'            : ( ['moidsdict','eq1dict'],                       ['moid_data'],                     [] ),
+    'categorization'       : ( ['eq1dict'],                                   [],                                ['categorization'] ),
+}
+
+# Inputs that trigger a step, but that it does not require
+# - moid_data: without (new) external MOIDs, the MOIDs are computed from the (new) COM elements, so a new orbit (eq1dict)
+#   also re-computes them
+OPTIONAL_STEP_INPUTS = {
+    'moid_data'            : ['moidsdict','eq1dict'],
+}
+
+def steps_for_inputs(changed_inputs):
+    ''' The steps of *populate* (in order) that depend on any of the changed inputs, & that can be run with them
+        - NB: Steps that also require inputs that were not supplied are left out (e.g. a new rwodict alone only re-runs
+              designation_data, as orbit_fit_statistics also needs the eq0dict, eq1dict & otherdict)
+    '''
+    return [step for step, (required, _, __) in POPULATE_STEPS.items()
+            if set(required) & set(changed_inputs)
+            and all( _ in changed_inputs or _ in OPTIONAL_STEP_INPUTS.get(step, []) for _ in required )]
+
+def _run_populate_step(step, inputs, mpcorb_populated, designation_backend=None, clock=None, qa_report=None):
+    ''' Run a single step of *populate* '''
+    if step == 'CAR_COM':
+        populate_CAR_COM( inputs['eq1dict'], mpcorb_populated)
+    elif step == 'software_data':
+        populate_software_data(inputs['otherdict'], mpcorb_populated, clock=clock)
+    elif step == 'system_data':
+        populate_system_data(inputs['otherdict'], mpcorb_populated)
+    elif step == 'designation_data':
+        populate_designation_data(inputs['rwodict'], mpcorb_populated, designation_backend=designation_backend)
+    elif step == 'orbit_fit_statistics':
+        populate_orbit_fit_statistics(inputs['eq0dict'],inputs['eq1dict'],inputs['rwodict'],inputs['otherdict'], mpcorb_populated, qa_report=qa_report)
+    elif step == 'magnitude_data':
+        populate_magnitude_data(inputs['eq1dict'] , mpcorb_populated)
+    elif step == 'epoch_data':
+        populate_epoch_data(inputs['eq1dict'] , mpcorb_populated)
+    elif step == 'moid_data':
+        populate_moid_data(inputs.get('moidsdict', {}), mpcorb_populated  )
+    elif step == 'categorization':
+        populate_categorization(inputs.get('otherdict', {}), mpcorb_populated  )
+    else:
+        raise Exception(f"Unknown populate step: {step}")
+
+def update(existing_mpcorb, changed_inputs, steps=None, designation_backend=None, schema=None, validator=None, clock=None,
+           change_feed=None, unpacked=None, qa_report=None):
+    """
+    Update an existing mpcorb_dict, only recomputing the sections that depend on the changed inputs
+     - E.g. for new MOIDs: update(mpcorb_dict, {'moidsdict': moidsdict})
+     - NB: A new orbit (eq1dict) also re-computes the MOIDs (from the new COM elements), unless new external MOIDs are supplied
+     - E.g. for a new designation cross-identification: update(mpcorb_dict, {'rwodict': rwodict})
+
+    inputs:
+    -------
+    existing_mpcorb: dict
+     - a previously constructed (valid) mpcorb_dict (this is not modified)
+    changed_inputs: dict
+     - any of 'eq0dict','eq1dict','rwodict','moidsdict','otherdict'
+    steps: list of str, optional
+     - the steps (see POPULATE_STEPS) to re-run (defaults to those that depend on the changed inputs & whose required
+       inputs are all supplied, see *steps_for_inputs*)
+     - an exception is raised if a (requested) step requires an input that is not supplied
+    schema: dict, optional
+     - the mpc_orb schema: if supplied, only the updated sections are validated (against their sub-schemas)
+    validator: function, optional
+     - validator(mpcorb_dict, sections) (defaults to *validate_sections*)
+    clock: function, datetime or str
+     - source of the mpcorb_creation_datetime, if software_data is recomputed (see *creation_datetime*)
+    change_feed: changefeed.ChangeFeed, optional
+     - if supplied, a change record (JSON patch from existing_mpcorb) is appended for the designation *unpacked*
+       (NB: not needed if the updated dict is written via backends ... write_mpc_orb_dict(..., change_feed=change_feed))
+    unpacked: str, optional
+     - the unpacked designation (required if change_feed is supplied)
+    qa_report: dict, optional
+     - filled with the QA results that are not part of the mpc_orb schema, if orbit_fit_statistics is recomputed (see *construct*)
+
+    returns:
+    --------
+    updated mpcorb_dict
+     - NB: sections that are not recomputed are shared with existing_mpcorb (not copied)
+    """
+    unknown = set(changed_inputs) - {'eq0dict','eq1dict','rwodict','moidsdict','otherdict'}
+    if unknown:
+        raise Exception(f"Unexpected inputs: {sorted(unknown)}")
+    if change_feed is not None and unpacked is None:
+        raise Exception("A change_feed requires the unpacked designation (unpacked=...)")
+
+    # Which steps need to be re-run, and are all of the inputs they need available?
+    if steps is None:
+        steps = steps_for_inputs(changed_inputs)
+    steps = [step for step in POPULATE_STEPS if step in steps]
+    for step in steps:
+        missing = [_ for _ in POPULATE_STEPS[step][0] if _ not in changed_inputs and _ not in OPTIONAL_STEP_INPUTS.get(step, [])]
+        if missing:
+            raise Exception(f"Cannot update *{step}* without the input(s) {missing}")
+
+    # Only the changed inputs are converted
+    inputs = {k: to_nums(v) for k, v in changed_inputs.items()}
+    if 'eq1dict' in inputs:
+        inputs['eq1dict'] = transform.fill_missing_coordtype(inputs['eq1dict'])
+
+    # Shallow copy of the document: only the sections being recomputed are replaced
+    mpcorb_updated = copy.copy(existing_mpcorb)
+    reset_sections = [_ for step in steps for _ in POPULATE_STEPS[step][1]]
+    kept_sections  = [_ for step in steps for _ in POPULATE_STEPS[step][2] if _ not in reset_sections]
+    if reset_sections:
+        mpcorb_template = template.get_template_json()
+        for section in reset_sections:
+            mpcorb_updated[section] = mpcorb_template[section]
+    for section in kept_sections:
+        mpcorb_updated[section] = copy.deepcopy(existing_mpcorb[section])
+
+    for step in steps:
+        _run_populate_step(step, inputs, mpcorb_updated, designation_backend=designation_backend, clock=clock, qa_report=qa_report)
+
+    # Re-validate
+    sections = list(dict.fromkeys(reset_sections + kept_sections))
+    if validator is None:
+        validate_sections(mpcorb_updated, sections, schema=schema)
+    else:
+        validator(mpcorb_updated, sections)
+
+    if change_feed is not None:
+        change_feed.append(unpacked, existing_mpcorb, mpcorb_updated)
+    return mpcorb_updated
+
+def validate_sections(mpcorb_dict, sections, schema=None):
+    """
+    Validate the named sections of an mpcorb_dict
+     - If the mpc_orb schema is supplied, each section is validated against its sub-schema (requires jsonschema)
+     - Otherwise, the whole document is validated using mpc_orb
+    """
+    if schema is None:
+        assert mpc_orb.validate_mpcorb.validate_mpcorb(mpcorb_dict)
+        return True
+
+    import jsonschema
+    for section in sections:
+        subschema = dict(schema['properties'][section])
+        for key in ['definitions', '$defs']:
+            if key in schema:
+                subschema[key] = schema[key]
+        jsonschema.validate(instance=mpcorb_dict[section], schema=subschema)
+    return True
+
+
 # ------------------------------------
 # Sub-Funcs to populate main sections
 # of the mpcorb json
@@ -202,15 +410,18 @@ def populate_CAR_COM( eq1dict, mpcorb_populated):
 
             # check that covariances are numbered correctly, and place into covariance sub-dictionary
             # (a) we expect to see numbering from cov00 ...
-            if 'cov00' in eq1dict[coordtype].keys():
-                covariance = {}
-                cov_keys = [key for key in eq1dict[coordtype].keys() if key[:3]=='cov' and key[3:].isnumeric()]
-                for key in cov_keys:
-                    mpcorb_populated[coordtype]["covariance"][key] = eq1dict[coordtype][key]
-            
+            # - the packed (upper-triangular) form extracts & writes all of the covIJ keys in one go
             # (b) older versions have different numbering (see cov10 in *std_format_els*)
-            # - *** Not dealing with that for now ***
-            
+            # - these are converted to the covIJ numbering by PackedCovariance.from_dict (which uses the "numparams" of the dict)
+            # (c) incomplete covariances are copied as they are (& flagged by *covariance_checks*)
+            if 'cov00' in eq1dict[coordtype].keys():
+                try:
+                    packed_cov = covariance.PackedCovariance.from_dict(eq1dict[coordtype])
+                    mpcorb_populated[coordtype]["covariance"].update( packed_cov.to_dict() )
+                except Exception:
+                    for key in [key for key in eq1dict[coordtype].keys() if key[:3]=='cov' and key[3:].isnumeric()]:
+                        mpcorb_populated[coordtype]["covariance"][key] = eq1dict[coordtype][key]
+
 
             # populate the coefficient_names & coefficient_values for the elements 
             populate_els(mpcorb_populated[coordtype], eq1dict[coordtype] , coordtype)
@@ -224,6 +435,44 @@ def populate_CAR_COM( eq1dict, mpcorb_populated):
     # populate non-grav components 
     populate_nongravs(mpcorb_populated , eq1dict) 
 
+def check_covariance(orbfit_component_dict, coordtype):
+    '''
+    The checks that a covariance matrix fails: 'complete' (all numparams x numparams entries are present),
+    & those of covariance.check_stack (finite, symmetric & positive-definite, & consistent with the reported eigval / rms)
+     - NB: the checks are run for N=1 objects here (see covariance.check_stack for the batched version)
+
+    returns:
+    --------
+    list of str, e.g. ["COM:rms_consistent"] ([] if the covariance passes all of the checks)
+    '''
+    try:
+        packed_cov = covariance.PackedCovariance.from_dict(orbfit_component_dict)
+    except Exception:
+        return [f"{coordtype}:complete"]
+
+    eigval, rms = orbfit_component_dict.get("eigval"), orbfit_component_dict.get("rms")
+    checks = covariance.check_stack( [packed_cov.to_array()],
+                                     eigval = [eigval] if eigval else None,
+                                     rms    = [rms] if rms else None,
+                                     eigval_scale = transform.eigval_scale(coordtype, packed_cov.numparams) )
+    return [f"{coordtype}:{_}" for _ in covariance.failed_checks(checks, 0)]
+
+def covariance_checks(eq1dict):
+    '''
+    The checks that the CAR & COM covariances fail (see *check_covariance*)
+     - NB: A failed check does not stop the document being built, & is not written into it (the mpc_orb schema has no
+       field for it): it is reported in the qa_report of *construct* instead
+
+    returns:
+    --------
+    list of str (e.g. ["CAR:rms_consistent"])
+    '''
+    failed = []
+    for coordtype in ["CAR","COM"]:
+        if coordtype in eq1dict.keys() and eq1dict[coordtype] and 'cov00' in eq1dict[coordtype].keys():
+            failed += check_covariance(eq1dict[coordtype], coordtype)
+    return failed
+
 def populate_els(mpcorb_element_dict, orbfit_component_dict , coordtype):
     """
     Rename elements to be human-readable
@@ -250,6 +499,8 @@ def populate_els(mpcorb_element_dict, orbfit_component_dict , coordtype):
 def populate_nongravs( mpcorb_populated , eq1dict ):
     """
     Function to populate nongrav data in the appropriate sections of the mpcorb_populated dict
+     - The non-grav model is resolved with a single lookup in the registry in nongrav.py
+       (the default/template is correct for standard integrations which lack non-gravs)
     """
     # Loop over the "coordtype" dictionaries that are required to be present
     for coordtype in ['CAR','COM']:
@@ -259,107 +510,27 @@ def populate_nongravs( mpcorb_populated , eq1dict ):
             # try to instantiate an empty dict ... MJP-2023:01:25
             mpcorb_populated[coordtype]['non_grav_uncertainty'] = {} 
         
-            # Do we have any non-gravs ?
-            if d["numparams"] == 6 and d["nongrav_model"] == 0:
-                mpcorb_populated["non_grav_booleans"]["non_gravs"] = False
-            elif d["numparams"] > 6 and d["nongrav_model"] > 0:
-                mpcorb_populated["non_grav_booleans"]["non_gravs"] = True
-            else:
-                raise Exception("Unexpected combination of nongrav parameters...")
+            # Do we have any non-gravs ? (raises an exception for an unregistered combination)
+            model = nongrav.lookup(d)
+            mpcorb_populated["non_grav_booleans"]["non_gravs"] = model is not None
 
             # If we have non-gravs, then change various parameters
             #   in the default-dict, according to the values in the input dict
-            #
-            # Example non-grav params from Margaret's json ...
-            #
-            #"numparams": "7",        <<-- Total number of variational parameters
-            #                               ( 6 for the state, plus 0-4 for the non-gravs)
-            #"nongrav_model": "1",    <<--  1 => Asteroidal or Cometary:Marsden,
-            #                               2=> Cometary: YC,
-            #                               3=> Cometary: Yabushita
-            #"nongrav_params": "2",   <<-- Maximum number of non-grav params allowed in this model
-            #"nongrav_type": ["2"],   <<-- List of the coefficients that are used
-            #"nongrav_vals": [
-            #    "0.00000000000000E+00",
-            #    "-2.84420523316711E-03"
-            #],
-            #
-            # We only need to do any work if there are non-gravs
-            # (the default/template is correct for standard integrations which lack non-gravs)
-            if mpcorb_populated["non_grav_booleans"]["non_gravs"]:
-                
-                # Asteroidal ...
-                if   d["nongrav_model"] == 1 and d["nongrav_params"] == 2:
-                
-                    # Solar Radn Pressure
-                    if  1 in d["nongrav_type"] and d["numparams"] in [7,8]:
-                        mpcorb_populated['non_grav_booleans']['non_grav_model']['srp']   = True
-                        mpcorb_populated['non_grav_booleans']['non_grav_coefficients']['srp']   = True
-
-                        mpcorb_populated[coordtype]['coefficient_names']  += ['srp']
-                        mpcorb_populated[coordtype]['coefficient_values'] += [d["nongrav_vals"][0]]
-                        #mpcorb_populated[coordtype]['non_grav_uncertainty']['srp_coeff']    = d["rms"][6] 
-
-                    # Yarkovski
-                    if 2 in d["nongrav_type"] and d["numparams"] in [7,8]:
-                        mpcorb_populated['non_grav_booleans']['non_grav_model']['yarkovski'] = True
-                        mpcorb_populated['non_grav_booleans']['non_grav_coefficients']['yarkovski'] = True
-
-                        mpcorb_populated[coordtype]['coefficient_names']  += ['yarkovski']
-                        mpcorb_populated[coordtype]['coefficient_values'] += [d["nongrav_vals"][1]]
-                        #mpcorb_populated[coordtype]['non_grav_uncertainty']['yarkovski_coeff'] = d["rms"][6] if d["numparams"] == 7 else d["rms"][7]
-
-                    # Error
-                    if d["numparams"] not in [7,8] or d["nongrav_type"] not in [[1],[2],[1,2]]:
-                        print(f'd["numparams"]={d["numparams"]} , d["nongrav_type"]={d["nongrav_type"]}')
-                        raise Exception
-
-                # Cometary ...
-                elif   d["nongrav_model"] in [1,2,3]  and d["nongrav_params"] in [3,4]:
-                    
-                    # Marsden
-                    if d["nongrav_model"] == 1:
-                        mpcorb_populated['non_grav_booleans']['non_grav_model']['marsden'] = True
-
-                    # Yeomans and Chodas
-                    elif d["nongrav_model"] == 2:
-                        mpcorb_populated['non_grav_booleans']['non_grav_model']['yc'] = True
-
-                    # Yabushita
-                    elif d["nongrav_model"] == 3:
-                        mpcorb_populated['non_grav_booleans']['non_grav_model']['yabushita'] = True
-
-                    # Error
-                    else:
-                        raise Exception
-                        
-                    
-                    # Parameters
-                    orbfit_signatures_to_mpcorb_names =  {
-                        [1,2]       : ["A1","A2"],
-                        [1,2,3]     : ["A1","A2","A3"],
-                        [1,2,3,4]   : ["A1","A2","A3","DT"] }
-                    assert d["nongrav_type"] in orbfit_signatures_to_mpcorb_names
-                    for k,v in orbfit_signatures_to_mpcorb_names.items() :
-                        if k in d["nongrav_type"]:
-                            for i,orbfit_sig in enumerate(k):
-                                # Extract the desired names
-                                # bool_name = v[i]
-                                coeff_name= v[i] # +'_coeff'
-                                # Set bool
-                                mpcorb_populated	['non_grav_booleans']["non_grav_coefficients"][coeff_name] = True
-                                # Set coeff
-                                mpcorb_populated[coordtype]['coefficient_names']  += [coeff_name]
-                                mpcorb_populated[coordtype]['coefficient_values'] += [d["nongrav_vals"][i]]
-                                #mpcorb_populated[coordtype]['non_grav_uncertainty'][coeff_name] = d["rms"][6 + i]
-                # Error
-                else:
-                    raise Exception
+            if model is not None:
+                for flag in model.model_flags:
+                    mpcorb_populated['non_grav_booleans']['non_grav_model'][flag] = True
+                for coeff_name in model.coefficient_names:
+                    mpcorb_populated['non_grav_booleans']['non_grav_coefficients'][coeff_name] = True
+
+                mpcorb_populated[coordtype]['coefficient_names']  += list(model.coefficient_names)
+                mpcorb_populated[coordtype]['coefficient_values'] += [d["nongrav_vals"][i] for i in model.value_indices]
+                mpcorb_populated[coordtype]['coefficient_uncertainties'] = \
+                    list(d["rms"][:6]) + [d["rms"][i] for i in model.uncertainty_indices]
 
     return True
     
     
-def populate_software_data(orbfit_other_dict, mpcorb_populated):
+def populate_software_data(orbfit_other_dict, mpcorb_populated, clock=None):
     '''
     # Populate software data
 
@@ -374,7 +545,19 @@ def populate_software_data(orbfit_other_dict, mpcorb_populated):
     '''
 
     mpcorb_populated["software_data"]["fitting_datetime"]         = orbfit_other_dict["orbfit_run_datetime"]
-    mpcorb_populated["software_data"]["mpcorb_creation_datetime"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S") 
+    mpcorb_populated["software_data"]["mpcorb_creation_datetime"] = creation_datetime(clock)
+
+def creation_datetime(clock=None):
+    '''
+    The mpcorb_creation_datetime string, "%Y-%m-%d %H:%M:%S"
+
+    clock: 
+     - None     : the current time
+     - function : called to get the time (a datetime or string)
+     - datetime or str : a fixed time (i.e. deterministic construction)
+    '''
+    now = clock() if callable(clock) else clock if clock is not None else datetime.now()
+    return now.strftime("%Y-%m-%d %H:%M:%S") if isinstance(now, datetime) else str(now)
 
 def populate_system_data(orbfit_other_dict, mpcorb_populated  ):
     '''
@@ -384,17 +567,19 @@ def populate_system_data(orbfit_other_dict, mpcorb_populated  ):
     
 
 
-def populate_designation_data( rwodict, mpcorb_populated):
+def populate_designation_data( rwodict, mpcorb_populated, designation_backend=None):
     '''
     # Populate designation_data & categorization data  
+
+    designation_backend: backends.DesignationBackend
+     - defaults to querying the designation-tables using Nora's designation-identifier service
     '''
     nominal_label = str(rwodict["optical_list"][0]["name"])
 
-    # Query the designation-tables using Nora's designation-identifier service
-    # NB: I don't like having to hardpaste all the connection details
-    # - I'd prefer to use some default connection func/class: https://github.com/Smithsonian/mpc-software/issues/28
-    with DatabaseClient.PostgresClient(host='localhost', port='5432', database='vmsops', user='postgres') as db:
-      result = identifier.get_ids( nominal_label, db, verbose=True, use_materialized_view=False)
+    # Query the designation-tables using Nora's designation-identifier service (or a stand-in)
+    if designation_backend is None:
+      designation_backend = backends.PostgresDesignationBackend()
+    result = designation_backend.get_ids( nominal_label )
     
     if result['status'] == 'Found':
       mpcorb_populated['designation_data'].update( result['results'] ) # N.B. We extract the inner dictionary of designations
@@ -422,37 +607,13 @@ def compute_and_populate_orbit_quality_metrics(eq0dict , mpcorb_populated):
     # Get RMS & then calc SNR
     '''
 
-    car_rms = [float(x) for x in eq0dict['CAR']['rms']]
-    car_els = [float(eq0dict['CAR'][x]) for x in ['element0','element1','element2','element3','element4','element5']]
-    car_sn = [abs(car_els[ind])/car_rms[ind] for ind in range(6)]
-    sig_to_noise_ratio = car_sn
-    if any([x<3 for x in car_sn]):
-        snr_below_3 = True
-        if any([x<1 for x in car_sn]):
-               snr_below_1 = True
-        else:
-            snr_below_1 = False
-    else:
-        snr_below_3 = False
-        snr_below_1 = False
+    # NB: the metrics are computed for N=1 objects here (see quality.rescore_catalogue for the catalogue-wide version)
+    car_rms = eq0dict['CAR']['rms'][:6]
+    car_els = [eq0dict['CAR'][x] for x in ['element0','element1','element2','element3','element4','element5']]
+    metrics = quality.orbit_quality_metrics([car_els], [car_rms])
 
     #Orbit quality metrics dictionary
-    mpcorb_populated['orbit_fit_statistics']['sig_to_noise_ratio'] = sig_to_noise_ratio
-    mpcorb_populated['orbit_fit_statistics']['snr_below_3'] = snr_below_3
-    mpcorb_populated['orbit_fit_statistics']['snr_below_1'] = snr_below_1
-
-    #SNR values to define the orbit quality
-    # good if   SNR>3
-    # poor if 1<SNR<3
-    # unreliable if SNR<1
-    if snr_below_1:
-        orbit_quality = 'unreliable'
-    elif snr_below_3:
-        orbit_quality = 'poor'
-    else:
-        orbit_quality = 'good'
-
-    mpcorb_populated['orbit_fit_statistics']['orbit_quality'] = orbit_quality
+    mpcorb_populated['orbit_fit_statistics'].update( quality.metrics_for_object(metrics, 0) )
 
 
 
@@ -506,11 +667,55 @@ def compute_and_populate_arc_lengths(rwodict , mpcorb_populated):
 
 
 
-def populate_orbit_fit_statistics(eq0dict,eq1dict,rwodict,otherdict, mpcorb_populated):
+def populate_residual_statistics(rwodict, mpcorb_populated):
+    ''' Normalized & not-normalized RMS of the (selected) astrometric residuals in the rwo observations
+        NB: If there are no usable residuals (the statistics are NaN), orbfit's rmsast is used for the normalized RMS,
+            & the not-normalized RMS is left at its template value
+    '''
+    stats = residuals.residual_statistics( residuals.optical_arrays(rwodict) )
+    mpcorb_populated['orbit_fit_statistics']['normalized_RMS'] = copy.deepcopy(rwodict['rmsast']) if math.isnan(stats['normalized_RMS']) else stats['normalized_RMS']
+    if not math.isnan(stats['not_normalized_RMS']):
+        mpcorb_populated['orbit_fit_statistics']['not_normalized_RMS'] = stats['not_normalized_RMS']
+    return stats
+
+def populate_quality_scores(eq1dict, otherdict, mpcorb_populated):
+    ''' U_param from the COM elements & covariance (see quality.py), & score1 & score2 from orbfit's quality output
+        (the "quality_dict" in the otherdict, e.g. the quality_json of orbfit_results: any U_param in it takes precedence)
+        NB: U_param is computed for N=1 objects here (see quality.uncertainty_catalogue for the catalogue-wide version)
+        NB: Undefined values are not written (the template's 0.0 is kept, as the schema types them as numbers): U_param
+            without a COM covariance or for an unbound orbit, & score1 & score2 without orbfit's quality output
+    '''
+    scores = None
+    if covariance.infer_numparams(eq1dict['COM']) >= 6:
+        com     = [eq1dict['COM'][x] for x in ['element0','element1','element2','element3','element4','element5']]
+        com_cov = covariance.PackedCovariance.from_dict(eq1dict['COM'], 6).to_array()
+        scores  = quality.uncertainty_parameter( [com], [com_cov] )
+    mpcorb_populated['orbit_fit_statistics'].update( quality.scores_for_object(scores, 0, quality_dict=otherdict.get('quality_dict')) )
+
+def identify_bad_tracklets(rwodict, otherdict):
+    ''' The bad tracklets of the rwo observations (see residuals.py for the criterion)
+        - The parameters are the "bad_trk_params" in the otherdict (or in its "bad_trk_dict"), defaulting to residuals.BAD_TRK_PARAMS
+        NB: The result is not written into the document (the mpc_orb schema has no field for it): it is reported in the
+            qa_report of *construct* instead
+
+    returns:
+    --------
+    dict: {'bad_trk': bool, 'bad_trk_list_ids': list of trkids}
+    '''
+    bad_trk_params   = otherdict.get('bad_trk_params') or (otherdict.get('bad_trk_dict') or {}).get('bad_trk_params')
+    bad_trk_list_ids = residuals.bad_tracklets( residuals.optical_arrays(rwodict), bad_trk_params=bad_trk_params )
+    return {'bad_trk': bool(bad_trk_list_ids), 'bad_trk_list_ids': bad_trk_list_ids}
+
+
+
+def populate_orbit_fit_statistics(eq0dict,eq1dict,rwodict,otherdict, mpcorb_populated, qa_report=None):
     '''
     # Populate orbit_fit_statistics
     Much of this taken from *define_fit_succ_from_dictionaries* in "create_output_dictionaries..." by FS 
 
+    qa_report: dict, optional
+     - the QA results that are not part of the mpc_orb schema are added to it ('bad_trk', 'bad_trk_list_ids' &
+       'covariance_checks_failed')
 
     '''
 
@@ -572,8 +777,8 @@ def populate_orbit_fit_statistics(eq0dict,eq1dict,rwodict,otherdict, mpcorb_popu
         get_and_populate_obs_number( rwodict ,mpcorb_populated )
 
         # Topline RMS 
-        mpcorb_populated['orbit_fit_statistics']['normalized_RMS']     = copy.deepcopy(rwodict['rmsast'])
-        mpcorb_populated['orbit_fit_statistics']['not_normalized_RMS'] = None ##<<-- ***NEEDS TO BE CORRECTED TO GET Non-Normalised RMS *** 
+        # - Populates 'normalized_RMS' & 'not_normalized_RMS' (see residuals.py for the definitions)
+        populate_residual_statistics(rwodict, mpcorb_populated)
 
         # Number of oppositions 
         mpcorb_populated['orbit_fit_statistics']['nopp']     = otherdict['nopp']
@@ -582,11 +787,20 @@ def populate_orbit_fit_statistics(eq0dict,eq1dict,rwodict,otherdict, mpcorb_popu
         compute_and_populate_arc_lengths(rwodict , mpcorb_populated)
 
         #Bad tracklet identification
-        # MJP: 2023-03: Turning this stuff off, as I assume it must have been calculated earlier if an MPC_ORB_JSON is being calculated
-        #               (i.e. I assume we only make the mpcorb.json if the orbit is good enough ...)
-        #if "bad_trk_dict" not in data_dict: data_dict["bad_trk_dict"] = {}
-        #data_dict["stats_dict"]['bad_trk'], data_dict['bad_trk_dict']['bad_trk_list_ids'], data_dict['bad_trk_dict']['bad_trk_list_obs80'] = identify_bad_tracklets(data_dict)
-        #data_dict['bad_trk_dict']['bad_trk_params'] = data_dict['otherdict']['badtrk_params']
+        # - Reported in the qa_report ('bad_trk' & 'bad_trk_list_ids'), not in the document
+        bad_trk = identify_bad_tracklets(rwodict, otherdict)
+        if qa_report is not None:
+            qa_report.update(bad_trk)
+
+        #Covariance checks
+        # - Reported in the qa_report, not in the document (the document is still built if any of the checks fail)
+        failed = covariance_checks(eq1dict)
+        if qa_report is not None:
+            qa_report['covariance_checks_failed'] = failed
+
+        #Uncertainty parameter & numbering scores
+        # - Populates 'U_param' (see quality.py for the definition), & 'score1' & 'score2' from orbfit's quality output (if supplied)
+        populate_quality_scores(eq1dict, otherdict, mpcorb_populated)
 
         #We change the definition of success if nobs_sel < nobs_tot/2
         if mpcorb_populated['orbit_fit_statistics']['nobs_total_sel'] < mpcorb_populated['orbit_fit_statistics']['nobs_total']/2:# and data_dict["stats_dict"]['bad_trk']:
@@ -631,7 +845,15 @@ def populate_moid_data(moidsdict, mpcorb_populated  ):
         "moid_units": "au"
     },
 
+    NB: If moidsdict is empty, the MOIDs are computed by moid.py (so the CAR_COM & epoch_data must already be populated)
     '''
+    # If no external MOIDs are supplied, compute them from the (already populated) COM elements
+    if not moidsdict and mpcorb_populated["COM"]["coefficient_values"][0] > 0:
+      moids = moid.compute_moids( [mpcorb_populated["COM"]["coefficient_values"][:5]],
+                                  epoch = mpcorb_populated["epoch_data"]["epoch"],
+                                  planets = [_ for _ in mpcorb_populated["moid_data"] if _ in moid.PLANET_ELEMENTS] )
+      moidsdict = {k: float(v[0]) for k,v in moids.items()}
+
     for key,value in moidsdict.items():
       if key in mpcorb_populated["moid_data"]:
         mpcorb_populated["moid_data"][key] = value
@@ -639,9 +861,23 @@ def populate_moid_data(moidsdict, mpcorb_populated  ):
 def populate_categorization(orbfit_other_dict, mpcorb_populated  ):
     '''
     # Populate categorization
-    
+
+    "categorization": {
+        "object_type_str": "",      # <<-- populated in *populate_designation_data*
+        "object_type_int": null,
+        "orbit_type_str": "",
+        "orbit_type_int": null,
+        "orbit_subtype_str": "",
+        "orbit_subtype_int": null
+    }
+
+    NB: The orbit type (MPC orbit-type code & name) is assigned from the (already populated) COM elements by orbit_class.py
+        (objects that match none of the classes get the catch-all type, 22 "Other"; there are no MPC orbit subtypes,
+        so orbit_subtype_str/int are set to "" & null)
     '''
-    pass
+    if mpcorb_populated["COM"]["coefficient_values"][0] > 0:
+      classes = orbit_class.classify( [mpcorb_populated["COM"]["coefficient_values"][:3]] )
+      mpcorb_populated['categorization'].update( orbit_class.classes_for_object(classes, 0) )
 
 
 
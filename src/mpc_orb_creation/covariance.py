@@ -0,0 +1,250 @@
+"""
+mpc_orb_creation/covariance.py
+ - Covariance matrices stored as a flat (row-major) upper-triangular float64 array
+ - Fast conversions to & from ...
+   (a) the keyed-dict form used in orbfit output & the mpc_orb json: {"cov00":..., "cov01":..., ..., "cov55":...}
+       (older orbfit output numbers the packed elements sequentially instead, {"cov00":..., "cov01":..., ..., "cov20":...}:
+        these are converted on input)
+   (b) square (p,p) arrays
+   (c) batched (N,p,p) stacks
+ - Batched consistency checks of (N,p,p) stacks: symmetry, positive-definiteness & agreement with
+   the reported eigenvalues ("eigval") & uncertainties ("rms")
+"""
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+
+# The keyed form "covIJ" only supports single-digit indices
+MAX_NUMPARAMS = 10
+
+# Tolerances used by *check_stack*
+# - symmetry : max |C - C^T| relative to max |C|
+# - eigval / rms : relative differences between the reported & recomputed values
+#   (orbfit writes these with ~6 significant figures)
+# - eigenvalue_floor : eigenvalues are only resolved to ~ eigenvalue_floor * (the largest eigenvalue),
+#   so smaller (or slightly negative) eigenvalues are treated as numerical noise
+#   (covariances with non-grav parameters can have condition numbers well beyond double precision)
+CHECK_TOLERANCES = {'symmetry': 1e-10, 'eigval': 1e-3, 'rms': 1e-3, 'eigenvalue_floor': 1e-12}
+
+_triu_cache = {}
+_keys_cache = {}
+
+def packed_size(numparams):
+    ''' Number of elements in the upper triangle of a (numparams,numparams) matrix '''
+    return numparams * (numparams + 1) // 2
+
+def numparams_from_size(size):
+    ''' Inverse of packed_size '''
+    numparams = int(round((np.sqrt(8 * size + 1) - 1) / 2))
+    if packed_size(numparams) != size:
+        raise Exception(f"{size} is not a valid size for a packed upper-triangular covariance")
+    return numparams
+
+def triu_indices(numparams):
+    ''' (row, column) indices of the packed elements (cached) '''
+    if numparams not in _triu_cache:
+        _triu_cache[numparams] = np.triu_indices(numparams)
+    return _triu_cache[numparams]
+
+def cov_keys(numparams):
+    ''' Keys of the packed elements in the keyed-dict form, i.e. ("cov00", "cov01", ...) (cached) '''
+    if numparams not in _keys_cache:
+        if numparams > MAX_NUMPARAMS:
+            raise Exception(f"numparams={numparams} cannot be represented using covIJ keys (max={MAX_NUMPARAMS})")
+        _keys_cache[numparams] = tuple( 'cov%d%d' % (i, j) for i, j in zip(*triu_indices(numparams)) )
+    return _keys_cache[numparams]
+
+def sequential_cov_keys(numparams):
+    ''' Keys of the packed elements in the older, sequentially-numbered, keyed-dict form, i.e. ("cov00", "cov01", ..., "cov20" for numparams=6) '''
+    return tuple( 'cov%02d' % _ for _ in range(packed_size(numparams)) )
+
+def is_sequential(cov_dict):
+    ''' Whether a keyed covariance dict uses the older sequential numbering (i.e. has (non-null) "lower-triangle" keys, e.g. cov10) '''
+    return any( cov_dict.get('cov%d%d' % (i, j)) is not None for i in range(1, MAX_NUMPARAMS) for j in range(i) )
+
+def infer_numparams(cov_dict):
+    '''
+    Number of parameters in a keyed covariance dict: the number of (non-null) diagonal entries
+    (or, for the older sequential numbering, from the number of consecutive keys)
+    NB: The mpc_orb template has keys up to cov99, with nulls for the unused parameters
+    '''
+    if is_sequential(cov_dict):
+        size = 0
+        while cov_dict.get('cov%02d' % size) is not None:
+            size += 1
+        return numparams_from_size(size)
+    numparams = 0
+    while numparams < MAX_NUMPARAMS and cov_dict.get('cov%d%d' % (numparams, numparams)) is not None:
+        numparams += 1
+    return numparams
+
+
+class PackedCovariance():
+    '''
+    Covariance matrix stored as a flat upper-triangular float64 array
+    E.g.
+    >>> cov = PackedCovariance.from_dict(eq1dict['CAR'])
+    >>> cov.to_array()   # <<-- (6,6) array
+    >>> cov.to_dict()    # <<-- {"cov00":..., ..., "cov55":...}
+    '''
+    __slots__ = ('numparams', 'packed')
+
+    def __init__(self, packed, numparams=None):
+        self.packed    = np.ascontiguousarray(packed, dtype=np.float64).reshape(-1)
+        self.numparams = numparams if numparams is not None else numparams_from_size(self.packed.size)
+        if self.packed.size != packed_size(self.numparams):
+            raise Exception(f"packed array of size {self.packed.size} is inconsistent with numparams={self.numparams}")
+
+    # ---- Constructors ----
+    @classmethod
+    def from_dict(cls, cov_dict, numparams=None):
+        '''
+        From a keyed dict (extra keys, e.g. other orbfit quantities, are ignored)
+         - The size of the matrix is the dict's own "numparams" (e.g. an orbfit CAR / COM dict), if present, or is inferred from the keys
+         - The older sequential numbering is converted (see *is_sequential*)
+         - If numparams is supplied, the leading (numparams,numparams) block is returned (it must not exceed the size of the matrix)
+         - Raises if the keys are inconsistent with the dict's numparams
+        '''
+        stored    = int(cov_dict['numparams']) if cov_dict.get('numparams') is not None else None
+        full      = stored if stored is not None else infer_numparams(cov_dict)
+        numparams = int(numparams) if numparams is not None else full
+        if numparams > full:
+            raise Exception(f"Cannot extract a ({numparams},{numparams}) covariance from one with numparams={full}")
+
+        sequential = is_sequential(cov_dict)
+        keys       = sequential_cov_keys(full) if sequential else cov_keys(full)
+        missing    = [k for k in keys if cov_dict.get(k) is None]
+        if missing:
+            raise Exception(f"Covariance dict with numparams={full} is missing the keys {missing}")
+        extra = ['cov%02d' % packed_size(full)] if sequential else \
+                [k for k in cov_keys(MAX_NUMPARAMS) if k not in set(keys)]
+        extra = [k for k in extra if cov_dict.get(k) is not None]
+        if extra:
+            raise Exception(f"Covariance dict with numparams={full} has the unexpected keys {extra}")
+
+        cov = cls( [cov_dict[k] for k in keys], full )
+        return cov if numparams == full else cls.from_array( cov.to_array()[:numparams, :numparams] )
+
+    @classmethod
+    def from_array(cls, covariance_array):
+        ''' From a square (p,p) array (only the upper triangle is used) '''
+        covariance_array = np.asarray(covariance_array, dtype=np.float64)
+        numparams = covariance_array.shape[-1]
+        return cls( covariance_array[triu_indices(numparams)], numparams )
+
+    # ---- Conversions ----
+    def to_dict(self):
+        ''' Keyed dict, {"cov00":..., "cov01":..., ...} '''
+        return dict( zip(cov_keys(self.numparams), self.packed.tolist()) )
+
+    def to_array(self):
+        ''' Square (p,p) array '''
+        return unpack_stack(self.packed[np.newaxis, :], self.numparams)[0]
+
+    def diagonal(self):
+        ''' Variances '''
+        i, j = triu_indices(self.numparams)
+        return self.packed[i == j]
+
+    def __len__(self):
+        return self.numparams
+
+    def __eq__(self, other):
+        return isinstance(other, PackedCovariance) and self.numparams == other.numparams and np.array_equal(self.packed, other.packed)
+
+    def __repr__(self):
+        return f"PackedCovariance(numparams={self.numparams})"
+
+
+# Batched conversions
+# -----------------------
+def unpack_stack(packed, numparams=None):
+    ''' (N, p(p+1)/2) array of packed covariances -> (N,p,p) stack of symmetric matrices '''
+    packed    = np.asarray(packed, dtype=np.float64)
+    numparams = numparams if numparams is not None else numparams_from_size(packed.shape[-1])
+    i, j      = triu_indices(numparams)
+    out       = np.empty( (packed.shape[0], numparams, numparams) )
+    out[:, i, j] = packed
+    out[:, j, i] = packed
+    return out
+
+def pack_stack(covariance_stack):
+    ''' (N,p,p) stack -> (N, p(p+1)/2) array of packed upper triangles '''
+    covariance_stack = np.asarray(covariance_stack, dtype=np.float64)
+    i, j  = triu_indices(covariance_stack.shape[-1])
+    return np.ascontiguousarray(covariance_stack[:, i, j])
+
+def stack(covariances):
+    ''' List of PackedCovariance (with a common numparams) -> (N,p,p) stack '''
+    numparams = {_.numparams for _ in covariances}
+    if len(numparams) != 1:
+        raise Exception(f"Cannot stack covariances with differing numparams: {numparams}")
+    return unpack_stack( np.stack([_.packed for _ in covariances]), numparams.pop() )
+
+
+# Batched checks
+# -----------------------
+def check_stack(covariance_stack, eigval=None, rms=None, eigval_scale=None, tolerances=None):
+    '''
+    Consistency & positive-definiteness checks for N covariance matrices, using a single batched eigen-decomposition
+
+    inputs:
+    -------
+    covariance_stack: (N,p,p) array-like
+    eigval: (N,p) array-like, optional
+     - the reported square-roots of the eigenvalues (ascending), as per orbfit's "eigval"
+    rms: (N,>=p) array-like, optional
+     - the reported uncertainties, as per orbfit's "rms" (compared to the square-roots of the diagonal)
+    eigval_scale: (p,) array-like, optional
+     - per-parameter scaling applied before the eigval are computed (see transform.eigval_scale)
+    tolerances: dict, optional
+     - defaults to CHECK_TOLERANCES
+
+    returns:
+    --------
+    dict of (N,) bool arrays
+     - 'finite', 'symmetric', 'positive_definite', 'eigval_consistent', 'rms_consistent' & 'ok' (all of the above)
+     - NB: the eigval / rms checks are True if the reported values are not supplied
+     - NB: 'positive_definite' is to within the resolution of the eigenvalues (see CHECK_TOLERANCES)
+    '''
+    tolerances       = dict(CHECK_TOLERANCES, **(tolerances or {}))
+    covariance_stack = np.asarray(covariance_stack, dtype=np.float64)
+    N, p = covariance_stack.shape[0], covariance_stack.shape[-1]
+
+    finite = np.all( np.isfinite(covariance_stack), axis=(1, 2) )
+    stack  = np.where( finite[:, np.newaxis, np.newaxis], covariance_stack, np.eye(p) )
+
+    scale_max = np.max( np.abs(stack), axis=(1, 2) )
+    symmetric = np.max( np.abs(stack - np.transpose(stack, (0, 2, 1))), axis=(1, 2) ) <= tolerances['symmetry'] * scale_max
+
+    # A positive diagonal scaling does not change the signs of the eigenvalues (Sylvester's law of inertia),
+    # so the one decomposition serves for both the positive-definiteness & the eigval checks
+    scale = np.ones(p) if eigval_scale is None else np.asarray(eigval_scale, dtype=np.float64)
+    eigenvalues = np.linalg.eigvalsh( stack * scale[:, np.newaxis] * scale[np.newaxis, :] )
+    noise       = tolerances['eigenvalue_floor'] * np.abs(eigenvalues[:, -1:])
+    positive_definite = eigenvalues[:, 0] > -noise[:, 0]
+
+    # NB: compared as eigenvalues (= eigval^2), for which the relative tolerance doubles
+    eigval_consistent = np.ones(N, dtype=bool)
+    if eigval is not None:
+        reported = np.asarray(eigval, dtype=np.float64).reshape(N, -1)**2
+        eigval_consistent = np.all( np.abs(eigenvalues - reported) <= 2 * tolerances['eigval'] * reported + noise, axis=1 ) \
+                            if reported.shape[1] == p else np.zeros(N, dtype=bool)
+
+    rms_consistent = np.ones(N, dtype=bool)
+    if rms is not None:
+        computed = np.sqrt( np.clip(np.diagonal(stack, axis1=1, axis2=2), 0.0, None) )
+        reported = np.asarray(rms, dtype=np.float64).reshape(N, -1)
+        rms_consistent = np.all( np.abs(computed - reported[:, :p]) <= tolerances['rms'] * np.abs(reported[:, :p]), axis=1 ) \
+                         if reported.shape[1] >= p else np.zeros(N, dtype=bool)
+
+    checks = {'finite': finite, 'symmetric': symmetric, 'positive_definite': positive_definite,
+              'eigval_consistent': eigval_consistent, 'rms_consistent': rms_consistent}
+    checks['ok'] = np.logical_and.reduce( list(checks.values()) )
+    return checks
+
+def failed_checks(checks, n):
+    ''' Names of the checks (see *check_stack*) that the n-th covariance failed '''
+    return [key for key, value in checks.items() if key != 'ok' and not value[n]]
@@ -0,0 +1,139 @@
+"""
+mpc_orb_creation/deadletter.py
+ - A local (SQLite) store of the designations whose mpc_orb construction failed
+ - Each entry records the stage that failed, the exception, and a hash of the inputs,
+   so that only the failures need to be reprocessed, & only once their inputs have changed
+   (see utility_popn.populate_orbfit_results(..., retry_failed=True) & pipeline.py)
+"""
+
+# Standard imports
+# -----------------------
+import hashlib
+import json
+import traceback
+
+# local imports
+# -----------------------
+from mpc_orb_creation import io
+from mpc_orb_creation.backends import _SQLiteBackend
+
+
+def input_hash(inputs):
+    ''' sha256 of the (key-ordered) json of the inputs: allows us to tell whether the inputs changed since the failure '''
+    return hashlib.sha256( json.dumps(inputs, sort_keys=True, default=str).encode() ).hexdigest()
+
+def orbfit_inputs(rwo_dict, mid_epoch_dict, standard_epoch_dict, updated_at, ele220):
+    '''
+    The inputs whose hash is recorded by populate_orbfit_results (utility_popn.py & pipeline.py) for every stage
+     - i.e. the row fetched from the orbfit_results table, so that a retry can tell whether the inputs have changed
+       before anything is constructed
+    '''
+    return [rwo_dict, mid_epoch_dict, standard_epoch_dict, updated_at, ele220]
+
+
+def make_entry(unpacked, stage, exception, inputs=None, inputs_hash=None):
+    '''
+    Structured description of a failure
+
+    inputs:
+    -------
+    unpacked: str
+     - designation of the object that failed
+    stage: str
+     - the stage that failed, e.g. 'fetch', 'template', 'populate', 'validate', 'insert'
+    exception: Exception
+    inputs: optional
+     - the inputs to the failed stage (only their hash is kept)
+    inputs_hash: str, optional
+     - the hash of the inputs, if already known (see *input_hash*)
+    '''
+    return {
+        'unpacked'       : unpacked,
+        'stage'          : stage,
+        'exception_type' : type(exception).__name__,
+        'message'        : str(exception),
+        'traceback'      : ''.join(traceback.format_exception(type(exception), exception, exception.__traceback__)),
+        'input_hash'     : inputs_hash if inputs_hash is not None else input_hash(inputs) if inputs is not None else None,
+        'failed_at'      : io.timestamp_str(),
+    }
+
+
+class FailureCollector():
+    '''
+    In-memory stand-in for a DeadLetterQueue
+    E.g. used in worker processes, so that the failures can be passed back and recorded by the parent
+    '''
+    def __init__(self):
+        self.entries = []
+
+    def record(self, unpacked, stage, exception, inputs=None, inputs_hash=None):
+        self.entries.append( make_entry(unpacked, stage, exception, inputs=inputs, inputs_hash=inputs_hash) )
+
+
+class DeadLetterQueue(_SQLiteBackend):
+    '''
+    SQLite store of failed constructions (one entry per designation: the most recent failure)
+    E.g.
+    >>> dlq = DeadLetterQueue('dead_letters.db')
+    >>> utility_popn.populate_orbfit_results(dead_letter=dlq)                     # <<-- Records failures
+    >>> utility_popn.populate_orbfit_results(dead_letter=dlq, retry_failed=True)  # <<-- Only reprocesses the failures
+    '''
+    _schema = """
+        CREATE TABLE IF NOT EXISTS dead_letters (
+            unpacked        TEXT PRIMARY KEY,
+            stage           TEXT NOT NULL,
+            exception_type  TEXT NOT NULL,
+            message         TEXT,
+            traceback       TEXT,
+            input_hash      TEXT,
+            n_failures      INTEGER NOT NULL DEFAULT 1,
+            first_failed_at TEXT,
+            failed_at       TEXT
+        );
+    """
+    _columns = ['unpacked', 'stage', 'exception_type', 'message', 'traceback', 'input_hash', 'n_failures', 'first_failed_at', 'failed_at']
+
+    def record(self, unpacked, stage, exception, inputs=None, inputs_hash=None):
+        ''' Record the failure of a stage for a designation '''
+        self.add( make_entry(unpacked, stage, exception, inputs=inputs, inputs_hash=inputs_hash) )
+
+    def add(self, entry):
+        ''' Add an entry (as created by make_entry), incrementing the failure-count of any existing entry '''
+        self.cnx.execute(
+            """INSERT INTO dead_letters (unpacked, stage, exception_type, message, traceback, input_hash, first_failed_at, failed_at)
+               VALUES (:unpacked, :stage, :exception_type, :message, :traceback, :input_hash, :failed_at, :failed_at)
+               ON CONFLICT(unpacked) DO UPDATE SET
+                    stage=excluded.stage, exception_type=excluded.exception_type, message=excluded.message,
+                    traceback=excluded.traceback, input_hash=excluded.input_hash, failed_at=excluded.failed_at,
+                    n_failures=n_failures+1;""",
+            entry)
+        self.cnx.commit()
+
+    def remove(self, unpacked):
+        ''' Remove the entry for a designation (e.g. after it has been successfully reprocessed) '''
+        self.cnx.execute("DELETE FROM dead_letters WHERE unpacked = ?;", (unpacked,))
+        self.cnx.commit()
+
+    def entries(self, stage=None):
+        ''' List of the entries (dicts), optionally restricted to a single stage '''
+        sql_str = f"SELECT {', '.join(self._columns)} FROM dead_letters"
+        rows = self.cnx.execute(sql_str + " WHERE stage = ? ORDER BY rowid;", (stage,)) if stage is not None else \
+               self.cnx.execute(sql_str + " ORDER BY rowid;")
+        return [dict(zip(self._columns, row)) for row in rows.fetchall()]
+
+    def inputs_changed(self, unpacked, inputs_hash):
+        ''' Whether the inputs of a designation differ from those of its recorded failure
+            (True if there is no entry, or if the entry has no input hash)
+        '''
+        result = self.cnx.execute("SELECT input_hash FROM dead_letters WHERE unpacked = ?;", (unpacked,)).fetchone()
+        return result is None or result[0] is None or result[0] != inputs_hash
+
+    def designations(self, stage=None):
+        ''' List of the designations that have failed, optionally restricted to a single stage '''
+        return [_['unpacked'] for _ in self.entries(stage=stage)]
+
+    def __len__(self):
+        return self.cnx.execute("SELECT COUNT(*) FROM dead_letters;").fetchone()[0]
+
+    def __contains__(self, unpacked):
+        return self.cnx.execute("SELECT 1 FROM dead_letters WHERE unpacked = ?;", (unpacked,)).fetchone() is not None
@@ -1,18 +1,38 @@
 """
 Defining filepaths used by mpc_orb
+
+NB: filepath_dict is a lazy registry: the file-lists are only globbed (and cached) the first time they are accessed,
+so that importing this module does not trigger a pile of directory listings
 """
 
 # Import third-party packages
 # -----------------------
 import glob
-from os.path import join, dirname, abspath
-import os
+from os.path import join, dirname, abspath, isdir
+import os, sys
+from collections.abc import Mapping
 
 # Directories
 # -----------------------
 pack_dir  = dirname(dirname(dirname(abspath(__file__))))    # Package directory
 
-json_dir  = join(pack_dir, 'json_files')           # All of the json-files
+def find_json_dir():
+    '''
+    Locate the directory containing all of the json-files. In order of preference ...
+     - the directory in the environment variable MPC_ORB_CREATION_JSON_DIR
+     - the repo-relative directory (i.e. running from a clone of the repo)
+     - the directory installed alongside the package (i.e. installed from a wheel, see setup.cfg:data_files)
+    '''
+    candidates = [  os.environ.get('MPC_ORB_CREATION_JSON_DIR'),
+                    join(pack_dir, 'json_files'),
+                    join(dirname(abspath(__file__)), 'json_files'),
+                    join(sys.prefix, 'share', 'mpc_orb_creation', 'json_files')]
+    for d in candidates:
+        if d and isdir(d):
+            return d
+    return join(pack_dir, 'json_files')
+
+json_dir  = find_json_dir()                        # All of the json-files
 code_dir  = join(pack_dir, 'src/mpc_orb_creation') # All of the packaged python code
 test_dir  = join(pack_dir, 'tests')                # All of the test code
 demo_dir  = join(pack_dir, 'demos')                # Some demos/examples
@@ -30,43 +50,75 @@ tem_dir      = join(json_dir, 'template_json')                  # Dir. containin
 
 
 
+# Lazy registry
+# -----------------------
+class FilepathRegistry(Mapping):
+    '''
+    Read-only dictionary of filepaths / file-lists, in which each value is
+    only resolved (e.g. globbed) on first access, and then cached
+    '''
+    def __init__(self, resolvers):
+        self._resolvers = resolvers # key -> zero-argument function returning the filepath / file-list
+        self._cache     = {}
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            self._cache[key] = self._resolvers[key]()
+        return self._cache[key]
+
+    def __iter__(self):
+        return iter(self._resolvers)
+
+    def __len__(self):
+        return len(self._resolvers)
+
+    def clear_cache(self):
+        ''' Forget any previously resolved values (e.g. after new files have been created) '''
+        self._cache = {}
+
+def _globbed(*patterns):
+    ''' Resolver for the (concatenated) list of files matching the patterns '''
+    return lambda : [f for pattern in patterns for f in glob.glob(pattern)]
+
+
 # Files / File-Lists
 # -----------------------
 
 # start with the defining felfiles for orbfit (string) jsons ...
-orbfit_defining_files_general      = glob.glob( def_gen_dir + "/*str.json" )    # List of defining JSONs that represent generally valid fel-files
-orbfit_defining_files_general.extend(glob.glob( def_gen_dir + "/*orig.json" ))
+# - List of defining JSONs that represent generally valid fel-files
+# - List of defining JSONs that represent valid fel-files that are good to convert to mpc_orb format
+# - List of defining JSONs that represent valid orbfit output dictionaries (containing multiple sub-dictionaries) that are good to convert to mpc_orb format
+_orbfit_defining_files_general   = _globbed( def_gen_dir + "/*str.json" ,  def_gen_dir + "/*orig.json" )
+_orbfit_defining_files_convert   = _globbed( def_con_dir + "/*str.json" ,  def_con_dir + "/*orig.json" )
+_orbfit_defining_files_construct = _globbed( def_cons_dir + "/*str.json" , def_cons_dir + "/*orig.json" )
 
-orbfit_defining_files_convert      = glob.glob( def_con_dir + "/*str.json" )    # List of defining JSONs that represent valid fel-files that are good to convert to mpc_orb format
-orbfit_defining_files_convert.extend(glob.glob( def_con_dir + "/*orig.json" ))
-
-orbfit_defining_files_construct      = glob.glob( def_cons_dir + "/*str.json" )   # List of defining JSONs that represent valid orbfit output dictionaries
-orbfit_defining_files_construct.extend(glob.glob( def_cons_dir + "/*orig.json" )) # (containing multiple sub-dictionaries) that are good to convert to mpc_orb format
+def _mpcorb_defining_files():
+    return [ join(def_mpc_dir , os.path.split(_)[-1][:os.path.split(_)[-1].rfind("_")+1] ) + "num.json" for _ in filepath_dict['orbfit_defining_sample_convert']]
 
 
 # Put all of the files/file-lists into a dictionary ...
 # -----------------------
-filepath_dict = {
-    'orbfit_defining_sample_general'    : orbfit_defining_files_general,          # List of defining JSONs that represent generally valid fel-files
-    'orbfit_defining_sample_convert'    : orbfit_defining_files_convert,          # List of defining JSONs that represent valid fel-files that are good to convert to mpc_orb format
-    'orbfit_defining_sample_construct'  : orbfit_defining_files_construct,        # List of :wqdefining JSONs that represent valid orbfit output dict-of-dicts...
+filepath_dict = FilepathRegistry({
+    'orbfit_defining_sample_general'    : _orbfit_defining_files_general,         # List of defining JSONs that represent generally valid fel-files
+    'orbfit_defining_sample_convert'    : _orbfit_defining_files_convert,         # List of defining JSONs that represent valid fel-files that are good to convert to mpc_orb format
+    'orbfit_defining_sample_construct'  : _orbfit_defining_files_construct,       # List of defining JSONs that represent valid orbfit output dict-of-dicts...
                                                                                   #     that are good to convert to mpc_orb format
-    'mpcorb_defining_sample'     : [ join(def_mpc_dir , os.path.split(_)[-1][:os.path.split(_)[-1].rfind("_")+1] ) + "num.json" for _ in orbfit_defining_files_convert],
-    
-    'orbfit_general_schema'      : join(sch_dir, 'orbfit_general_schema.json'),      # The validation schema json created from the defining sample (for generally valid fel-files)
-    'orbfit_conversion_schema'   : join(sch_dir, 'orbfit_conversion_schema.json'),   # The validation schema json created from the defining sample (for valid convertible fel-files)
-    'orbfit_construction_schema' : join(sch_dir, 'orbfit_construction_schema.json'), # The validation schema json created from the defining sample...
-                                                                                     #(for valid convertible orbfit-output consisting of a dictionary-of-dictionaries)
-    'mpcorb_schema'             : join(sch_dir, 'mpcorb_schema.json'),               # The validation schema json
-    'mpcorb_template'           : join(tem_dir, 'mpcorb_template.json'),             # A template mpc_orb json
-
-    'test_fail_mpcorb'          : glob.glob( tj_dir + "/fail_mpcorb/*" ),
-    'test_fail_orbfit_convert'  : glob.glob( tj_dir + "/fail_orbfit_convert/*" ),
-    'test_fail_orbfit_construct': glob.glob( tj_dir + "/fail_orbfit_construct/*" ),
-    'test_fail_orbfit_general'  : glob.glob( tj_dir + "/fail_orbfit_general/*" ),
-    'test_pass_mpcorb'          : glob.glob( tj_dir + "/pass_mpcorb/*" ),
-    'test_pass_orbfit_convert'  : glob.glob( tj_dir + "/pass_orbfit_convert/*" ),
-    'test_pass_orbfit_construct': glob.glob( tj_dir + "/pass_orbfit_construct/*" ),
-    'test_pass_orbfit_general'  : glob.glob( tj_dir + "/pass_orbfit_general/*" ),
-    'test_pass_orbfit_standard' : glob.glob( tj_dir + "/pass_orbfit_standard/*" ), # Example(s) of new "standard" orbfit output dict 
-}
+    'mpcorb_defining_sample'     : _mpcorb_defining_files,
+
+    'orbfit_general_schema'      : lambda : join(sch_dir, 'orbfit_general_schema.json'),      # The validation schema json created from the defining sample (for generally valid fel-files)
+    'orbfit_conversion_schema'   : lambda : join(sch_dir, 'orbfit_conversion_schema.json'),   # The validation schema json created from the defining sample (for valid convertible fel-files)
+    'orbfit_construction_schema' : lambda : join(sch_dir, 'orbfit_construction_schema.json'), # The validation schema json created from the defining sample...
+                                                                                              #(for valid convertible orbfit-output consisting of a dictionary-of-dictionaries)
+    'mpcorb_schema'             : lambda : join(sch_dir, 'mpcorb_schema.json'),               # The validation schema json
+    'mpcorb_template'           : lambda : join(tem_dir, 'mpcorb_template.json'),             # A template mpc_orb json
+
+    'test_fail_mpcorb'          : _globbed( tj_dir + "/fail_mpcorb/*" ),
+    'test_fail_orbfit_convert'  : _globbed( tj_dir + "/fail_orbfit_convert/*" ),
+    'test_fail_orbfit_construct': _globbed( tj_dir + "/fail_orbfit_construct/*" ),
+    'test_fail_orbfit_general'  : _globbed( tj_dir + "/fail_orbfit_general/*" ),
+    'test_pass_mpcorb'          : _globbed( tj_dir + "/pass_mpcorb/*" ),
+    'test_pass_orbfit_convert'  : _globbed( tj_dir + "/pass_orbfit_convert/*" ),
+    'test_pass_orbfit_construct': _globbed( tj_dir + "/pass_orbfit_construct/*" ),
+    'test_pass_orbfit_general'  : _globbed( tj_dir + "/pass_orbfit_general/*" ),
+    'test_pass_orbfit_standard' : _globbed( tj_dir + "/pass_orbfit_standard/*" ), # Example(s) of new "standard" orbfit output dict
+})
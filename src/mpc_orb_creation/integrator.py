@@ -0,0 +1,192 @@
+"""
+mpc_orb_creation/integrator.py
+ - Batch export of the (CAR) states of N orbits as the inputs of the rebound-ephem integrator
+   https://github.com/matthewholman/reboundx/blob/holman/examples/ephem_forces/ephem_forces.py
+       integration_function(tstart, tstep, trange, geocentric, n_particles, instate_arr, n_var, invar_part, invar, epsilon)
+ - All of the arrays are allocated once, as contiguous float64 (int for invar_part) arrays
+ - The objects are sorted by epoch, so that the objects that share a tstart are a contiguous block
+   & can be passed to the integrator as views (see *epoch_group*), without copies
+ - NB: ephem_forces integrates barycentric, equatorial states, with times in TDB
+   * The mpc_orb CAR states are heliocentric (& ecliptic, as per the system_data refsys): they are rotated to the
+     equatorial frame, & must be shifted to the barycentre with the (barycentric) state of the Sun at each epoch
+     (sun_state is required, unless barycentric=True says that the states are already barycentric)
+   * The mpc_orb epochs are MJD in the time system of the epoch_data (TDT, i.e. TT): they are converted to MJD(TDB)
+     (the tstart of each epoch group), & the time system & form of the exported epochs are named in the output
+"""
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+
+# Obliquity of the ecliptic (J2000) [arcsec], if not supplied in the system_data
+OBLIQUITY_ARCSEC = 84381.448
+
+# Number of variational particles per object (one per component of the state)
+N_VAR_PER_PARTICLE = 6
+
+# Time systems that can be converted to TDB (see *to_tdb*)
+TT_TIMESYSTEMS = ('TDT', 'TT')
+
+
+def to_tdb(mjd, timesystem):
+    '''
+    MJD epochs in the given time system -> MJD(TDB)
+     - TT (= TDT) -> TDB via the usual periodic approximation (good to ~10 microseconds):
+       TDB - TT = 0.001657 sin(g) + 0.000014 sin(2g) seconds, g = 357.53 + 0.98560028 (JD - 2451545.0) degrees
+     - NB: Other time systems (e.g. UTC, which needs leap seconds) are not supported
+    '''
+    mjd = np.asarray(mjd, dtype=np.float64)
+    timesystem = str(timesystem).upper()
+    if timesystem == 'TDB':
+        return mjd
+    if timesystem not in TT_TIMESYSTEMS:
+        raise Exception(f"Cannot convert epochs in the {timesystem} time system to TDB (expected one of {TT_TIMESYSTEMS + ('TDB',)})")
+    g = np.radians( 357.53 + 0.98560028 * (mjd + 2400000.5 - 2451545.0) )
+    return mjd + (0.001657 * np.sin(g) + 0.000014 * np.sin(2 * g)) / 86400.0
+
+
+def ecliptic_to_equatorial(states, obliquity_arcsec=OBLIQUITY_ARCSEC):
+    '''
+    Rotate (N,6) states (positions & velocities) from the ecliptic to the equatorial frame (in place)
+
+    returns:
+    --------
+    the (modified) states
+    '''
+    eps  = np.radians(obliquity_arcsec / 3600.0)
+    c, s = np.cos(eps), np.sin(eps)
+    for i in [0, 3]:
+        y, z = states[:, i + 1].copy(), states[:, i + 2].copy()
+        states[:, i + 1] = c * y - s * z
+        states[:, i + 2] = s * y + c * z
+    return states
+
+
+# -------------------------------------------------------------------
+# Export
+# -------------------------------------------------------------------
+
+def export(states, epoch, sun_state=None, barycentric=False, timesystem='TDT', variational=False,
+           rotate_to_equatorial=True, obliquity_arcsec=OBLIQUITY_ARCSEC):
+    '''
+    Integrator inputs for N objects
+
+    inputs:
+    -------
+    states: (N,6) array-like
+     - heliocentric (unless barycentric), ecliptic CAR states: x, y, z [au], vx, vy, vz [au/day]
+    epoch: (N,) array-like
+     - epochs of the states (MJD, in the timesystem)
+    sun_state: (6,) or (N,6) array-like
+     - barycentric state of the Sun (in the output frame) at the epochs, by which the states are made barycentric
+     - required, unless barycentric
+    barycentric: bool
+     - if True, the states are already barycentric (& sun_state must not be supplied)
+    timesystem: str
+     - time system of the epochs (e.g. the timesystem of the mpc_orb epoch_data): converted to TDB (see *to_tdb*)
+    variational: bool
+     - if True, each object is given N_VAR_PER_PARTICLE variational particles seeded with the identity
+       (i.e. the integrator then returns the state-transition matrix of each object)
+    rotate_to_equatorial: bool
+     - if True, the (ecliptic) states are rotated to the equatorial frame
+
+    returns:
+    --------
+    dict
+     - 'instate_arr' : (N,6) float64, barycentric, sorted by epoch
+     - 'epoch'       : (N,)  float64, MJD(TDB), sorted
+     - 'timesystem' : 'TDB' & 'timeform' : 'MJD' (of 'epoch' & of the tstart of the epoch groups)
+     - 'order'       : (N,)  indices of the input objects, i.e. instate_arr[k] is the state of object order[k]
+     - 'n_particles' : N
+     - 'epoch_groups': list of (epoch, slice), the contiguous blocks of objects with a common epoch
+     - 'n_var', 'invar_part' (n_var,) int & 'invar' (n_var,6) float64 (n_var = 0 unless variational)
+    '''
+    if sun_state is None and not barycentric:
+        raise Exception("ephem_forces integrates barycentric states: supply the barycentric sun_state at the epochs (or barycentric=True)")
+    if sun_state is not None and barycentric:
+        raise Exception("The states are already barycentric: sun_state must not be supplied")
+
+    states = np.atleast_2d( np.asarray(states, dtype=np.float64) )
+    epoch  = np.broadcast_to( to_tdb(epoch, timesystem), (states.shape[0],) )
+    N      = states.shape[0]
+
+    # Sort by epoch (stable, so that objects with a common epoch keep their input order)
+    # NB: fancy-indexing creates the single (contiguous) copy of the states
+    order       = np.argsort(epoch, kind='stable')
+    instate_arr = np.ascontiguousarray( states[order] )
+    epoch       = np.ascontiguousarray( epoch[order] )
+
+    if rotate_to_equatorial:
+        ecliptic_to_equatorial(instate_arr, obliquity_arcsec)
+    if sun_state is not None:
+        sun_state = np.asarray(sun_state, dtype=np.float64)
+        instate_arr += sun_state[order] if sun_state.ndim == 2 else sun_state
+
+    # Contiguous blocks of a common epoch
+    boundaries   = np.flatnonzero( np.diff(epoch) ) + 1
+    starts, ends = np.concatenate([[0], boundaries]), np.concatenate([boundaries, [N]])
+    epoch_groups = [ (float(epoch[s]), slice(int(s), int(e))) for s, e in zip(starts, ends) ] if N else []
+
+    # Variational particles: identity seeds for each object
+    n_var      = N * N_VAR_PER_PARTICLE if variational else 0
+    invar_part = np.repeat( np.arange(N), N_VAR_PER_PARTICLE ) if variational else np.empty(0, dtype=int)
+    invar      = np.tile( np.eye(N_VAR_PER_PARTICLE), (N, 1) ) if variational else np.empty((0, 6))
+
+    return {'instate_arr': instate_arr, 'epoch': epoch, 'timesystem': 'TDB', 'timeform': 'MJD', 'order': order,
+            'n_particles': N, 'epoch_groups': epoch_groups, 'n_var': n_var, 'invar_part': invar_part, 'invar': invar}
+
+def epoch_group(data, k):
+    '''
+    The integrator inputs for the k-th group of objects with a common epoch (see *export*)
+     - instate_arr & invar are views (not copies) of the exported arrays
+     - invar_part is renumbered to refer to the particles within the group
+
+    returns:
+    --------
+    dict with 'tstart' (MJD(TDB), as per 'timesystem' & 'timeform'), 'n_particles', 'instate_arr', 'n_var', 'invar_part', 'invar'
+    '''
+    tstart, s = data['epoch_groups'][k]
+    n = s.stop - s.start
+    variational = data['n_var'] > 0
+    vs = slice(s.start * N_VAR_PER_PARTICLE, s.stop * N_VAR_PER_PARTICLE) if variational else slice(0, 0)
+    return {'tstart'      : tstart,
+            'timesystem'  : data['timesystem'],
+            'timeform'    : data['timeform'],
+            'n_particles' : n,
+            'instate_arr' : data['instate_arr'][s],
+            'n_var'       : n * N_VAR_PER_PARTICLE if variational else 0,
+            'invar_part'  : data['invar_part'][vs] - s.start,
+            'invar'       : data['invar'][vs]}
+
+
+# -------------------------------------------------------------------
+# Inputs from parse.MPCORB objects & catalogue snapshots
+# -------------------------------------------------------------------
+
+def _frame_kwargs(system_data, epoch_data_list):
+    '''
+    Rotation to the equatorial frame (only if the mpc_orb refsys is ecliptic) & the obliquity, from the system_data,
+    & the time system of the epochs, from the epoch_data (which must be common to all of the objects)
+    '''
+    system_data = system_data or {}
+    timesystems = { str(_.get('timesystem', 'TDT')).upper() for _ in epoch_data_list } or {'TDT'}
+    if len(timesystems) > 1:
+        raise Exception(f"The epochs are in more than one time system: {sorted(timesystems)}")
+    return {'rotate_to_equatorial' : str(system_data.get('refsys', 'Ecliptic')).lower().startswith('ecl'),
+            'obliquity_arcsec'     : float(system_data.get('EclipticObliquityArcseconds', OBLIQUITY_ARCSEC)),
+            'timesystem'           : timesystems.pop()}
+
+def export_mpcorb(mpcorbs, sun_state=None, **kwargs):
+    ''' Integrator inputs for a list of parse.MPCORB objects (see *export* for sun_state & the kwargs) '''
+    states = [ _.CAR['element_array'][:6] for _ in mpcorbs ]
+    epoch  = [ _.epoch_data['epoch'] for _ in mpcorbs ]
+    kwargs = dict( _frame_kwargs(getattr(mpcorbs[0], 'system_data', None) if mpcorbs else None, [_.epoch_data for _ in mpcorbs]), **kwargs )
+    return export( np.reshape(np.asarray(states, dtype=np.float64), (-1, 6)), epoch, sun_state=sun_state, **kwargs )
+
+def export_catalogue(docs, sun_state=None, **kwargs):
+    ''' Integrator inputs for a catalogue snapshot (list of mpc_orb dicts, see catalogue.get_snapshot) (see *export* for sun_state & the kwargs) '''
+    states = [ doc['CAR']['coefficient_values'][:6] for doc in docs ]
+    epoch  = [ doc['epoch_data']['epoch'] for doc in docs ]
+    kwargs = dict( _frame_kwargs(docs[0].get('system_data') if docs else None, [doc['epoch_data'] for doc in docs]), **kwargs )
+    return export( np.reshape(np.asarray(states, dtype=np.float64), (-1, 6)), epoch, sun_state=sun_state, **kwargs )
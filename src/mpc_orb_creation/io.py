@@ -1,6 +1,8 @@
 # standard imports
+import hashlib
 import json
 import os, sys
+from datetime import datetime, timezone
 
 # IO functions
 # -----------------------
@@ -20,3 +22,38 @@ def save_json( json_filepath , data_dict, VERBOSE=False ):
         with open( json_filepath , 'w' ) as f:
             json.dump(data_dict , f , indent=4)
 
+
+# Canonical serialisation
+# -----------------------
+def canonical_json( data_dict ):
+    """ Key-ordered, compact json string: identical dicts always give identical strings (& bytes) """
+    return json.dumps(data_dict, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+def content_hash( data_dict ):
+    """ sha256 (hex) of the canonical json of a dict """
+    return hashlib.sha256( canonical_json(data_dict).encode('utf-8') ).hexdigest()
+
+# Fields that change on every construction (even from identical inputs): (section, key)
+VOLATILE_FIELDS = [ ('software_data', 'mpcorb_creation_datetime') ]
+
+def semantic_hash( mpc_orb_dict ):
+    """ content_hash of an mpc_orb dict, ignoring the VOLATILE_FIELDS (so regenerated-but-unchanged documents hash identically) """
+    d = dict(mpc_orb_dict)
+    for section, key in VOLATILE_FIELDS:
+        if isinstance(d.get(section), dict) and key in d[section]:
+            d[section] = {k: v for k, v in d[section].items() if k != key}
+    return content_hash(d)
+
+
+# Timestamps
+# -----------------------
+def utc_now():
+    """ The current UTC time, to the second, as a naive datetime (the orbfit_results timestamps are "without time zone", in UTC) """
+    return datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None)
+
+def timestamp_str( t=None ):
+    """ "%Y-%m-%d %H:%M:%S" string of a datetime (defaults to utc_now; aware datetimes are converted to UTC) """
+    t = t if t is not None else utc_now()
+    if t.tzinfo is not None:
+        t = t.astimezone(timezone.utc).replace(tzinfo=None)
+    return t.isoformat(sep=' ')
@@ -0,0 +1,61 @@
+"""
+mpc_orb_creation/lazy.py
+ - Deferred importing of heavy and/or internal-MPC-only modules
+ - The module is only imported on first attribute access, so importing e.g. construct.py is cheap,
+   and does not fail on machines where the internal MPC modules are unavailable
+"""
+
+# Standard imports
+# -----------------------
+import importlib
+import sys
+
+
+INTERNAL_MPC_MESSAGE = "This routine is intended for internal MPC usage and requires modules that are likely to only be available on internal MPC machines"
+
+
+class LazyModule():
+    '''
+    Stand-in for a module that is imported on first attribute access
+    E.g.
+    >>> ma = LazyModule('mpc_astro', path='/sa/python_libs')   # <<-- Nothing imported yet
+    >>> ma.to_julian_date(2023, 3, 5.0)                          # <<-- mpc_astro imported here
+
+    inputs:
+    -------
+    name: str
+     - name of the module to be imported
+    path: str, optional
+     - directory to be appended to sys.path before importing
+    message: str, optional
+     - message of the Exception raised if the module cannot be imported
+    '''
+
+    def __init__(self, name, path=None, message=INTERNAL_MPC_MESSAGE):
+        self.__dict__['_name'] = name
+        self.__dict__['_path'] = path
+        self.__dict__['_message'] = message
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            if self._path is not None and self._path not in sys.path:
+                sys.path.append(self._path)
+            try:
+                self.__dict__['_module'] = importlib.import_module(self._name)
+            except ImportError as e:
+                raise Exception(f"{self._message} (could not import {self._name}: {e})")
+        return self._module
+
+    def is_loaded(self):
+        ''' Whether the underlying module has been imported yet '''
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return f"<LazyModule {self._name} ({'loaded' if self.is_loaded() else 'not loaded'})>"
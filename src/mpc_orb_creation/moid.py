@@ -0,0 +1,169 @@
+"""
+mpc_orb_creation/moid.py
+ - Vectorised computation of the Minimum Orbit Intersection Distance (MOID) between
+   N heliocentric orbits (cometary elements) & the orbits of the major planets
+ - Used by construct.populate_moid_data when no external MOIDs are supplied
+ - Method:
+   (a) grid search over the true anomaly of the object & the eccentric anomaly of the planet
+       (all N objects at once, in chunks)
+   (b) the best few local minima of the grid are refined by successively finer local grids
+ - NB: The planetary orbits are Keplerian approximations (Standish, "Keplerian Elements for Approximate
+       Positions of the Major Planets", valid 1800-2050), with elements referred to the J2000 ecliptic
+"""
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+# local imports
+# -----------------------
+from mpc_orb_creation.transform import _rotation_matrices
+
+
+# Planetary orbital elements at J2000 & their rates (per Julian century)
+#             a [au]                      e                          i [deg]                    long.peri [deg]           node [deg]
+PLANET_ELEMENTS = {
+    'Venus'   : ( (0.72333566,  0.00000390), (0.00677672, -0.00004107), (3.39467605, -0.00078890), (131.60246718, 0.00268329), ( 76.67984255, -0.27769418) ),
+    'Earth'   : ( (1.00000261,  0.00000562), (0.01671123, -0.00004392), (-0.00001531, -0.01294668), (102.93768193, 0.32327364), (  0.0,          0.0       ) ),
+    'Mars'    : ( (1.52371034,  0.00001847), (0.09339410,  0.00007882), (1.84969142, -0.00813131), (-23.94362959, 0.44441088), ( 49.55953891, -0.29257343) ),
+    'Jupiter' : ( (5.20288700, -0.00011607), (0.04838624, -0.00013253), (1.30439695, -0.00183714), ( 14.72847983, 0.21252668), (100.47390909,  0.20469106) ),
+}
+MJD_J2000 = 51544.5
+
+# Grid & refinement settings
+N_GRID       = 72       # points per orbit in the initial grid search
+N_CANDIDATES = 4        # number of local minima of the grid that are refined
+N_REFINE     = 9        # points per dimension in each refinement grid
+N_ITERATIONS = 14       # number of refinement iterations
+CHUNK_SIZE   = 256      # number of objects in each chunk of the grid search
+
+# Hyperbolic (& parabolic) orbits are only searched out to this multiple of q (or to R_MAX_HYPERBOLIC, if larger)
+R_MAX_HYPERBOLIC = 50.0
+
+
+def planet_elements(planet, epoch=MJD_J2000):
+    '''
+    Keplerian elements of a planet at the epoch(s)
+
+    returns:
+    --------
+    a, e, incl, node, argperi (angles in radians), each of shape epoch.shape
+    '''
+    T = (np.asarray(epoch, dtype=np.float64) - MJD_J2000) / 36525.0
+    a, e, incl, varpi, node = [value + rate * T for value, rate in PLANET_ELEMENTS[planet]]
+    return a, e, np.radians(incl), np.radians(node), np.radians(varpi - node)
+
+
+# -------------------------------------------------------------------
+# Positions on the orbits
+# -------------------------------------------------------------------
+
+def _object_positions(p, e, R, nu):
+    ''' Positions of the objects at true anomalies nu: R (...,3,3), p & e (...), nu (..., M) -> (..., M, 3) '''
+    r = p[..., np.newaxis] / (1 + e[..., np.newaxis] * np.cos(nu))
+    perifocal = np.stack( [r * np.cos(nu), r * np.sin(nu)], axis=-1 )
+    return np.einsum('...ij,...mj->...mi', R[..., :, :2], perifocal)
+
+def _planet_positions(a, e, R, E):
+    ''' Positions of the planets at eccentric anomalies E: R (...,3,3), a & e (...), E (..., M) -> (..., M, 3) '''
+    a, e = a[..., np.newaxis], e[..., np.newaxis]
+    perifocal = np.stack( [a * (np.cos(E) - e), a * np.sqrt(1 - e**2) * np.sin(E)], axis=-1 )
+    return np.einsum('...ij,...mj->...mi', R[..., :, :2], perifocal)
+
+def _max_true_anomaly(q, e):
+    ''' Range of true anomaly that is searched: everything for ellipses, out to a maximum distance for hyperbolae '''
+    nu_max = np.full_like(q, np.pi)
+    open_orbit = e >= 1.0
+    if np.any(open_orbit):
+        r_max = np.maximum(R_MAX_HYPERBOLIC, 10 * q[open_orbit])
+        p     = q[open_orbit] * (1 + e[open_orbit])
+        nu_max[open_orbit] = np.arccos( np.clip((p / r_max - 1) / e[open_orbit], -1.0, 1.0) )
+    return nu_max
+
+
+# -------------------------------------------------------------------
+# MOID
+# -------------------------------------------------------------------
+
+def _moid_chunk(p, e, R, nu_max, a_pl, e_pl, R_pl):
+    ''' MOIDs for a chunk of objects (all arrays have a leading dimension of n) '''
+    n = p.shape[0]
+
+    # (a) Grid search: object true-anomaly (rows) x planet eccentric-anomaly (columns)
+    grid      = (np.arange(N_GRID) + 0.5) / N_GRID                          # (0,1)
+    nu        = nu_max[:, np.newaxis] * (2 * grid - 1)                       # (n, N_GRID)
+    E         = 2 * np.pi * grid[np.newaxis, :].repeat(n, axis=0)             # (n, N_GRID)
+    r_obj     = _object_positions(p, e, R, nu)                               # (n, N_GRID, 3)
+    r_pl      = _planet_positions(a_pl, e_pl, R_pl, E)                       # (n, N_GRID, 3)
+    d2 = np.einsum('nik,nik->ni', r_obj, r_obj)[:, :, np.newaxis] + np.einsum('njk,njk->nj', r_pl, r_pl)[:, np.newaxis, :] \
+         - 2 * np.einsum('nik,njk->nij', r_obj, r_pl)
+
+    # Local minima of the (periodic) grid: the best few are refined
+    local_min = np.ones(d2.shape, dtype=bool)
+    for shift in [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]:
+        local_min &= d2 <= np.roll(d2, shift, axis=(1, 2))
+    d2_min = np.where(local_min, d2, np.inf).reshape(n, -1)
+    k      = min(N_CANDIDATES, d2_min.shape[1])
+    best   = np.argpartition(d2_min, k - 1, axis=1)[:, :k]                    # (n, k)
+    i, j   = np.unravel_index(best, (N_GRID, N_GRID))
+
+    # (b) Refinement: successively finer local grids around each candidate
+    nu_c  = np.take_along_axis(nu, i, axis=1)                                # (n, k)
+    E_c   = np.take_along_axis(E,  j, axis=1)
+    h_nu  = (2 * nu_max / N_GRID)[:, np.newaxis].repeat(k, axis=1)
+    h_E   = np.full_like(E_c, 2 * np.pi / N_GRID)
+    offsets = np.linspace(-1.0, 1.0, N_REFINE)
+
+    nk = n * k
+    p_k, e_k, R_k = p.repeat(k), e.repeat(k), R.repeat(k, axis=0)
+    a_pl_k, e_pl_k, R_pl_k = a_pl.repeat(k), e_pl.repeat(k), R_pl.repeat(k, axis=0)
+    nu_lim = nu_max.repeat(k).reshape(n, k)
+    for _ in range(N_ITERATIONS):
+        nu_trial = np.clip( nu_c[..., np.newaxis] + h_nu[..., np.newaxis] * offsets, -nu_lim[..., np.newaxis], nu_lim[..., np.newaxis] )
+        E_trial  = E_c[..., np.newaxis] + h_E[..., np.newaxis] * offsets
+        r_obj = _object_positions(p_k, e_k, R_k, nu_trial.reshape(nk, N_REFINE))       # (nk, N_REFINE, 3)
+        r_pl  = _planet_positions(a_pl_k, e_pl_k, R_pl_k, E_trial.reshape(nk, N_REFINE))
+        d2    = np.sum( (r_obj[:, :, np.newaxis, :] - r_pl[:, np.newaxis, :, :])**2, axis=-1 )   # (nk, N_REFINE, N_REFINE)
+        ij    = np.argmin(d2.reshape(nk, -1), axis=1)
+        ii, jj = np.unravel_index(ij, (N_REFINE, N_REFINE))
+        nu_c  = np.take_along_axis(nu_trial.reshape(nk, N_REFINE), ii[:, np.newaxis], axis=1).reshape(n, k)
+        E_c   = np.take_along_axis(E_trial.reshape(nk, N_REFINE),  jj[:, np.newaxis], axis=1).reshape(n, k)
+        h_nu *= 2.0 / (N_REFINE - 1)
+        h_E  *= 2.0 / (N_REFINE - 1)
+
+    d2_final = d2.reshape(nk, -1)[np.arange(nk), ij].reshape(n, k)
+    return np.sqrt( np.maximum(d2_final.min(axis=1), 0.0) )
+
+def compute_moids(com, epoch=MJD_J2000, planets=None):
+    '''
+    MOIDs between N orbits & the planets
+
+    inputs:
+    -------
+    com: (N,>=5) array-like
+     - cometary elements: q [au], e, i, node, argperi [deg] (any further columns are ignored)
+    epoch: float or (N,) array-like
+     - MJD at which the planetary orbits are evaluated
+    planets: list of str, optional
+     - defaults to all of PLANET_ELEMENTS
+
+    returns:
+    --------
+    dict of (N,) arrays of MOIDs [au], keyed by planet name
+    '''
+    com   = np.atleast_2d( np.asarray(com, dtype=np.float64) )
+    N     = com.shape[0]
+    epoch = np.broadcast_to( np.asarray(epoch, dtype=np.float64), (N,) )
+    q, e  = com[:, 0], com[:, 1]
+    p     = q * (1 + e)
+    R     = _rotation_matrices( np.radians(com[:, 2]), np.radians(com[:, 3]), np.radians(com[:, 4]) )
+    nu_max = _max_true_anomaly(q, e)
+
+    moids = {}
+    for planet in (planets if planets is not None else PLANET_ELEMENTS):
+        a_pl, e_pl, i_pl, node_pl, argperi_pl = planet_elements(planet, epoch)
+        R_pl = _rotation_matrices(i_pl, node_pl, argperi_pl)
+        moids[planet] = np.concatenate( [ _moid_chunk( p[s], e[s], R[s], nu_max[s], a_pl[s], e_pl[s], R_pl[s] )
+                                          for s in [slice(start, start + CHUNK_SIZE) for start in range(0, N, CHUNK_SIZE)] ] ) \
+                        if N else np.empty(0)
+    return moids
@@ -0,0 +1,98 @@
+"""
+mpc_orb_creation/nongrav.py
+ - Registry of the orbfit non-gravitational models, keyed by (nongrav_model, nongrav_params, tuple(nongrav_type))
+ - Each entry says which mpc_orb booleans to set, and where the coefficient values & uncertainties are in the orbfit output
+ - New models are added by registering them (see the bottom of this file), rather than by adding more if/elif branches
+
+Example non-grav params from the orbfit output ...
+
+"numparams": "7",        <<-- Total number of variational parameters
+                               ( 6 for the state, plus 0-4 for the non-gravs)
+"nongrav_model": "1",    <<--  1 => Asteroidal or Cometary:Marsden,
+                               2=> Cometary: YC,
+                               3=> Cometary: Yabushita
+"nongrav_params": "2",   <<-- Maximum number of non-grav params allowed in this model
+"nongrav_type": ["2"],   <<-- List of the coefficients that are used
+"nongrav_vals": [
+    "0.00000000000000E+00",
+    "-2.84420523316711E-03"
+],
+"""
+
+# Standard imports
+# -----------------------
+import itertools
+from collections import namedtuple
+
+
+NongravModel = namedtuple('NongravModel', [
+    'model_flags',          # keys of non_grav_booleans.non_grav_model to set True
+    'coefficient_names',    # names of the coefficients (also the keys of non_grav_booleans.non_grav_coefficients)
+    'value_indices',        # indices of the coefficients in "nongrav_vals"
+    'uncertainty_indices',  # indices of the coefficients in "rms" (i.e. after the 6 elements)
+])
+
+NONGRAV_REGISTRY = {}
+
+
+def register_nongrav_model(nongrav_model, nongrav_params, nongrav_type, model_flags, coefficient_names):
+    '''
+    Register a non-grav model
+
+    inputs:
+    -------
+    nongrav_model, nongrav_params: int
+    nongrav_type: list of int
+     - the (1-based) orbfit numbers of the coefficients that are used
+    model_flags: list of str
+     - the non_grav_booleans.non_grav_model flags that are set for this model
+    coefficient_names: list of str
+     - mpc_orb names of the coefficients, in the same order as nongrav_type
+    '''
+    nongrav_type = tuple(nongrav_type)
+    if len(coefficient_names) != len(nongrav_type):
+        raise Exception(f"nongrav_type={nongrav_type} is inconsistent with coefficient_names={coefficient_names}")
+    NONGRAV_REGISTRY[(nongrav_model, nongrav_params, nongrav_type)] = NongravModel(
+        model_flags         = tuple(model_flags),
+        coefficient_names   = tuple(coefficient_names),
+        value_indices       = tuple( t - 1 for t in nongrav_type ),
+        uncertainty_indices = tuple( 6 + j for j in range(len(nongrav_type)) ),
+    )
+
+def lookup(orbfit_component_dict):
+    '''
+    The registered model for a CAR/COM component of the (eq1) orbfit output
+
+    returns:
+    --------
+    NongravModel, or None if the orbit has no non-gravs
+    '''
+    d = orbfit_component_dict
+    numparams, nongrav_model = int(d["numparams"]), int(d["nongrav_model"])
+    if numparams == 6 and nongrav_model == 0:
+        return None
+
+    key = ( nongrav_model, int(d["nongrav_params"]), tuple(int(_) for _ in d["nongrav_type"]) )
+    model = NONGRAV_REGISTRY.get(key)
+    if model is None or numparams != 6 + len(key[2]):
+        raise Exception(f"Unexpected combination of nongrav parameters: (model, params, type)={key}, numparams={numparams}")
+    return model
+
+
+# -------------------------------------------------------------------
+# Registered models
+# -------------------------------------------------------------------
+
+# Asteroidal: solar radiation pressure & Yarkovski (each is both a "model" & a "coefficient" in mpc_orb)
+_ASTEROIDAL_COEFFICIENTS = {1: 'srp', 2: 'yarkovski'}
+for nongrav_type in [(1,), (2,), (1, 2)]:
+    names = [_ASTEROIDAL_COEFFICIENTS[t] for t in nongrav_type]
+    register_nongrav_model(1, 2, nongrav_type, names, names)
+
+# Cometary: Marsden, Yeomans & Chodas, Yabushita
+_COMETARY_MODELS       = {1: 'marsden', 2: 'yc', 3: 'yabushita'}
+_COMETARY_COEFFICIENTS = {1: 'A1', 2: 'A2', 3: 'A3', 4: 'DT'}
+for (nongrav_model, flag), nongrav_params, nongrav_type in itertools.product(
+        _COMETARY_MODELS.items(), [3, 4], [(1, 2), (1, 2, 3), (1, 2, 3, 4)]):
+    if len(nongrav_type) <= nongrav_params:
+        register_nongrav_model(nongrav_model, nongrav_params, nongrav_type, [flag], [_COMETARY_COEFFICIENTS[t] for t in nongrav_type])
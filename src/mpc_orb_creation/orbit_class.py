@@ -0,0 +1,180 @@
+"""
+mpc_orb_creation/orbit_class.py
+ - Vectorised assignment of the dynamical (orbit) class of N objects from their cometary elements
+   (fills orbit_type_str/int in the "categorization" section of mpc_orb)
+ - The codes are those of the MPC orbit-types list (https://minorplanetcenter.net/mpcops/documentation/orbit-types/),
+   which the mpc_orb schema refers to for orbit_type_int/str: 0-3 (Atira, Aten, Apollo, Amor), 9 (q < 1.665 au),
+   10-19 (Hungaria, MBA, Phocaea, Hilda, Jupiter Trojan, Centaur, Plutino, Other Resonant TNO, Cubewano, Scattered Disk),
+   20 (Hyperbolic), 21 (Parabolic) & 22 (Other)
+ - The classes are defined by an ordered rule table (ORBIT_CLASS_RULES): each rule is a set of intervals,
+   lower <= x < upper (or lower <= x, if upper = inf), on q, e, i, a & Q, and an object is given the
+   class of the *first* rule that it satisfies
+ - The table is compiled once into arrays of bounds, so that the whole catalogue can be re-classified
+   in a single call (e.g. when the class boundaries are changed)
+ - NB: The boundaries follow the conventional (MPC) definitions, e.g. Atira: a < 1 au & Q < 0.983 au, Aten: a < 1 au,
+       Apollo: a >= 1 au & q < 1.017 au, Amor: 1.017 <= q < 1.3 au, q < 1.665 au, ...
+ - NB: Objects that match no rule (e.g. 4.2 <= a < 5.05 au, or a < 2 au & q >= 1.665 au outside the Hungarias) are given
+       the catch-all type, 22 (Other)
+ - NB: The MPC list has no subtypes, so orbit_subtype_str/int are explicitly set to the template's "none" values ("" & null)
+"""
+
+# Standard imports
+# -----------------------
+import copy
+from collections import namedtuple
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+# local imports
+# -----------------------
+from mpc_orb_creation import catalogue
+
+
+# The quantities that the rules can constrain: perihelion distance [au], eccentricity,
+# inclination [deg], semi-major axis [au] & aphelion distance [au]
+QUANTITIES = ('q', 'e', 'i', 'a', 'Q')
+
+# Ordered rule table: (orbit_type_int, orbit_type_str, {quantity: (lower, upper)})
+# NB: Unbound orbits (e >= 1) have a = Q = inf
+# NB: There is no separate MPC type for Neptune Trojans (resonant, 1:1) nor for detached TNOs (scattered disk)
+INF = np.inf
+PARABOLIC_E = np.nextafter(1.0, INF)      # <<-- i.e. 1.0 <= e < PARABOLIC_E means e == 1.0
+ORBIT_CLASS_RULES = [
+    (21, 'Parabolic',                {'e': (1.0, PARABOLIC_E)}),
+    (20, 'Hyperbolic',               {'e': (PARABOLIC_E, INF)}),
+    ( 0, 'Atira',                    {'q': (0.0, 1.3),  'a': (0.0, 1.0),   'Q': (0.0, 0.983)}),
+    ( 1, 'Aten',                     {'q': (0.0, 1.3),  'a': (0.0, 1.0)}),
+    ( 2, 'Apollo',                   {'q': (0.0, 1.017)}),
+    ( 3, 'Amor',                     {'q': (0.0, 1.3)}),
+    ( 9, 'Object with q < 1.665 AU', {'q': (1.3, 1.665)}),
+    (10, 'Hungaria',                 {'a': (1.78, 2.0),  'e': (0.0, 0.18), 'i': (16.0, 34.0)}),
+    (12, 'Phocaea',                  {'a': (2.25, 2.5),  'e': (0.1, 1.0),  'i': (18.0, 32.0)}),
+    (11, 'MBA',                      {'a': (2.0, 3.7)}),
+    (13, 'Hilda',                    {'a': (3.7, 4.2),   'e': (0.0, 0.3),  'i': (0.0, 20.0)}),
+    (14, 'Jupiter Trojan',           {'a': (5.05, 5.35), 'e': (0.0, 0.3)}),
+    (17, 'Other Resonant TNO',       {'a': (29.8, 30.4), 'e': (0.0, 0.2)}),
+    (15, 'Centaur',                  {'a': (5.5, 30.1)}),
+    (16, 'Plutino',                  {'a': (39.2, 39.8)}),
+    (18, 'Cubewano',                 {'a': (39.8, 48.4), 'q': (35.0, INF)}),
+    (19, 'Scattered Disk',           {'a': (30.1, INF)}),
+]
+
+# Objects that do not satisfy any rule: the catch-all MPC type
+UNCLASSIFIED = (22, 'Other')
+
+
+CompiledRules = namedtuple('CompiledRules', ['lower', 'upper', 'orbit_type_int', 'orbit_type_str'])
+
+def compile_rules(rules):
+    '''
+    Compile a rule table into arrays
+
+    returns:
+    --------
+    CompiledRules
+     - lower, upper : (R, len(QUANTITIES)) arrays of bounds (unconstrained quantities are (-inf, inf))
+     - orbit_type_int, orbit_type_str : (R+1,) arrays,
+       the last entry of which is UNCLASSIFIED
+    '''
+    lower = np.full( (len(rules), len(QUANTITIES)), -np.inf )
+    upper = np.full( (len(rules), len(QUANTITIES)),  np.inf )
+    for r, rule in enumerate(rules):
+        for quantity, (lo, hi) in rule[2].items():
+            if quantity not in QUANTITIES:
+                raise Exception(f"Unknown quantity in orbit-class rule {rule[:2]}: {quantity} (expected one of {QUANTITIES})")
+            k = QUANTITIES.index(quantity)
+            lower[r, k], upper[r, k] = lo, hi
+
+    labels = list(zip(*( [tuple(rule[:2]) for rule in rules] + [UNCLASSIFIED] )))
+    return CompiledRules( lower, upper, np.array(labels[0], dtype=int), np.array(labels[1], dtype=str) )
+
+COMPILED_RULES = compile_rules(ORBIT_CLASS_RULES)
+
+
+# -------------------------------------------------------------------
+# Classification
+# -------------------------------------------------------------------
+
+def derived_quantities(com):
+    '''
+    q, e, i, a & Q from the cometary elements
+
+    inputs:
+    -------
+    com: (N,>=3) array-like
+     - q [au], e, i [deg], ... (any further columns are ignored)
+
+    returns:
+    --------
+    (N, len(QUANTITIES)) array
+    '''
+    com  = np.atleast_2d( np.asarray(com, dtype=np.float64) )
+    q, e, incl = com[:, 0], com[:, 1], com[:, 2]
+    bound = e < 1.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = np.where(bound, q / (1.0 - e), np.inf)
+    Q = np.where(bound, a * (1.0 + e), np.inf)
+    return np.stack([q, e, incl, a, Q], axis=1)
+
+def classify(com, rules=None):
+    '''
+    Orbit class of N objects (first matching rule)
+
+    inputs:
+    -------
+    com: (N,>=3) array-like
+     - cometary elements: q [au], e, i [deg] (any further columns are ignored)
+    rules: list or CompiledRules, optional
+     - rule table (defaults to ORBIT_CLASS_RULES)
+
+    returns:
+    --------
+    dict of (N,) arrays
+     - 'orbit_type_int', 'orbit_type_str' (UNCLASSIFIED for objects that match no rule)
+    '''
+    rules  = COMPILED_RULES if rules is None else rules if isinstance(rules, CompiledRules) else compile_rules(rules)
+    values = derived_quantities(com)
+    N, R   = values.shape[0], rules.lower.shape[0]
+
+    # Index of the first matching rule (R if none match, i.e. UNCLASSIFIED)
+    # NB: Looping over the (few) rules keeps the memory use O(N)
+    index = np.full(N, R)
+    for r in range(R):
+        match = (index == R) & np.all( (values >= rules.lower[r]) & ((values < rules.upper[r]) | (rules.upper[r] == np.inf)), axis=1 )
+        index[match] = r
+
+    return {
+        'orbit_type_int'    : rules.orbit_type_int[index],
+        'orbit_type_str'    : rules.orbit_type_str[index],
+    }
+
+def classes_for_object(classes, n):
+    ''' The class of the n-th object, as a categorization (sub-)dict of python types (no MPC subtypes: "" & None) '''
+    return {
+        'orbit_type_int'    : int(classes['orbit_type_int'][n]),
+        'orbit_type_str'    : str(classes['orbit_type_str'][n]),
+        'orbit_subtype_int' : None,
+        'orbit_subtype_str' : '',
+    }
+
+def reclassify_catalogue(docs, rules=None):
+    '''
+    Re-classify a catalogue snapshot (list of mpc_orb dicts) in one vectorised call
+     - See catalogue.get_snapshot
+
+    returns:
+    --------
+    list of updated mpc_orb dicts (the input dicts are not modified)
+    '''
+    if not docs:
+        return []
+    classes = classify( catalogue.to_arrays(docs, 'COM')['elements'], rules=rules )
+
+    reclassified = []
+    for n, doc in enumerate(docs):
+        doc = copy.copy(doc)
+        doc['categorization'] = dict( doc['categorization'], **classes_for_object(classes, n) )
+        reclassified.append(doc)
+    return reclassified
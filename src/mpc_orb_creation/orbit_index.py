@@ -0,0 +1,320 @@
+"""
+mpc_orb_creation/orbit_index.py
+ - Spatial index over the (cometary) orbits of a catalogue, for orbital-similarity (D-criterion) queries:
+   k-nearest neighbours, radius queries & a bulk self-join (candidate duplicates / linkages)
+ - Replaces a linear scan over the catalogue for each query orbit with a KD-tree search
+ - D-criteria (D_CRITERIA)
+   D_SH (Southworth & Hawkins 1963):
+     D^2 = (e2 - e1)^2 + (q2 - q1)^2 + (2 sin(I/2))^2 + ((e1 + e2)/2)^2 (2 sin(PI/2))^2
+   D_H  (Jopek 1993): as D_SH, but with ((q2 - q1)/(q2 + q1))^2 as the perihelion-distance term
+   where I is the mutual inclination of the orbits & PI is the difference of their longitudes of perihelion,
+   measured from the mutual node
+ - The KD-tree is built over a Euclidean embedding of the orbits, in which the distance is never larger than the
+   D-criterion, so a search of the tree returns a superset of the answer, which is then filtered / ranked on the exact
+   D-criterion. The embedding is (q, b e, b n, c min(e,1) P), with n & P the unit orbit normal & perihelion direction:
+   2 sin(I/2) = |n1 - n2| & |e1 P1 - e2 P2| <= |e2 - e1| + 2 sin(I/2) + ((e1 + e2)/2) 2 sin(PI/2), so that
+   b^2 + 3 c^2 <= 1 ensures the lower bound
+ - All queries are batched: the queries that reach a node of the tree are processed together, so the work at each
+   leaf is a single (n_queries, leaf_size) numpy operation
+ - NB: The D-criteria do not depend on the peri_time, so (for two-body motion) orbits at different epochs can be compared
+"""
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+# local imports
+# -----------------------
+from mpc_orb_creation import catalogue
+
+
+# Number of orbits in each leaf of the KD-tree
+LEAF_SIZE = 32
+
+# Number of query orbits processed at a time (limits the size of the temporary arrays)
+QUERY_CHUNK_SIZE = 4096
+
+# Weight of q in the embedding, for each D-criterion (0: the q-term of D_H is not bounded by |q2 - q1|)
+D_CRITERIA = {'D_SH': 1.0, 'D_H': 0.0}
+
+# Weights of (e, orbit normal) & of the eccentricity vector in the embedding (b^2 + 3 c^2 = 1)
+EMBEDDING_WEIGHTS = (np.sqrt(0.5), np.sqrt(1.0 / 6.0))
+
+
+# -------------------------------------------------------------------
+# D-criteria
+# -------------------------------------------------------------------
+
+def _orbit_normals(com):
+    ''' Unit normals of the orbital planes of (N,>=5) cometary elements (i & node in degrees) '''
+    incl, node = np.radians(com[:, 2]), np.radians(com[:, 3])
+    return np.stack( [np.sin(incl) * np.sin(node), -np.sin(incl) * np.cos(node), np.cos(incl)], axis=-1 )
+
+def _perihelion_directions(com):
+    ''' Unit vectors towards the perihelia of (N,>=5) cometary elements (i, node & argperi in degrees) '''
+    incl, node, peri = np.radians(com[:, 2]), np.radians(com[:, 3]), np.radians(com[:, 4])
+    return np.stack( [np.cos(node) * np.cos(peri) - np.sin(node) * np.sin(peri) * np.cos(incl),
+                      np.sin(node) * np.cos(peri) + np.cos(node) * np.sin(peri) * np.cos(incl),
+                      np.sin(peri) * np.sin(incl)], axis=-1 )
+
+def embed(com, metric='D_SH'):
+    '''
+    Euclidean embedding of (N,>=5) cometary elements (q, e, i, node, argperi, ...), in which |x1 - x2| <= D(orbit1, orbit2)
+
+    returns:
+    --------
+    (N,8) array: (w q, b e, b n, c min(e,1) P), with w from D_CRITERIA & (b, c) = EMBEDDING_WEIGHTS
+    '''
+    if metric not in D_CRITERIA:
+        raise Exception(f"Unknown D-criterion {metric}: expected one of {list(D_CRITERIA)}")
+    com  = np.atleast_2d( np.asarray(com, dtype=np.float64) )
+    b, c = EMBEDDING_WEIGHTS
+    return np.concatenate( [D_CRITERIA[metric] * com[:, :1], b * com[:, 1:2], b * _orbit_normals(com),
+                            c * np.minimum(com[:, 1:2], 1.0) * _perihelion_directions(com)], axis=1 )
+
+def d_criterion(com1, com2, metric='D_SH'):
+    '''
+    D-criterion between (N,>=5) & (N,>=5) (or broadcastable) cometary elements
+
+    returns:
+    --------
+    (N,) array
+    '''
+    if metric not in D_CRITERIA:
+        raise Exception(f"Unknown D-criterion {metric}: expected one of {list(D_CRITERIA)}")
+    com1, com2 = np.atleast_2d( np.asarray(com1, dtype=np.float64) ), np.atleast_2d( np.asarray(com2, dtype=np.float64) )
+    q1, e1, i1, node1, peri1 = [com1[:, _] for _ in range(5)]
+    q2, e2, i2, node2, peri2 = [com2[:, _] for _ in range(5)]
+
+    # Mutual inclination: 2 sin(I/2) = |n1 - n2|
+    chord_I = np.linalg.norm( _orbit_normals(com2) - _orbit_normals(com1), axis=-1 )
+    cos_half_I = np.sqrt( np.clip(1.0 - (chord_I / 2)**2, 0.0, 1.0) )
+
+    # Difference of the longitudes of perihelion, measured from the mutual node
+    # (the sign of the node term changes if |node2 - node1| > 180, for nodes in [0, 360))
+    dnode = np.remainder(node2, 360.0) - np.remainder(node1, 360.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.cos( np.radians(i1 + i2) / 2 ) * np.sin( np.radians(dnode) / 2 ) / cos_half_I
+    node_term = 2 * np.degrees( np.arcsin( np.clip( np.nan_to_num(x), -1.0, 1.0 ) ) )
+    PI = peri2 - peri1 + np.where( np.abs(dnode) > 180.0, -node_term, node_term )
+
+    dq = q2 - q1 if metric == 'D_SH' else (q2 - q1) / (q2 + q1)
+    return np.sqrt( (e2 - e1)**2 + dq**2 + chord_I**2 + ((e1 + e2) / 2 * 2 * np.sin( np.radians(PI) / 2 ))**2 )
+
+
+# -------------------------------------------------------------------
+# Index
+# -------------------------------------------------------------------
+
+class OrbitIndex():
+    '''
+    KD-tree over the orbits of a catalogue, for D-criterion queries
+    E.g.
+    >>> index = OrbitIndex.from_catalogue(docs)
+    >>> index.query(com, k=5)                   # <<-- 5 nearest orbits to each of the (M,6) orbits in com
+    >>> index.query_radius(com, 0.05)           # <<-- all orbits within D < 0.05 of each orbit in com
+    >>> index.self_join(0.02)                   # <<-- all pairs of catalogue orbits within D < 0.02
+
+    inputs:
+    -------
+    com: (N,>=5) array-like
+     - cometary elements: q [au], e, i, node, argperi [deg], ...
+    designations: list, optional
+     - labels of the orbits (e.g. the unpacked designations)
+    metric: str
+     - a key of D_CRITERIA
+    leaf_size: int
+    '''
+
+    def __init__(self, com, designations=None, metric='D_SH', leaf_size=LEAF_SIZE):
+        self.com          = np.atleast_2d( np.asarray(com, dtype=np.float64) )[:, :5].copy()
+        self.designations = np.asarray(designations) if designations is not None else None
+        self.metric       = metric
+        self.leaf_size    = leaf_size
+        self.points       = embed(self.com, metric)
+        self._build()
+
+    @classmethod
+    def from_catalogue(cls, docs, designations=None, **kwargs):
+        ''' Index over a catalogue snapshot (list of mpc_orb dicts, see catalogue.get_snapshot) '''
+        if designations is None:
+            designations = [doc['designation_data']['unpacked_primary_provisional_designation'] for doc in docs]
+        return cls( catalogue.to_arrays(docs, 'COM')['elements'], designations=designations, **kwargs )
+
+    def __len__(self):
+        return self.com.shape[0]
+
+    def __repr__(self):
+        return f"OrbitIndex(N={len(self)}, metric={self.metric}, n_nodes={self.start.size})"
+
+    # ---- Construction ----
+    def _build(self):
+        '''
+        Build the tree: each node is split at the median of its widest (embedded) dimension
+         - self.order     : orbit indices, permuted so that each node is a contiguous block (start:end)
+         - self.lo/hi     : (n_nodes, 8) bounding boxes
+         - self.children  : (n_nodes, 2) indices of the child nodes (-1 for the leaves)
+        '''
+        N = len(self)
+        order = np.arange(N)
+        start, end, children, lo, hi = [0], [N], [[-1, -1]], [], []
+        n = 0
+        while n < len(start):
+            block = self.points[ order[start[n]:end[n]] ]
+            lo.append( block.min(axis=0) if block.size else np.full(self.points.shape[1], np.inf) )
+            hi.append( block.max(axis=0) if block.size else np.full(self.points.shape[1], -np.inf) )
+            if end[n] - start[n] > self.leaf_size:
+                dim  = np.argmax( hi[n] - lo[n] )
+                half = (end[n] - start[n]) // 2
+                order[start[n]:end[n]] = order[start[n]:end[n]][ np.argpartition(block[:, dim], half) ]
+                children[n] = [len(start), len(start) + 1]
+                start += [start[n], start[n] + half]
+                end   += [start[n] + half, end[n]]
+                children += [[-1, -1], [-1, -1]]
+            n += 1
+
+        self.order    = order
+        self.start    = np.array(start)
+        self.end      = np.array(end)
+        self.children = np.array(children).reshape(-1, 2)
+        self.lo, self.hi = np.array(lo).reshape(-1, self.points.shape[1]), np.array(hi).reshape(-1, self.points.shape[1])
+
+    def _min_distance(self, x, node):
+        ''' Minimum embedded distance from (M,8) points to the bounding box of a node '''
+        return np.linalg.norm( np.maximum( np.maximum(self.lo[node] - x, x - self.hi[node]), 0.0 ), axis=1 )
+
+    # ---- Embedded (lower-bound) searches ----
+    def _candidates(self, x, r):
+        '''
+        All (query, orbit) pairs with embedded distance <= r
+
+        returns:
+        --------
+        (n_pairs,) query indices, (n_pairs,) orbit indices
+        '''
+        qs, ps = [], []
+        stack  = [ (0, np.arange(x.shape[0])) ]
+        while stack:
+            node, q = stack.pop()
+            q = q[ self._min_distance(x[q], node) <= r[q] ]
+            if not q.size:
+                continue
+            if self.children[node, 0] < 0:
+                p = self.order[ self.start[node]:self.end[node] ]
+                d = np.linalg.norm( x[q, np.newaxis, :] - self.points[p][np.newaxis], axis=-1 )
+                qi, pi = np.nonzero( d <= r[q, np.newaxis] )
+                qs.append( q[qi] )
+                ps.append( p[pi] )
+            else:
+                stack += [ (self.children[node, 0], q), (self.children[node, 1], q) ]
+        if not qs:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int)
+        return np.concatenate(qs), np.concatenate(ps)
+
+    def _nearest(self, x, k):
+        '''
+        The k nearest orbits in the embedding (fewer if len(self) < k)
+
+        returns:
+        --------
+        (M,k) orbit indices (-1 if missing)
+        '''
+        M = x.shape[0]
+        best_d, best_p = np.full((M, k), np.inf), np.full((M, k), -1)
+        stack = [ (0, np.arange(M)) ]
+        while stack:
+            node, q = stack.pop()
+            q = q[ self._min_distance(x[q], node) < best_d[q, -1] ]
+            if not q.size:
+                continue
+            if self.children[node, 0] < 0:
+                p = self.order[ self.start[node]:self.end[node] ]
+                d = np.concatenate( [best_d[q], np.linalg.norm( x[q, np.newaxis, :] - self.points[p][np.newaxis], axis=-1 )], axis=1 )
+                i = np.concatenate( [best_p[q], np.broadcast_to(p, (q.size, p.size))], axis=1 )
+                keep = np.argsort(d, axis=1, kind='stable')[:, :k]
+                best_d[q], best_p[q] = np.take_along_axis(d, keep, axis=1), np.take_along_axis(i, keep, axis=1)
+            else:
+                # Visit the child that is nearer (on average) to the queries first (i.e. push it last)
+                left, right = self.children[node]
+                if self._min_distance(x[q], left).mean() < self._min_distance(x[q], right).mean():
+                    left, right = right, left
+                stack += [ (left, q), (right, q) ]
+        return best_p
+
+    # ---- Queries ----
+    def query_radius(self, com, r):
+        '''
+        All catalogue orbits within D <= r of each of M query orbits
+
+        inputs:
+        -------
+        com: (M,>=5) array-like
+        r: float or (M,) array-like
+
+        returns:
+        --------
+        dict of (n_pairs,) arrays, sorted by query & then by D
+         - 'query'    : index of the query orbit
+         - 'index'    : index of the catalogue orbit
+         - 'distance' : D
+        '''
+        com = np.atleast_2d( np.asarray(com, dtype=np.float64) )
+        r   = np.broadcast_to( np.asarray(r, dtype=np.float64), (com.shape[0],) )
+        qs, ps, ds = [], [], []
+        for chunk in range(0, com.shape[0], QUERY_CHUNK_SIZE):
+            s = slice(chunk, min(chunk + QUERY_CHUNK_SIZE, com.shape[0]))
+            q, p = self._candidates( embed(com[s], self.metric), r[s] )
+            d = d_criterion(com[s][q], self.com[p], self.metric)
+            keep = d <= r[s][q]
+            qs.append( q[keep] + chunk )
+            ps.append( p[keep] )
+            ds.append( d[keep] )
+        q, p, d = [ np.concatenate(_) if _ else np.empty(0) for _ in [qs, ps, ds] ]
+        o = np.lexsort( (d, q) )
+        return {'query': q[o].astype(int), 'index': p[o].astype(int), 'distance': d[o]}
+
+    def query(self, com, k=1):
+        '''
+        The k catalogue orbits with the smallest D from each of M query orbits
+         - The k nearest in the embedding give an upper bound on the D of the k-th nearest orbit, &
+           a radius search to that bound then finds the exact answer
+
+        returns:
+        --------
+        (M,k) D-criteria (inf if missing), (M,k) orbit indices (-1 if missing), sorted by D
+        '''
+        com = np.atleast_2d( np.asarray(com, dtype=np.float64) )
+        M   = com.shape[0]
+        distance, index = np.full((M, k), np.inf), np.full((M, k), -1)
+        if not len(self) or not M:
+            return distance, index
+
+        nearest = np.concatenate( [ self._nearest( embed(com[s], self.metric), k )
+                                    for s in [slice(_, _ + QUERY_CHUNK_SIZE) for _ in range(0, M, QUERY_CHUNK_SIZE)] ] )
+        bound = np.where( nearest >= 0, d_criterion( np.repeat(com, k, axis=0), self.com[nearest.reshape(-1)], self.metric ).reshape(M, k), -np.inf ).max(axis=1)
+        bound = np.where( (nearest >= 0).all(axis=1), bound, np.inf )
+
+        pairs = self.query_radius(com, bound)
+        rank  = np.arange(pairs['query'].size) - np.searchsorted(pairs['query'], pairs['query'])
+        keep  = rank < k
+        distance[pairs['query'][keep], rank[keep]] = pairs['distance'][keep]
+        index[pairs['query'][keep], rank[keep]]    = pairs['index'][keep]
+        return distance, index
+
+    def self_join(self, r):
+        '''
+        All pairs of catalogue orbits (i < j) within D <= r, e.g. candidate duplicate orbits / linkages
+
+        returns:
+        --------
+        dict of (n_pairs,) arrays, sorted by D
+         - 'i', 'j'   : indices of the orbits (& 'designation_i', 'designation_j' if the index has designations)
+         - 'distance' : D
+        '''
+        pairs = self.query_radius(self.com, r)
+        keep  = pairs['query'] < pairs['index']
+        o     = np.argsort( pairs['distance'][keep], kind='stable' )
+        out   = {'i': pairs['query'][keep][o], 'j': pairs['index'][keep][o], 'distance': pairs['distance'][keep][o]}
+        if self.designations is not None:
+            out['designation_i'], out['designation_j'] = self.designations[out['i']], self.designations[out['j']]
+        return out
@@ -21,6 +21,8 @@ import numpy as np
 # -----------------------
 import interpret
 from schema import validate_mpcorb
+from mpc_orb_creation import covariance
+from mpc_orb_creation import integrator
 
 
 class MPCORB():
@@ -73,7 +75,6 @@ class MPCORB():
             self._populate_coord_components(coord_attr)
             
         # convenience method to return data to be passed into mpc-integrator
-        # *** NOT YET IMPLEMENTED ***
         self._populate_integrator_data()
         
         # Is there some other stuff we want to provide as convenient attributes?
@@ -96,13 +97,7 @@ class MPCORB():
     def _generate_square_CoV(self, coord_attr ):
         """ populate square array from triangular elements """
         num_params       = self.__dict__[coord_attr]['numparams']
-        covariance_array = np.empty( [num_params,num_params] )
-        print('num_params',num_params, 'covariance_array.shape', covariance_array.shape )
-        for i in range(num_params):
-            for j in range(i,num_params):
-                covariance_array[i,j] = covariance_array[j,i] = self.__dict__[coord_attr]['covariance']['cov%d%d' % (i,j)]
-                
-        return covariance_array
+        return covariance.PackedCovariance.from_dict( self.__dict__[coord_attr]['covariance'], num_params ).to_array()
 
     def _generate_element_array(self,  coord_attr ):
         """ turn element dict into numpy array (with fixed ordering) """
@@ -142,11 +137,11 @@ class MPCORB():
     '''
 
 
-    def _populate_integrator_data(self,):
+    def _populate_integrator_data(self, sun_state=None):
         """
         Rebound-Ephem Integrator wants certain standard inputs
         This function drags together the parts of the data required from the mpcorb-json ...
-        and combines it into a single convenient ... dict?
+        and combines it into a single convenient dict, self.integrator_data (see integrator.export)
         
         https://github.com/matthewholman/reboundx/blob/holman/examples/ephem_forces/ephem_forces.py
         def integration_function(tstart, tstep, trange,
@@ -157,6 +152,10 @@ class MPCORB():
                          invar_part,
                          invar,
                          epsilon = 1e-8)
+
+        NB: For many objects at once, use integrator.export_mpcorb (the arrays here are for this one object)
+        NB: The integrator needs barycentric states, so self.integrator_data is None until this is called again with
+            the barycentric state of the Sun at the epoch (sun_state, see integrator.export)
         """
-        pass
+        self.integrator_data = integrator.export_mpcorb( [self], sun_state=sun_state ) if sun_state is not None else None
         
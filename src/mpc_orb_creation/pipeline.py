@@ -0,0 +1,250 @@
+"""
+mpc_orb_creation/pipeline.py
+ - asyncio driver for back-filling / regenerating the mpc_orb jsons in the orbfit_results table
+ - Overlaps the three stages of utility_popn.populate_orbfit_results:
+   (a) fetch of the orbfit dictionaries from the backend   (I/O thread)
+   (b) construction of the mpc_orb dict                    (process pool: CPU-bound)
+   (c) write-back of the mpc_orb dict to the backend       (I/O thread)
+ - The stages are connected by bounded queues, so that a slow stage applies back-pressure to the earlier ones
+ - Optionally (shared_memory=True), the numeric parts of the constructed dicts (elements, covariances & statistics) are
+   returned from the workers through shared-memory ring buffers, rather than being pickled (see transport.py)
+"""
+
+# Standard imports
+# -----------------------
+import asyncio
+import concurrent.futures
+import os
+
+# local imports
+# -----------------------
+from mpc_orb_creation import backends
+from mpc_orb_creation import construct
+from mpc_orb_creation import deadletter
+from mpc_orb_creation import transport
+from mpc_orb_creation import utility_popn
+
+
+# -------------------------------------------------------------------
+# Worker-side construction
+# -------------------------------------------------------------------
+
+def construct_worker(construct_func, designation_backend, construct_args, unpacked, clock=None, shared_memory=False,
+                     updated_at=None, ele220=None, quality_dict=None):
+    '''
+    Run in the process pool: construct a single mpc_orb dict
+    NB: Must be a top-level function (and construct_func importable) so it can be pickled
+    NB: If the otherdict in construct_args is None, it is made here (from updated_at, ele220 & quality_dict, see utility_popn.make_otherdict),
+        as counting the oppositions (when there is no ele220) is CPU-bound & must not block the event loop
+
+    returns:
+    --------
+    mpcorb_dict, list of any failure entries (see deadletter.make_entry)
+     - if shared_memory, a (non-empty) mpcorb_dict is returned as a transport handle (see transport.send)
+    '''
+    eq0dict, eq1dict, rwodict, moidsdict, otherdict = construct_args
+    failures = deadletter.FailureCollector()
+    if otherdict is None:
+        try:
+            otherdict = utility_popn.make_otherdict(rwodict, eq1dict, updated_at, ele220, quality_dict=quality_dict)
+        except Exception as e:
+            failures.record(unpacked, 'otherdict', e)
+            return {}, failures.entries
+    mpcorb_dict = construct_func(eq0dict, eq1dict, rwodict, moidsdict, otherdict, VERBOSE=False,
+                                 designation_backend=designation_backend, dead_letter=failures, unpacked=unpacked, clock=clock)
+    if shared_memory and mpcorb_dict:
+        mpcorb_dict = transport.send(mpcorb_dict)
+    return mpcorb_dict, failures.entries
+
+
+# -------------------------------------------------------------------
+# Pipeline
+# -------------------------------------------------------------------
+
+async def run_pipeline( backend, designations=None, n_max=None, designation_backend=None,
+                        executor=None, n_workers=None, queue_size=None, io_workers=1,
+                        construct_func=None, dead_letter=None, retry_failed=False, retry_unchanged=False, clock=None,
+                        shared_memory=False, buffer_size=None, change_feed=None, VERBOSE=True ):
+    '''
+    Fetch -> construct -> write the mpc_orb dicts for the designations in the backend
+
+    inputs:
+    -------
+    backend: backends.OrbfitResultsBackend
+     - store of orbfit results to read from & write to
+    designations: list of str, optional
+     - unpacked designations to process (defaults to those returned by backend.query_unpacked_orbfit_results(n_max))
+    designation_backend: backends.DesignationBackend, optional
+     - designation-identifier used by construct (must be picklable if a process pool is used)
+    executor: concurrent.futures.Executor, optional
+     - pool used for construction (defaults to a ProcessPoolExecutor with n_workers processes)
+    queue_size: int, optional
+     - maximum number of items waiting between stages (defaults to 2*n_workers)
+    io_workers: int
+     - number of threads used for backend I/O
+     - NB: Leave at 1 for the SQLite backends (access to a connection must be serialised)
+    construct_func: function, optional
+     - defaults to construct.construct
+    dead_letter: deadletter.DeadLetterQueue, optional
+     - failed designations are recorded here (by the parent process), and removed once successfully written
+    retry_failed: bool
+     - if True, only the designations in the dead_letter queue are (re)processed ...
+     - ... & only those whose inputs have changed since the failure (see deadletter.orbfit_inputs), unless retry_unchanged
+     - designations that no longer have any orbfit data are removed from the queue
+    retry_unchanged: bool
+     - if True, the retry also reprocesses the designations whose inputs are unchanged (e.g. after a fix to the code)
+    clock: function, datetime or str, optional
+     - source of the mpcorb_creation_datetime (see construct.creation_datetime; must be picklable if a process pool is used)
+    shared_memory: bool
+     - if True, the workers return the numeric parts of the constructed dicts through shared-memory ring buffers (see transport.py)
+     - NB: requires the pipeline's own process pool (i.e. executor=None)
+    buffer_size: int, optional
+     - size of the ring buffer of each worker [bytes] (defaults to transport.DEFAULT_BUFFER_SIZE)
+    change_feed: changefeed.ChangeFeed, optional
+     - if supplied, a change record (JSON patch) is appended for each document that is written (by the I/O thread)
+
+    returns:
+    --------
+    dict of counts: 'fetched', 'constructed', 'written', 'skipped' (unchanged documents that were not re-written), 'failed'
+    '''
+    if retry_failed and dead_letter is None:
+        raise Exception("retry_failed requires a dead_letter queue")
+    if shared_memory and executor is not None:
+        raise Exception("The shared-memory transport requires the pipeline's own process pool (executor=None)")
+
+    loop            = asyncio.get_running_loop()
+    n_workers       = n_workers if n_workers else (os.cpu_count() or 1)
+    queue_size      = queue_size if queue_size else 2 * n_workers
+    construct_func  = construct_func if construct_func is not None else construct.construct
+    stats           = {'fetched': 0, 'constructed': 0, 'written': 0, 'skipped': 0, 'failed': 0}
+
+    own_executor    = executor is None
+    results         = transport.ResultTransport(n_workers, buffer_size) if shared_memory else None
+    executor        = (results.executor() if shared_memory else concurrent.futures.ProcessPoolExecutor(max_workers=n_workers)) if own_executor else executor
+    io_executor     = concurrent.futures.ThreadPoolExecutor(max_workers=io_workers)
+
+    def record_failure(unpacked, stage, e, inputs_hash=None):
+        stats['failed'] += 1
+        print(f'Exception in *{stage}*', unpacked, '\n', e)
+        if dead_letter is not None:
+            dead_letter.record(unpacked, stage, e, inputs_hash=inputs_hash)
+
+    def fetch(unpacked):
+        ''' The orbfit dictionaries & quality output (& the hash of the dictionaries, if failures are being recorded) '''
+        rwo_dict, mid_epoch_dict, standard_epoch_dict, updated_at, ele220 = backend.get_dictionaries(unpacked=unpacked)
+        quality_dict = backend.get_quality_dict(unpacked=unpacked) if rwo_dict else {}
+        inputs_hash = deadletter.input_hash( deadletter.orbfit_inputs(rwo_dict, mid_epoch_dict, standard_epoch_dict, updated_at, ele220) ) \
+                      if dead_letter is not None else None
+        return rwo_dict, mid_epoch_dict, standard_epoch_dict, updated_at, ele220, quality_dict, inputs_hash
+
+    construct_queue = asyncio.Queue(maxsize=queue_size)
+    write_queue     = asyncio.Queue(maxsize=queue_size)
+
+    async def fetch_stage():
+        ''' (a) fetch the orbfit dictionaries & queue them for construction '''
+        desigs = designations
+        if desigs is None and retry_failed:
+            desigs = (await loop.run_in_executor(io_executor, dead_letter.designations))[:n_max]
+        if desigs is None:
+            desigs = await loop.run_in_executor(io_executor, backend.query_unpacked_orbfit_results, n_max)
+        if VERBOSE:
+            print(f'len(unpacked_desig_list)={len(desigs)}')
+
+        for unpacked in desigs:
+            try:
+                rwo_dict, mid_epoch_dict, standard_epoch_dict, updated_at, ele220, quality_dict, inputs_hash = \
+                    await loop.run_in_executor(io_executor, fetch, unpacked)
+
+                # Skip on to the next object if we do not have data to work with ...
+                # ... (& there is then nothing to retry)
+                if not (rwo_dict and mid_epoch_dict and standard_epoch_dict):
+                    if dead_letter is not None:
+                        await loop.run_in_executor(io_executor, dead_letter.remove, unpacked)
+                    continue
+
+                # Failures whose inputs are unchanged would fail again: leave them in the queue
+                if retry_failed and not retry_unchanged and \
+                   not await loop.run_in_executor(io_executor, dead_letter.inputs_changed, unpacked, inputs_hash):
+                    if VERBOSE:
+                        print('Inputs unchanged since the failure: not retried', unpacked)
+                    continue
+
+                # NB: The otherdict is made by the worker (see construct_worker)
+                stats['fetched'] += 1
+                await construct_queue.put( (unpacked, updated_at, ele220, quality_dict, inputs_hash, (mid_epoch_dict, standard_epoch_dict, rwo_dict, {}, None)) )
+
+            except Exception as e:
+                await loop.run_in_executor(io_executor, record_failure, unpacked, 'fetch', e)
+
+        for _ in range(n_workers):
+            await construct_queue.put(None)
+
+    async def construct_stage():
+        ''' (b) construct in the process pool & queue the results for writing '''
+        while True:
+            item = await construct_queue.get()
+            if item is None:
+                return
+            unpacked, updated_at, ele220, quality_dict, inputs_hash, construct_args = item
+            try:
+                mpcorb_dict, failures = await loop.run_in_executor(executor, construct_worker, construct_func, designation_backend, construct_args, unpacked,
+                                                                   clock, shared_memory, updated_at, ele220, quality_dict)
+                if shared_memory:
+                    mpcorb_dict = results.receive(mpcorb_dict)
+            except Exception as e:
+                await loop.run_in_executor(io_executor, record_failure, unpacked, 'construct', e, inputs_hash)
+                continue
+
+            # construct returns an empty dict on failure: don't overwrite the stored json with that
+            # NB: The failures are recorded against the hash of the fetched inputs (see deadletter.orbfit_inputs)
+            if mpcorb_dict:
+                stats['constructed'] += 1
+                await write_queue.put( (unpacked, updated_at, inputs_hash, mpcorb_dict) )
+            else:
+                stats['failed'] += 1
+                if dead_letter is not None:
+                    for entry in failures:
+                        await loop.run_in_executor(io_executor, dead_letter.add, dict(entry, input_hash=inputs_hash))
+
+    async def write_stage():
+        ''' (c) write back to the backend (skipping documents that are unchanged) '''
+        while True:
+            item = await write_queue.get()
+            if item is None:
+                return
+            unpacked, updated_at, inputs_hash, mpcorb_dict = item
+            try:
+                written = await loop.run_in_executor(io_executor, backend.write_mpc_orb_dict, unpacked, updated_at, mpcorb_dict, change_feed)
+                stats['written' if written else 'skipped'] += 1
+            except Exception as e:
+                await loop.run_in_executor(io_executor, record_failure, unpacked, 'insert', e, inputs_hash)
+                continue
+            if dead_letter is not None:
+                await loop.run_in_executor(io_executor, dead_letter.remove, unpacked)
+
+    async def construct_stages():
+        await asyncio.gather(*[construct_stage() for _ in range(n_workers)])
+        await write_queue.put(None)
+
+    try:
+        await asyncio.gather(fetch_stage(), construct_stages(), write_stage())
+    finally:
+        io_executor.shutdown(wait=True)
+        if own_executor:
+            executor.shutdown(wait=True)
+        if shared_memory:
+            results.close()
+
+    if VERBOSE:
+        print(f'pipeline: {stats}')
+    return stats
+
+
+def populate_orbfit_results( n_max = None , backend = None, designation_backend = None, **kwargs ):
+    '''
+    Synchronous entry point: asyncio equivalent of utility_popn.populate_orbfit_results
+    See run_pipeline for the optional keyword arguments
+    '''
+    if backend is None:
+        backend = backends.PostgresOrbfitResultsBackend()
+    return asyncio.run( run_pipeline(backend, n_max=n_max, designation_backend=designation_backend, **kwargs) )
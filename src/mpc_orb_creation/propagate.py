@@ -0,0 +1,198 @@
+"""
+mpc_orb_creation/propagate.py
+ - Vectorised two-body (Keplerian) propagation of N orbits to a target epoch (e.g. a common epoch for the whole catalogue)
+ - Elliptic, parabolic & hyperbolic orbits: the Kepler equation is solved for all N objects at once
+   (see transform.solve_kepler & transform.solve_hyperbolic_kepler)
+ - CAR & COM elements, & (optionally) their (N,p,p) covariances, C' = J C J^T (see transform.propagate_covariance)
+ - NB: Two-body motion about the Sun only (no planetary perturbations, no non-gravs): intended for first-pass screening,
+       e.g. before comparing / indexing the orbits of the catalogue, not as a replacement for an n-body integration
+       (see integrator.py). Any non-grav parameters (& their covariance) are carried across unchanged
+"""
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+# local imports
+# -----------------------
+from mpc_orb_creation import catalogue
+from mpc_orb_creation import covariance
+from mpc_orb_creation.transform import GM_SUN, PARABOLIC_TOLERANCE, com_to_car, car_to_com, propagate_covariance
+
+
+# -------------------------------------------------------------------
+# Elements
+# -------------------------------------------------------------------
+
+def _periods(com, target_epoch, mu=GM_SUN):
+    '''
+    Orbital periods [days] of (N,>=6) cometary elements, & the number of (whole) periods from the pericentre passage
+    in the elements to the one preceding target_epoch
+     - NB: both are 0 for parabolic & hyperbolic orbits
+    '''
+    q, e = com[:, 0], com[:, 1]
+    ell  = e < 1.0 - PARABOLIC_TOLERANCE
+    a    = q[ell] / (1.0 - e[ell])
+    P, k = np.zeros_like(q), np.zeros_like(q)
+    P[ell] = 2 * np.pi * np.sqrt( a**3 / mu )
+    k[ell] = np.floor( (target_epoch[ell] - com[ell, 5]) / P[ell] )
+    return P, k
+
+def propagate_com(com, target_epoch, mu=GM_SUN):
+    '''
+    Two-body propagation of cometary elements
+     - q, e, i, node & argperi are constants of two-body motion
+     - for elliptic orbits the peri_time is moved by a whole number of periods, to the pericentre passage preceding
+       target_epoch (the convention of transform.car_to_com)
+
+    returns:
+    --------
+    (N,6) array
+    '''
+    com = np.atleast_2d( np.asarray(com, dtype=np.float64) ).copy()
+    target_epoch = np.broadcast_to( np.asarray(target_epoch, dtype=np.float64), (com.shape[0],) )
+    P, k = _periods(com, target_epoch, mu=mu)
+    com[:, 5] += k * P
+    return com
+
+def propagate_car(car, epoch, target_epoch, mu=GM_SUN):
+    '''
+    Two-body propagation of Cartesian states, from epoch to target_epoch (via the cometary elements)
+
+    returns:
+    --------
+    (N,6) array
+    '''
+    return com_to_car( car_to_com(car, epoch, mu=mu), target_epoch, mu=mu )
+
+
+# -------------------------------------------------------------------
+# Jacobians (state-transition matrices)
+# -------------------------------------------------------------------
+
+def jacobian_com(com, target_epoch, mu=GM_SUN):
+    '''
+    Batched (analytic) Jacobians, d(COM at target_epoch)/d(COM), of *propagate_com*
+     - the identity, except for d(peri_time)/d(q, e) = k dP/d(q, e), for k whole periods
+
+    returns:
+    --------
+    (N,6,6) array
+    '''
+    com = np.atleast_2d( np.asarray(com, dtype=np.float64) )
+    N   = com.shape[0]
+    target_epoch = np.broadcast_to( np.asarray(target_epoch, dtype=np.float64), (N,) )
+    J   = np.broadcast_to( np.eye(6), (N, 6, 6) ).copy()
+
+    # P ~ a^1.5, a = q / (1 - e)
+    P, k = _periods(com, target_epoch, mu=mu)
+    J[:, 5, 0] = k * 1.5 * P / com[:, 0]
+    J[:, 5, 1] = k * 1.5 * P / np.where( k != 0, 1.0 - com[:, 1], 1.0 )
+    return J
+
+def jacobian_car(car, epoch, target_epoch, mu=GM_SUN, rel_step=1e-6):
+    '''
+    Batched Jacobians (state-transition matrices), d(CAR at target_epoch)/d(CAR at epoch), of *propagate_car*,
+    evaluated by central finite differences (as transform.jacobian)
+
+    returns:
+    --------
+    (N,6,6) array
+    '''
+    car   = np.atleast_2d( np.asarray(car, dtype=np.float64) )
+    N     = car.shape[0]
+    epoch        = np.broadcast_to( np.asarray(epoch, dtype=np.float64), (N,) )
+    target_epoch = np.broadcast_to( np.asarray(target_epoch, dtype=np.float64), (N,) )
+
+    steps = rel_step * np.maximum( np.abs(car), 1e-6 )
+
+    # All 2*6 perturbed versions of all N objects are propagated in a single call
+    perturbed = np.repeat( car[:, np.newaxis, np.newaxis, :], 2, axis=1 ).repeat(6, axis=2)   # (N,2,6,6)
+    idx = np.arange(6)
+    perturbed[:, 0, idx, idx] += steps
+    perturbed[:, 1, idx, idx] -= steps
+
+    propagated = propagate_car( perturbed.reshape(-1, 6), np.repeat(epoch, 12), np.repeat(target_epoch, 12), mu=mu ).reshape(N, 2, 6, 6)
+    diff = propagated[:, 0] - propagated[:, 1]        # (N, perturbed-element, output-element)
+    return np.swapaxes( diff / (2 * steps[:, :, np.newaxis]), 1, 2 )
+
+
+# -------------------------------------------------------------------
+# Propagation
+# -------------------------------------------------------------------
+
+def propagate(elements, epoch, target_epoch, coordtype='CAR', covariance_stack=None, mu=GM_SUN):
+    '''
+    Two-body propagation of N orbits (& optionally their covariances) to target_epoch
+
+    inputs:
+    -------
+    elements: (N,p) array-like
+     - CAR (x, y, z, vx, vy, vz) or COM (q, e, i, node, argperi, peri_time) elements,
+       followed by any non-grav parameters (p > 6), which are left unchanged
+    epoch: float or (N,) array-like
+     - MJD of the elements (only used for CAR: the COM elements refer to the peri_time)
+    target_epoch: float or (N,) array-like
+     - MJD to propagate to (same time system as the epoch & peri_time)
+    coordtype: str
+     - 'CAR' or 'COM'
+    covariance_stack: (N,p,p) array-like, optional
+
+    returns:
+    --------
+    (N,p) elements at target_epoch, & (if covariance_stack is supplied) (N,p,p) covariances at target_epoch
+    '''
+    elements = np.atleast_2d( np.asarray(elements, dtype=np.float64) )
+    N        = elements.shape[0]
+    epoch        = np.broadcast_to( np.asarray(epoch, dtype=np.float64), (N,) )
+    target_epoch = np.broadcast_to( np.asarray(target_epoch, dtype=np.float64), (N,) )
+
+    propagated = elements.copy()
+    if coordtype == 'CAR':
+        propagated[:, :6] = propagate_car(elements[:, :6], epoch, target_epoch, mu=mu)
+    elif coordtype == 'COM':
+        propagated[:, :6] = propagate_com(elements[:, :6], target_epoch, mu=mu)
+    else:
+        raise Exception(f"Cannot propagate coordtype {coordtype}: expected 'CAR' or 'COM'")
+
+    if covariance_stack is None:
+        return propagated
+
+    J = jacobian_car(elements[:, :6], epoch, target_epoch, mu=mu) if coordtype == 'CAR' else jacobian_com(elements[:, :6], target_epoch, mu=mu)
+    return propagated, propagate_covariance( np.asarray(covariance_stack, dtype=np.float64).reshape(N, elements.shape[1], elements.shape[1]), J )
+
+
+# -------------------------------------------------------------------
+# Catalogue snapshots
+# -------------------------------------------------------------------
+
+def propagate_catalogue(docs, target_epoch=None, coordtype='CAR', include_covariance=False, mu=GM_SUN):
+    '''
+    Two-body propagation of a catalogue snapshot (list of mpc_orb dicts, see catalogue.get_snapshot) to a common epoch
+
+    inputs:
+    -------
+    target_epoch: float, optional
+     - MJD (defaults to the median epoch of the snapshot)
+    include_covariance: bool
+     - if True, the (6,6) covariances of the elements are propagated too
+
+    returns:
+    --------
+    dict of arrays
+     - 'elements'   : (N,6) elements at target_epoch
+     - 'epoch'      : (N,)  target_epoch
+     - 'covariance' : (N,6,6) covariances at target_epoch (only if include_covariance)
+    '''
+    arrays = catalogue.to_arrays(docs, coordtype)
+    target_epoch = float( np.median(arrays['epoch']) ) if target_epoch is None else float(target_epoch)
+
+    out = {'epoch': np.full(len(docs), target_epoch)}
+    if include_covariance:
+        covariance_stack = np.array( [covariance.PackedCovariance.from_dict(doc[coordtype]['covariance']).to_array()[:6, :6] for doc in docs],
+                                     dtype=np.float64 ).reshape(-1, 6, 6)
+        out['elements'], out['covariance'] = propagate(arrays['elements'], arrays['epoch'], target_epoch, coordtype=coordtype,
+                                                       covariance_stack=covariance_stack, mu=mu)
+    else:
+        out['elements'] = propagate(arrays['elements'], arrays['epoch'], target_epoch, coordtype=coordtype, mu=mu)
+    return out
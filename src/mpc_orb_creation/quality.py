@@ -0,0 +1,220 @@
+"""
+mpc_orb_creation/quality.py
+ - Vectorised computation of the orbit-quality metrics in the "orbit_fit_statistics" section of mpc_orb
+   (sig_to_noise_ratio, snr_below_3, snr_below_1 & orbit_quality)
+ - Vectorised computation of the uncertainty parameter, U_param
+ - The numbering scores, score1 & score2, are orbfit's (from its quality output, e.g. the quality_json of orbfit_results):
+   they are not recomputed here (orbfit's definition is not available), so without that output the template's 0.0 is kept
+ - Works on (N,6) arrays, so that the whole catalogue can be re-graded in a single call
+   (e.g. when the quality thresholds are changed)
+
+Uncertainty parameter (https://minorplanetcenter.net/iau/info/UValue.html)
+ - RUNOFF = (dT * e + 10 * dP / P) * 3600 * 3 * k0 / P      (in-orbit longitude runoff, arcsec/decade)
+   where dT & dP are the uncertainties in the time of perihelion & the period (days),
+   P is the period (years) & k0 = 0.98560766 deg/day
+ - U = floor( ln(RUNOFF) / (ln(648000)/9) ) + 1, clipped to 0 ... 9
+ - NB: U is only defined for bound (e < 1) orbits with a covariance (otherwise U_param is not written, i.e. the template's
+   0.0, or the previous value, is kept: the schema types it as a number)
+"""
+
+# Standard imports
+# -----------------------
+import copy
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+# local imports
+# -----------------------
+from mpc_orb_creation import catalogue
+from mpc_orb_creation import covariance
+
+
+# SNR values that define the orbit quality
+# good if   SNR>3
+# poor if 1<SNR<3
+# unreliable if SNR<1
+QUALITY_THRESHOLDS = {'poor': 3.0, 'unreliable': 1.0}
+
+# Gaussian gravitational constant in deg/day, & the runoff that corresponds to U = 9 (180 deg, in arcsec)
+K0_DEG_PER_DAY = 0.98560766
+RUNOFF_U9      = 648000.0
+
+# The fields of orbfit's quality output that are copied as they are (see *scores_for_object*)
+ORBFIT_SCORE_KEYS = ('U_param', 'score1', 'score2')
+
+
+def orbit_quality_metrics(elements, rms, thresholds=None):
+    '''
+    Signal-to-noise ratio of the (CAR) elements & the derived quality flags, for N objects at once
+
+    inputs:
+    -------
+    elements: (N,6) array-like
+    rms: (N,6) array-like
+    thresholds: dict, optional
+     - SNR below which an orbit is 'poor' / 'unreliable' (defaults to QUALITY_THRESHOLDS)
+     - NB: snr_below_3 & snr_below_1 always use 3 & 1 (as per their names)
+
+    returns:
+    --------
+    dict of arrays
+     - 'sig_to_noise_ratio' : (N,6) |element| / rms
+     - 'snr_below_3'        : (N,)  bool
+     - 'snr_below_1'        : (N,)  bool
+     - 'orbit_quality'      : (N,)  str, 'good', 'poor' or 'unreliable'
+    '''
+    thresholds = dict(QUALITY_THRESHOLDS, **(thresholds or {}))
+    elements   = np.atleast_2d( np.asarray(elements, dtype=np.float64) )
+    rms        = np.atleast_2d( np.asarray(rms, dtype=np.float64) )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        snr = np.abs(elements) / rms
+    min_snr = snr.min(axis=1)
+
+    orbit_quality = np.where( min_snr < thresholds['unreliable'], 'unreliable',
+                              np.where( min_snr < thresholds['poor'], 'poor', 'good') )
+
+    return {
+        'sig_to_noise_ratio' : snr,
+        'snr_below_3'        : min_snr < 3,
+        'snr_below_1'        : min_snr < 1,
+        'orbit_quality'      : orbit_quality,
+    }
+
+def metrics_for_object(metrics, n):
+    ''' The metrics for the n-th object, as an orbit_fit_statistics (sub-)dict of python types '''
+    return {
+        'sig_to_noise_ratio' : metrics['sig_to_noise_ratio'][n].tolist(),
+        'snr_below_3'        : bool(metrics['snr_below_3'][n]),
+        'snr_below_1'        : bool(metrics['snr_below_1'][n]),
+        'orbit_quality'      : str(metrics['orbit_quality'][n]),
+    }
+
+def rescore_catalogue(docs, thresholds=None):
+    '''
+    Re-grade the orbit quality of a catalogue snapshot (list of mpc_orb dicts) in one vectorised call
+     - See catalogue.get_snapshot
+
+    returns:
+    --------
+    list of updated mpc_orb dicts (the input dicts are not modified)
+    '''
+    if not docs:
+        return []
+    arrays  = catalogue.to_arrays(docs, 'CAR')
+    metrics = orbit_quality_metrics(arrays['elements'], arrays['rms'], thresholds=thresholds)
+
+    rescored = []
+    for n, doc in enumerate(docs):
+        doc = copy.copy(doc)
+        doc['orbit_fit_statistics'] = dict( doc['orbit_fit_statistics'], **metrics_for_object(metrics, n) )
+        rescored.append(doc)
+    return rescored
+
+
+# -------------------------------------------------------------------
+# Uncertainty parameter & numbering scores
+# -------------------------------------------------------------------
+
+def runoff(com, com_cov):
+    '''
+    In-orbit longitude runoff (arcsec/decade, 3-sigma) of N orbits
+
+    inputs:
+    -------
+    com: (N,>=6) array-like
+     - cometary elements: q [au], e, i, node, argperi [deg], tp [MJD]
+    com_cov: (N,>=6,>=6) array-like
+     - covariance matrices of the cometary elements (only the q, e & tp rows / columns are used)
+
+    returns:
+    --------
+    (N,) array (nan for unbound orbits)
+    '''
+    com     = np.atleast_2d( np.asarray(com, dtype=np.float64) )
+    com_cov = np.asarray(com_cov, dtype=np.float64).reshape(-1, *np.shape(com_cov)[-2:])
+    q, e    = com[:, 0], com[:, 1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a      = np.where(e < 1.0, q / (1.0 - e), np.nan)
+        P_yr   = a**1.5                                       # <<-- period in years, such that the mean motion = k0 / P deg/day
+        P_days = 360.0 / K0_DEG_PER_DAY * P_yr
+
+        # Uncertainty in the period, from the (q, e) block of the covariance: P = P(a(q, e))
+        J      = np.stack( [1.0 / (1.0 - e), q / (1.0 - e)**2], axis=1 ) * (1.5 * P_days / a)[:, np.newaxis]
+        dP     = np.sqrt( np.einsum('ni,nij,nj->n', J, com_cov[:, :2, :2], J) )
+        dT     = np.sqrt( com_cov[:, 5, 5] )
+
+        return (dT * e + 10.0 * dP / P_yr) * 3600.0 * 3.0 * K0_DEG_PER_DAY / P_yr
+
+def uncertainty_parameter(com, com_cov):
+    '''
+    U_param of N orbits, in one vectorised pass
+
+    inputs:
+    -------
+    com, com_cov:
+     - see *runoff*
+
+    returns:
+    --------
+    dict of (N,) arrays
+     - 'runoff', 'U_param' (nan for unbound orbits)
+    '''
+    R = runoff(com, com_cov)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        U = np.clip( np.floor( 9.0 * np.log(R) / np.log(RUNOFF_U9) ) + 1, 0, 9 )     # <<-- nan is preserved (unbound orbits)
+    return {'runoff': R, 'U_param': U}
+
+def scores_for_object(scores, n, quality_dict=None):
+    '''
+    U_param, score1 & score2 of the n-th object, as an orbit_fit_statistics (sub-)dict of python types
+
+    inputs:
+    -------
+    scores: dict or None
+     - as returned by *uncertainty_parameter* (None if U could not be computed, e.g. without a covariance)
+    quality_dict: dict, optional
+     - orbfit's quality output: any of ORBFIT_SCORE_KEYS in it take precedence over the computed values
+
+    returns:
+    --------
+    dict of the defined values only (e.g. no U_param for an unbound orbit, & no score1 & score2 without orbfit's quality
+    output), so that updating orbit_fit_statistics with it never writes None into these number-typed fields
+    '''
+    U = float(scores['U_param'][n]) if scores is not None else np.nan
+    result = {'U_param': U} if np.isfinite(U) else {}
+    result.update( { key: (quality_dict or {})[key] for key in ORBFIT_SCORE_KEYS if (quality_dict or {}).get(key) is not None } )
+    return result
+
+def uncertainty_catalogue(docs):
+    '''
+    Compute U_param for a catalogue snapshot (list of mpc_orb dicts) in one vectorised call
+     - See catalogue.get_snapshot
+     - Uses the COM elements & covariance of each document (U_param is left as it is for those without a COM covariance,
+       or with an unbound orbit)
+     - NB: score1 & score2 are orbfit's, so are left as they are
+
+    returns:
+    --------
+    list of updated mpc_orb dicts (the input dicts are not modified)
+    '''
+    if not docs:
+        return []
+    with_cov = [ n for n, doc in enumerate(docs) if covariance.infer_numparams(doc['COM']['covariance']) >= 6 ]
+    updates  = [{}] * len(docs)
+    if with_cov:
+        com     = catalogue.to_arrays([docs[n] for n in with_cov], 'COM')['elements']
+        com_cov = covariance.stack( [covariance.PackedCovariance.from_dict(docs[n]['COM']['covariance'], 6) for n in with_cov] )
+        scores  = uncertainty_parameter(com, com_cov)
+        for k, n in enumerate(with_cov):
+            updates[n] = scores_for_object(scores, k)
+
+    scored = []
+    for n, doc in enumerate(docs):
+        doc = copy.copy(doc)
+        doc['orbit_fit_statistics'] = dict( doc['orbit_fit_statistics'], **updates[n] )
+        scored.append(doc)
+    return scored
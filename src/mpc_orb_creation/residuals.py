@@ -0,0 +1,170 @@
+"""
+mpc_orb_creation/residuals.py
+ - Columnar (numpy) access to the optical observations in the orbfit rwo dict
+ - Vectorised residual statistics (normalised & un-normalised RMS, per-band photometric RMS)
+ - Vectorised group-by (per-tracklet) statistics of the residuals
+
+Residual statistics (all residuals in arcsec / mag; "selected" = used in the fit, i.e. a_select / m_select)
+ - normalized_RMS     = sqrt( mean[ ((ra_resid/ra_rms)^2 + (dec_resid/dec_rms)^2) / 2 ] )  (= orbfit's rmsast)
+ - not_normalized_RMS = sqrt( mean[ (ra_resid^2 + dec_resid^2) / 2 ] )
+ - photometric_RMS    = sqrt( mean[ mag_resid^2 ] )                                          (= orbfit's rmsmag)
+
+Per-tracklet statistics & bad tracklets
+ - Each observation has a (normalised) residual, chi (the "chisq" field of the rwo = orbfit's "Chi" column),
+   & a weight, the inverse of its astrometric variance, w = 2/(ra_rms^2 + dec_rms^2)
+ - A bad observation is one that was not selected in the fit (a_select), or whose chi > bad_obs_weight
+ - For each tracklet: the number of observations, the number & the (weighted) fraction of bad observations,
+   & the weighted-mean chi
+ - A tracklet is bad if its weighted fraction of bad observations > fraction_bad, & its weighted-mean chi > bad_obs_threshhold
+ - Deleted observations (T == 'X') are ignored, & observations without a trkid are never part of a bad tracklet
+ - NB: This is the criterion of this package, computed from the rwo observations with the bad_trk_params
+       (orbfit's own identification is not available as code)
+"""
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+
+# Default bad-tracklet parameters (as passed to orbfit via the "bad_trk_dict", & used by *tracklet_statistics*)
+BAD_TRK_PARAMS = {'bad_obs_weight': 5.0, 'fraction_bad': 0.5, 'bad_obs_threshhold': 1.0}
+
+# Columns of the optical observations that are extracted as floats / strings
+NUMERIC_COLUMNS = ['ra_resid', 'dec_resid', 'ra_rms', 'dec_rms', 'chisq', 'mag_resid', 'mag_rms']
+STRING_COLUMNS  = ['trkid', 'mag_band', 'T', 'a_select', 'm_select']
+
+
+# -------------------------------------------------------------------
+# Columnar extraction
+# -------------------------------------------------------------------
+
+def _to_float_array(values):
+    ''' Numbers / numeric strings -> float array (blanks & missing values -> nan) '''
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (ValueError, TypeError):
+        out = np.full(len(values), np.nan)
+        for n, value in enumerate(values):
+            try:
+                out[n] = float(value)
+            except (ValueError, TypeError):
+                pass
+        return out
+
+def optical_arrays(rwodict, include_deleted=False):
+    '''
+    Extract the optical observations from the rwo dict as columns
+
+    returns:
+    --------
+    dict of (N,) arrays, keyed by the NUMERIC_COLUMNS (float) & STRING_COLUMNS (str)
+     - NB: a_select & m_select are returned as bool arrays
+    '''
+    obs = rwodict['optical_list'] if include_deleted else [_ for _ in rwodict['optical_list'] if _.get('T') != 'X']
+    columns = {}
+    for key in NUMERIC_COLUMNS:
+        columns[key] = _to_float_array( [_.get(key) for _ in obs] )
+    for key in STRING_COLUMNS:
+        columns[key] = np.array( [str(_.get(key, '')).strip() for _ in obs], dtype=str )
+    for key in ['a_select', 'm_select']:
+        columns[key] = (columns[key] != '0') & (columns[key] != '')
+    return columns
+
+
+# -------------------------------------------------------------------
+# Residual statistics
+# -------------------------------------------------------------------
+
+def _rms(sum_of_squares, n):
+    ''' sqrt(sum_of_squares / n), with nan if n == 0 '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(n > 0, np.sqrt(sum_of_squares / np.maximum(n, 1)), np.nan)
+
+def residual_statistics(columns):
+    '''
+    RMS of the astrometric & photometric residuals, for all & for the selected observations
+
+    inputs:
+    -------
+    columns: dict
+     - as returned by *optical_arrays*
+
+    returns:
+    --------
+    dict of floats (nan if there are no observations)
+     - 'normalized_RMS', 'not_normalized_RMS', 'photometric_RMS'          : selected observations
+     - 'normalized_RMS_all', 'not_normalized_RMS_all', 'photometric_RMS_all' : all (non-deleted) observations
+     - 'photometric_RMS_by_band', 'photometric_RMS_by_band_all'            : dicts of band -> RMS
+    '''
+    # Per-observation squared terms (computed once)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = ( (columns['ra_resid'] / columns['ra_rms'])**2 + (columns['dec_resid'] / columns['dec_rms'])**2 ) / 2
+    not_normalized = ( columns['ra_resid']**2 + columns['dec_resid']**2 ) / 2
+    photometric    = columns['mag_resid']**2
+
+    astrometric_ok = np.isfinite(normalized) & np.isfinite(not_normalized)
+    photometric_ok = np.isfinite(photometric) & (columns['mag_band'] != '')
+    bands, band_index = np.unique(columns['mag_band'], return_inverse=True)
+
+    stats = {}
+    for suffix, a_mask, m_mask in [ ('',     astrometric_ok & columns['a_select'], photometric_ok & columns['m_select']),
+                                    ('_all', astrometric_ok,                      photometric_ok) ]:
+        n = a_mask.sum()
+        stats['normalized_RMS'     + suffix] = float( _rms(normalized[a_mask].sum(),     n) )
+        stats['not_normalized_RMS' + suffix] = float( _rms(not_normalized[a_mask].sum(), n) )
+        stats['photometric_RMS'    + suffix] = float( _rms(photometric[m_mask].sum(),    m_mask.sum()) )
+
+        # Per band: group-by on the band
+        band_n   = np.bincount(band_index, weights=m_mask.astype(np.float64), minlength=bands.size)
+        band_sum = np.bincount(band_index, weights=np.where(m_mask, photometric, 0.0), minlength=bands.size)
+        stats['photometric_RMS_by_band' + suffix] = { str(band): float(rms) for band, rms, n_band in zip(bands, _rms(band_sum, band_n), band_n) if n_band > 0 }
+    return stats
+
+
+# -------------------------------------------------------------------
+# Per-tracklet statistics
+# -------------------------------------------------------------------
+
+def tracklet_statistics(columns, bad_trk_params=None):
+    '''
+    Per-tracklet statistics & the bad tracklets, computed with vectorised group-by operations
+
+    inputs:
+    -------
+    columns: dict
+     - as returned by *optical_arrays*
+    bad_trk_params: dict, optional
+     - bad_obs_weight, fraction_bad & bad_obs_threshhold (defaults to BAD_TRK_PARAMS)
+
+    returns:
+    --------
+    dict of (n_tracklets,) arrays
+     - 'trkid', 'nobs', 'nobs_bad', 'fraction_bad', 'weighted_fraction_bad', 'weighted_chi', 'bad' (bool)
+    '''
+    params = dict(BAD_TRK_PARAMS, **(bad_trk_params or {}))
+
+    trkid, inverse = np.unique(columns['trkid'], return_inverse=True)
+    chi  = np.nan_to_num(columns['chisq'], nan=0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = 2.0 / (columns['ra_rms']**2 + columns['dec_rms']**2)
+    weight = np.where(np.isfinite(weight), weight, 0.0)
+    bad    = ~columns['a_select'] | (chi > params['bad_obs_weight'])
+
+    nobs         = np.bincount(inverse, minlength=trkid.size)
+    nobs_bad     = np.bincount(inverse, weights=bad.astype(np.float64), minlength=trkid.size)
+    weight_sum   = np.bincount(inverse, weights=weight, minlength=trkid.size)
+    weight_bad   = np.bincount(inverse, weights=np.where(bad, weight, 0.0), minlength=trkid.size)
+    weighted_chi = np.bincount(inverse, weights=weight * chi, minlength=trkid.size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weighted_chi          = np.where(weight_sum > 0, weighted_chi / weight_sum, 0.0)
+        weighted_fraction_bad = np.where(weight_sum > 0, weight_bad / weight_sum, 0.0)
+    fraction_bad = nobs_bad / np.maximum(nobs, 1)
+
+    return {'trkid': trkid, 'nobs': nobs, 'nobs_bad': nobs_bad.astype(int), 'fraction_bad': fraction_bad,
+            'weighted_fraction_bad': weighted_fraction_bad, 'weighted_chi': weighted_chi,
+            'bad': (weighted_fraction_bad > params['fraction_bad']) & (weighted_chi > params['bad_obs_threshhold']) & (trkid != '')}
+
+def bad_tracklets(columns, bad_trk_params=None):
+    ''' The trkids of the bad tracklets (see *tracklet_statistics*), as a sorted list of str '''
+    stats = tracklet_statistics(columns, bad_trk_params=bad_trk_params)
+    return stats['trkid'][stats['bad']].tolist()
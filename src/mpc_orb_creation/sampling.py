@@ -0,0 +1,146 @@
+"""
+mpc_orb_creation/sampling.py
+ - Monte-Carlo sampling of variant ("clone") orbits from best-fit elements & their covariances
+ - Batched: K variants for each of N objects are drawn in one go, from a single RNG stream,
+   using a batched Cholesky factorisation of the (N,p,p) covariance stack (with a per-matrix fallback)
+ - Returns contiguous (N,K,p) float64 arrays (no per-sample python objects)
+ - Inputs can be arrays, parse.MPCORB objects, or a catalogue snapshot (list of mpc_orb dicts)
+"""
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+# local imports
+# -----------------------
+from mpc_orb_creation import covariance
+from mpc_orb_creation.transform import _WRAPPED_COM_COLUMNS
+
+
+# Number of objects whose variants are generated at a time (limits the size of the temporary arrays)
+CHUNK_SIZE = 4096
+
+
+# -------------------------------------------------------------------
+# Square-roots of the covariances
+# -------------------------------------------------------------------
+
+def square_roots(covariance_stack):
+    '''
+    Matrices, L, such that L L^T = C, for an (N,p,p) stack of covariances
+     - Batched Cholesky factorisation
+     - Only the matrices that are not (numerically) positive-definite are instead factorised via an
+       eigen-decomposition, L = V sqrt(max(w,0)), so that (semi-definite) covariances, e.g. with poorly-determined
+       non-grav parameters, can still be sampled
+     - NB: The factor of each matrix therefore does not depend on the other matrices in the stack
+
+    returns:
+    --------
+    (N,p,p) array
+    '''
+    covariance_stack = np.asarray(covariance_stack, dtype=np.float64)
+    try:
+        return np.linalg.cholesky(covariance_stack)
+    except np.linalg.LinAlgError:
+        pass
+
+    # Find the matrices that fail (one at a time) & only fall back for those
+    L = np.empty_like(covariance_stack)
+    failed = []
+    for n, C in enumerate(covariance_stack):
+        try:
+            L[n] = np.linalg.cholesky(C)
+        except np.linalg.LinAlgError:
+            failed.append(n)
+    w, V = np.linalg.eigh(covariance_stack[failed])
+    L[failed] = V * np.sqrt( np.clip(w, 0.0, None) )[:, np.newaxis, :]
+    return L
+
+
+# -------------------------------------------------------------------
+# Sampling
+# -------------------------------------------------------------------
+
+def sample(elements, covariance_stack, K, seed=None, rng=None, include_nominal=False, coordtype=None):
+    '''
+    Draw K variant orbits for each of N objects from N(elements, covariance)
+
+    inputs:
+    -------
+    elements: (N,p) array-like
+    covariance_stack: (N,p,p) array-like
+    K: int
+     - number of variants per object
+    seed: int, optional
+     - seed for a new numpy Generator (ignored if rng is supplied)
+    rng: numpy.random.Generator, optional
+     - the single stream from which all of the variants are drawn
+       (object by object, variant by variant, so the results do not depend on CHUNK_SIZE)
+    include_nominal: bool
+     - if True, variant 0 of each object is the nominal (best-fit) orbit
+    coordtype: str, optional
+     - if 'COM', the node & argperi of the variants are wrapped into [0, 360)
+
+    returns:
+    --------
+    (N,K,p) contiguous float64 array
+    '''
+    elements         = np.atleast_2d( np.asarray(elements, dtype=np.float64) )
+    covariance_stack = np.asarray(covariance_stack, dtype=np.float64).reshape(-1, elements.shape[1], elements.shape[1])
+    rng  = rng if rng is not None else np.random.default_rng(seed)
+    N, p = elements.shape
+
+    out = np.empty( (N, K, p) )
+    for start in range(0, N, CHUNK_SIZE):
+        s = slice(start, min(start + CHUNK_SIZE, N))
+        L = square_roots( covariance_stack[s] )
+        z = rng.standard_normal( (L.shape[0], K, p) )
+        if include_nominal:
+            z[:, 0, :] = 0.0
+        out[s] = elements[s, np.newaxis, :] + np.einsum('nij,nkj->nki', L, z)
+
+    if coordtype == 'COM':
+        out[..., _WRAPPED_COM_COLUMNS] %= 360.0
+    return out
+
+
+# -------------------------------------------------------------------
+# Inputs from parse.MPCORB objects & catalogue snapshots
+# -------------------------------------------------------------------
+
+def stack_mpcorb(mpcorbs, coordtype='CAR'):
+    '''
+    Elements & covariances of a list of parse.MPCORB objects
+     - NB: only the parameters in the element_array (& the corresponding covariance block) are used
+
+    returns:
+    --------
+    (N,p) elements, (N,p,p) covariances
+    '''
+    elements = np.array( [getattr(_, coordtype)['element_array'] for _ in mpcorbs], dtype=np.float64 )
+    p = elements.shape[1]
+    return elements, np.array( [getattr(_, coordtype)['covariance_array'][:p, :p] for _ in mpcorbs], dtype=np.float64 )
+
+def stack_catalogue(docs, coordtype='CAR'):
+    '''
+    Elements & covariances of a catalogue snapshot (list of mpc_orb dicts, see catalogue.get_snapshot)
+     - The number of parameters is that of the covariance (so non-grav parameters are included)
+     - NB: all of the documents must have the same number of parameters
+
+    returns:
+    --------
+    (N,p) elements, (N,p,p) covariances
+    '''
+    covs     = [covariance.PackedCovariance.from_dict(doc[coordtype]['covariance']) for doc in docs]
+    elements = np.array( [doc[coordtype]['coefficient_values'][:cov.numparams] for doc, cov in zip(docs, covs)], dtype=np.float64 )
+    return elements, covariance.stack(covs)
+
+def sample_mpcorb(mpcorbs, K, coordtype='CAR', **kwargs):
+    ''' K variants for each of a list of parse.MPCORB objects: (N,K,p) array (see *sample* for the kwargs) '''
+    elements, covariance_stack = stack_mpcorb(mpcorbs, coordtype)
+    return sample(elements, covariance_stack, K, coordtype=coordtype, **kwargs)
+
+def sample_catalogue(docs, K, coordtype='CAR', **kwargs):
+    ''' K variants for each of the mpc_orb dicts in a catalogue snapshot: (N,K,p) array (see *sample* for the kwargs) '''
+    elements, covariance_stack = stack_catalogue(docs, coordtype)
+    return sample(elements, covariance_stack, K, coordtype=coordtype, **kwargs)
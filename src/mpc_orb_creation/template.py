@@ -12,6 +12,7 @@ the defining schema.
 '''
 # standard imports 
 import sys, os 
+import copy
 
 # local imports
 from mpc_orb_creation import io
@@ -19,9 +20,14 @@ from mpc_orb_creation.filepaths import filepath_dict
 
 
 # ------- Sample / Template Dictionary --------
+_template_cache = {}
+
 def get_template_json():
     ''' A template dict/JSON that conforms to
         the defining schema in filepaths.filepath_dict['mpcorb_schema']
+        NB: The file is only read once per process: a fresh copy is returned on each call
     '''
-    return io.load_json( filepath_dict['mpcorb_template'] )
+    if 'mpcorb_template' not in _template_cache:
+        _template_cache['mpcorb_template'] = io.load_json( filepath_dict['mpcorb_template'] )
+    return copy.deepcopy( _template_cache['mpcorb_template'] )
     
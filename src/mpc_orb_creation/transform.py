@@ -0,0 +1,348 @@
+"""
+mpc_orb_creation/transform.py
+ - Vectorised conversion between the Cartesian (CAR) & cometary (COM) representations of heliocentric orbits
+   (a) elements: (N,6) arrays of CAR <-> COM
+   (b) covariances: batched Jacobians, J, (N,6,6) & propagation of (N,p,p) covariance stacks, C' = J C J^T
+       (any non-grav parameters beyond the 6 elements are carried across unchanged)
+ - Allows a missing CAR or COM block in the orbfit output to be filled in, and whole catalogues
+   to be re-expressed, without re-running orbfit
+
+Conventions (as per the orbfit output)
+ - CAR: x, y, z [au], vx, vy, vz [au/day]
+ - COM: q [au], e, i, node, argperi [deg], peri_time [MJD]
+ - Two-body (Sun-only) motion, with GM = k^2
+ - peri_time is the pericentre passage *preceding* the epoch for elliptic orbits (mean anomaly in [0, 360) deg)
+"""
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+# local imports
+# -----------------------
+from mpc_orb_creation import covariance
+
+
+# Gaussian gravitational constant [au^(3/2) day^-1] & the corresponding GM of the Sun [au^3 day^-2]
+GAUSS_K = 0.01720209895
+GM_SUN  = GAUSS_K**2
+
+# Orbits with |e - 1| below this are treated as parabolic
+PARABOLIC_TOLERANCE = 1e-10
+
+# Element names (in the order used by orbfit)
+ELEMENT_NAMES = {
+    'CAR' : ['x','y','z','vx','vy','vz'],
+    'COM' : ['q','e','i','node','argperi','peri_time'],
+}
+
+# Columns of the COM elements that are angles which wrap at 360 deg
+_WRAPPED_COM_COLUMNS = [3, 4]
+
+# Columns of the COM elements that are angles (orbfit's "eigval" are computed with these in radians)
+_ANGULAR_COM_COLUMNS = [2, 3, 4]
+
+
+# -------------------------------------------------------------------
+# Element conversions
+# -------------------------------------------------------------------
+
+def _rotation_matrices(incl, node, argperi):
+    ''' (N,3,3) rotations from the perifocal frame to the reference frame (angles in radians) '''
+    ci, si = np.cos(incl), np.sin(incl)
+    cO, sO = np.cos(node), np.sin(node)
+    cw, sw = np.cos(argperi), np.sin(argperi)
+    R = np.empty( incl.shape + (3, 3) )
+    R[..., 0, 0] =  cO * cw - sO * sw * ci
+    R[..., 0, 1] = -cO * sw - sO * cw * ci
+    R[..., 0, 2] =  sO * si
+    R[..., 1, 0] =  sO * cw + cO * sw * ci
+    R[..., 1, 1] = -sO * sw + cO * cw * ci
+    R[..., 1, 2] = -cO * si
+    R[..., 2, 0] =  sw * si
+    R[..., 2, 1] =  cw * si
+    R[..., 2, 2] =  ci
+    return R
+
+def solve_kepler(M, e, n_iter=50, tol=1e-15):
+    ''' Eccentric anomaly, E, from mean anomaly, M, for elliptic orbits: M = E - e sin(E) (radians) '''
+    E = np.where(e < 0.8, M, np.where(M >= 0, np.pi, -np.pi))
+    for _ in range(n_iter):
+        dE = (E - e * np.sin(E) - M) / (1.0 - e * np.cos(E))
+        E  = E - dE
+        if np.all(np.abs(dE) < tol):
+            break
+    return E
+
+def solve_hyperbolic_kepler(M, e, n_iter=100, tol=1e-15):
+    ''' Hyperbolic anomaly, H, from mean anomaly, M, for hyperbolic orbits: M = e sinh(H) - H '''
+    H = np.arcsinh(M / e)
+    for _ in range(n_iter):
+        dH = (e * np.sinh(H) - H - M) / (e * np.cosh(H) - 1.0)
+        H  = H - dH
+        if np.all(np.abs(dH) < tol * np.maximum(1.0, np.abs(H))):
+            break
+    return H
+
+def _true_anomaly_from_time(q, e, dt, mu):
+    ''' True anomaly [radians] at time dt [days] after pericentre, for any conic '''
+    nu = np.empty_like(q)
+    ell, hyp = e < 1.0 - PARABOLIC_TOLERANCE, e > 1.0 + PARABOLIC_TOLERANCE
+    par = ~(ell | hyp)
+
+    if np.any(ell):
+        a = q[ell] / (1.0 - e[ell])
+        M = np.remainder( np.sqrt(mu / a**3) * dt[ell] + np.pi, 2 * np.pi ) - np.pi
+        E = solve_kepler(M, e[ell])
+        nu[ell] = 2 * np.arctan2( np.sqrt(1 + e[ell]) * np.sin(E / 2), np.sqrt(1 - e[ell]) * np.cos(E / 2) )
+    if np.any(hyp):
+        a = q[hyp] / (1.0 - e[hyp])
+        H = solve_hyperbolic_kepler( np.sqrt(mu / (-a)**3) * dt[hyp], e[hyp] )
+        nu[hyp] = 2 * np.arctan( np.sqrt((e[hyp] + 1) / (e[hyp] - 1)) * np.tanh(H / 2) )
+    if np.any(par):
+        # Barker's equation, D + D^3/3 = sqrt(mu/(2q^3)) dt, with D = tan(nu/2)
+        B = 1.5 * np.sqrt(mu / (2 * q[par]**3)) * dt[par]
+        s = np.sqrt(B**2 + 1)
+        nu[par] = 2 * np.arctan( np.cbrt(B + s) + np.cbrt(B - s) )
+    return nu
+
+def _time_from_true_anomaly(q, e, nu, mu):
+    ''' Time [days] since the pericentre passage (preceding the epoch for elliptic orbits) '''
+    dt = np.empty_like(q)
+    ell, hyp = e < 1.0 - PARABOLIC_TOLERANCE, e > 1.0 + PARABOLIC_TOLERANCE
+    par = ~(ell | hyp)
+
+    if np.any(ell):
+        a = q[ell] / (1.0 - e[ell])
+        E = 2 * np.arctan2( np.sqrt(1 - e[ell]) * np.sin(nu[ell] / 2), np.sqrt(1 + e[ell]) * np.cos(nu[ell] / 2) )
+        M = np.remainder( E - e[ell] * np.sin(E), 2 * np.pi )
+        dt[ell] = M / np.sqrt(mu / a**3)
+    if np.any(hyp):
+        a = q[hyp] / (1.0 - e[hyp])
+        H = 2 * np.arctanh( np.sqrt((e[hyp] - 1) / (e[hyp] + 1)) * np.tan(nu[hyp] / 2) )
+        dt[hyp] = (e[hyp] * np.sinh(H) - H) / np.sqrt(mu / (-a)**3)
+    if np.any(par):
+        D = np.tan(nu[par] / 2)
+        dt[par] = (D + D**3 / 3) / np.sqrt(mu / (2 * q[par]**3))
+    return dt
+
+def com_to_car(com, epoch, mu=GM_SUN):
+    '''
+    Cometary -> Cartesian elements
+
+    inputs:
+    -------
+    com: (N,6) array-like
+     - q, e, i, node, argperi, peri_time
+    epoch: float or (N,) array-like
+     - MJD of the Cartesian state (same timesystem as peri_time)
+
+    returns:
+    --------
+    (N,6) array of x, y, z, vx, vy, vz
+    '''
+    com   = np.atleast_2d( np.asarray(com, dtype=np.float64) )
+    epoch = np.broadcast_to( np.asarray(epoch, dtype=np.float64), com.shape[:1] )
+    q, e  = com[:, 0], com[:, 1]
+    incl, node, argperi = np.radians(com[:, 2]), np.radians(com[:, 3]), np.radians(com[:, 4])
+
+    nu = _true_anomaly_from_time(q, e, epoch - com[:, 5], mu)
+
+    # Position & velocity in the perifocal frame
+    p  = q * (1 + e)
+    r  = p / (1 + e * np.cos(nu))
+    vp = np.sqrt(mu / p)
+    perifocal_pos = np.stack( [r * np.cos(nu), r * np.sin(nu), np.zeros_like(r)], axis=-1 )
+    perifocal_vel = np.stack( [-vp * np.sin(nu), vp * (e + np.cos(nu)), np.zeros_like(r)], axis=-1 )
+
+    R = _rotation_matrices(incl, node, argperi)
+    return np.concatenate( [np.einsum('nij,nj->ni', R, perifocal_pos), np.einsum('nij,nj->ni', R, perifocal_vel)], axis=-1 )
+
+def car_to_com(car, epoch, mu=GM_SUN):
+    '''
+    Cartesian -> cometary elements
+
+    inputs:
+    -------
+    car: (N,6) array-like
+     - x, y, z, vx, vy, vz
+    epoch: float or (N,) array-like
+     - MJD of the Cartesian state
+
+    returns:
+    --------
+    (N,6) array of q, e, i, node, argperi, peri_time
+     - NB: node is set to 0 for zero-inclination orbits & argperi is measured from the node for circular orbits
+    '''
+    car   = np.atleast_2d( np.asarray(car, dtype=np.float64) )
+    epoch = np.broadcast_to( np.asarray(epoch, dtype=np.float64), car.shape[:1] )
+    pos, vel = car[:, :3], car[:, 3:6]
+    r  = np.linalg.norm(pos, axis=-1)
+
+    h_vec = np.cross(pos, vel)
+    h     = np.linalg.norm(h_vec, axis=-1)
+    h_hat = h_vec / h[:, np.newaxis]
+    incl  = np.arccos( np.clip(h_hat[:, 2], -1.0, 1.0) )
+
+    # Unit vector towards the ascending node (x-axis if the orbit is in the reference plane)
+    n_vec = np.stack( [-h_vec[:, 1], h_vec[:, 0], np.zeros_like(h)], axis=-1 )
+    n     = np.linalg.norm(n_vec, axis=-1)
+    n_hat = np.where( (n > 1e-15 * h)[:, np.newaxis], n_vec / np.where(n > 0, n, 1.0)[:, np.newaxis], [1.0, 0.0, 0.0] )
+    node  = np.arctan2(n_hat[:, 1], n_hat[:, 0])
+
+    # Eccentricity vector (points to the pericentre; the node direction is used for circular orbits)
+    e_vec = np.cross(vel, h_vec) / mu - pos / r[:, np.newaxis]
+    e     = np.linalg.norm(e_vec, axis=-1)
+    e_hat = np.where( (e > 1e-15)[:, np.newaxis], e_vec / np.where(e > 0, e, 1.0)[:, np.newaxis], n_hat )
+
+    argperi = np.arctan2( np.einsum('ni,ni->n', np.cross(n_hat, e_hat), h_hat), np.einsum('ni,ni->n', n_hat, e_hat) )
+    nu      = np.arctan2( np.einsum('ni,ni->n', np.cross(e_hat, pos), h_hat), np.einsum('ni,ni->n', e_hat, pos) )
+
+    q  = h**2 / mu / (1 + e)
+    tp = epoch - _time_from_true_anomaly(q, e, nu, mu)
+
+    return np.stack( [q, e, np.degrees(incl), np.remainder(np.degrees(node), 360.0),
+                      np.remainder(np.degrees(argperi), 360.0), tp], axis=-1 )
+
+def convert(elements, epoch, from_coordtype, to_coordtype, mu=GM_SUN):
+    ''' Convert (N,6) elements between coordtypes ('CAR' or 'COM') '''
+    if from_coordtype == to_coordtype:
+        return np.atleast_2d( np.asarray(elements, dtype=np.float64) ).copy()
+    if (from_coordtype, to_coordtype) == ('COM', 'CAR'):
+        return com_to_car(elements, epoch, mu=mu)
+    if (from_coordtype, to_coordtype) == ('CAR', 'COM'):
+        return car_to_com(elements, epoch, mu=mu)
+    raise Exception(f"Cannot convert from {from_coordtype} to {to_coordtype}")
+
+
+# -------------------------------------------------------------------
+# Jacobians & covariance propagation
+# -------------------------------------------------------------------
+
+def jacobian(elements, epoch, from_coordtype, to_coordtype, mu=GM_SUN, rel_step=1e-6):
+    '''
+    Batched Jacobians, d(to)/d(from), of the conversion, evaluated by central finite differences
+
+    returns:
+    --------
+    (N,6,6) array
+    '''
+    elements = np.atleast_2d( np.asarray(elements, dtype=np.float64) )
+    N        = elements.shape[0]
+    epoch    = np.broadcast_to( np.asarray(epoch, dtype=np.float64), (N,) )
+
+    # Step sizes: relative to the magnitude of each element (absolute for elements near zero)
+    steps = rel_step * np.maximum( np.abs(elements), 1e-3 if from_coordtype == 'COM' else 1e-6 )
+
+    # All 2*6 perturbed versions of all N objects are converted in a single call
+    perturbed = np.repeat( elements[:, np.newaxis, np.newaxis, :], 2, axis=1 ).repeat(6, axis=2)   # (N,2,6,6)
+    idx = np.arange(6)
+    perturbed[:, 0, idx, idx] += steps
+    perturbed[:, 1, idx, idx] -= steps
+
+    converted = convert( perturbed.reshape(-1, 6), np.repeat(epoch, 12), from_coordtype, to_coordtype, mu=mu ).reshape(N, 2, 6, 6)
+    diff = converted[:, 0] - converted[:, 1]          # (N, perturbed-element, output-element)
+
+    # Angles that wrap (node & argperi) must be differenced modulo 360
+    if to_coordtype == 'COM':
+        diff[..., _WRAPPED_COM_COLUMNS] = np.remainder( diff[..., _WRAPPED_COM_COLUMNS] + 180.0, 360.0 ) - 180.0
+
+    return np.swapaxes( diff / (2 * steps[:, :, np.newaxis]), 1, 2 )
+
+def propagate_covariance(covariance_stack, J):
+    '''
+    C' = J C J^T for (N,p,p) covariances & (N,6,6) Jacobians
+     - For p > 6 (non-gravs) the Jacobian is extended with an identity block
+    '''
+    covariance_stack = np.asarray(covariance_stack, dtype=np.float64)
+    numparams = covariance_stack.shape[-1]
+    if numparams > 6:
+        J_full = np.broadcast_to( np.eye(numparams), covariance_stack.shape ).copy()
+        J_full[:, :6, :6] = J
+        J = J_full
+    out = np.einsum('nij,njk,nlk->nil', J, covariance_stack, J)
+    return 0.5 * (out + np.swapaxes(out, 1, 2))
+
+def eigval_scale(coordtype, numparams):
+    '''
+    Per-parameter scaling applied to a covariance before orbfit computes its "eigval"
+     - NB: For COM, orbfit computes these with the angles (i, node, argperi) in radians, not degrees
+
+    returns:
+    --------
+    (numparams,) array
+    '''
+    scale = np.ones(numparams)
+    if coordtype == 'COM':
+        scale[_ANGULAR_COM_COLUMNS] = np.pi / 180.0
+    return scale
+
+def eigval(covariance_stack, coordtype):
+    '''
+    orbfit's "eigval" quantity for (N,p,p) covariances: the square-roots of the eigenvalues (ascending)
+     - See *eigval_scale*
+
+    returns:
+    --------
+    (N,p) array
+    '''
+    covariance_stack = np.asarray(covariance_stack, dtype=np.float64)
+    scale = eigval_scale(coordtype, covariance_stack.shape[-1])
+    covariance_stack = covariance_stack * scale[:, np.newaxis] * scale[np.newaxis, :]
+    return np.sqrt( np.clip(np.linalg.eigvalsh(covariance_stack), 0.0, None) )
+
+def transform(elements, epoch, covariance_stack, from_coordtype, to_coordtype, mu=GM_SUN):
+    '''
+    Convert (N,6) elements & (N,p,p) covariances between coordtypes
+
+    returns:
+    --------
+    (N,6) elements, (N,p,p) covariances
+    '''
+    J = jacobian(elements, epoch, from_coordtype, to_coordtype, mu=mu)
+    return convert(elements, epoch, from_coordtype, to_coordtype, mu=mu), propagate_covariance(covariance_stack, J)
+
+
+# -------------------------------------------------------------------
+# Orbfit (eq1dict) blocks
+# -------------------------------------------------------------------
+
+def fill_missing_coordtype(eq1dict):
+    '''
+    If exactly one of the CAR/COM blocks is present in an (eq1) orbfit dict, compute the other one
+     - elements & covariance are transformed
+     - rms = sqrt(diagonal) & eigval (see *eigval*) are recomputed from the covariance
+     - all other quantities (epoch, non-gravs, magnitudes, ...) are copied across
+    NB: Values are expected to already be numbers (see construct.to_nums)
+
+    returns:
+    --------
+    eq1dict (a shallow copy, if a block was added)
+    '''
+    present = [_ for _ in ['CAR','COM'] if eq1dict.get(_)]
+    if len(present) != 1:
+        return eq1dict
+
+    from_coordtype = present[0]
+    to_coordtype   = 'COM' if from_coordtype == 'CAR' else 'CAR'
+    d              = eq1dict[from_coordtype]
+
+    elements = np.array([[ d['element%d' % _] for _ in range(6) ]], dtype=np.float64)
+    new = {k: v for k, v in d.items() if not (k[:7] == 'element' or k[:3] in ['cov', 'nor'] or k in ['rms', 'eigval', 'wea'])}
+    new['coordtype']     = to_coordtype
+    new['element_order'] = list(ELEMENT_NAMES[to_coordtype])
+
+    if 'cov00' in d:
+        cov = covariance.PackedCovariance.from_dict(d, d.get('numparams'))
+        new_elements, new_covariance = transform(elements, d['epoch'], cov.to_array()[np.newaxis], from_coordtype, to_coordtype)
+        new.update( covariance.PackedCovariance.from_array(new_covariance[0]).to_dict() )
+        new['rms']    = np.sqrt( np.diagonal(new_covariance[0]) ).tolist()
+        new['eigval'] = eigval(new_covariance, to_coordtype)[0].tolist()
+    else:
+        new_elements = convert(elements, d['epoch'], from_coordtype, to_coordtype)
+
+    new.update( {'element%d' % i: float(v) for i, v in enumerate(new_elements[0])} )
+
+    eq1dict = dict(eq1dict)
+    eq1dict[to_coordtype] = new
+    return eq1dict
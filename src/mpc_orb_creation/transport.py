@@ -0,0 +1,214 @@
+"""
+mpc_orb_creation/transport.py
+ - Shared-memory transport of constructed mpc_orb dicts from the worker processes to the (single) writer process
+ - Only the numeric parts of each result (the element lists, covariances & fit statistics) go through shared memory:
+   the worker splits the dict (see binary.split) & writes the values, as a fixed-layout float64 array, into its own
+   ring buffer (a multiprocessing.shared_memory block); the rest of the dict (the "skeleton"), the block codes & a small
+   handle, (buffer name, position, offset, length), are returned (pickled) through the executor's result queue
+ - The writer reads the values with np.frombuffer directly from the shared memory, releases the space & puts the
+   values back into the skeleton (binary.join): there is no per-value decoding in Python
+ - Single producer / single consumer per buffer: the producer's write position is private to the worker, the consumer's
+   read position (the "tail") is stored in the header of the block, so the worker never overwrites unreleased results
+ - If a result does not fit in the free space of the buffer, the worker falls back to returning the dict itself
+   (i.e. it is pickled as usual), so that a slow writer never blocks the workers; so do dicts without numeric blocks
+"""
+
+# Standard imports
+# -----------------------
+import concurrent.futures
+import multiprocessing
+import struct
+from multiprocessing import shared_memory
+
+# Third party imports
+# -----------------------
+import numpy as np
+
+# local imports
+# -----------------------
+from mpc_orb_creation import binary
+
+
+# Size of the data region of each ring buffer [bytes] (the numeric blocks of an mpc_orb dict are <1 kB)
+DEFAULT_BUFFER_SIZE = 4 * 2**20
+
+# The header holds the consumer's read position (uint64), padded to a cache line
+HEADER_SIZE = 64
+_TAIL = struct.Struct('<Q')
+
+
+class RingBuffer():
+    '''
+    Single-producer / single-consumer ring buffer of variable-length payloads in a shared-memory block
+    E.g.
+    >>> ring   = RingBuffer.create(2**20)                       # <<-- consumer (creates & owns the block)
+    >>> handle = RingBuffer.attach(ring.name).put(payload)      # <<-- producer (e.g. in a worker process)
+    >>> view   = ring.view(handle)                              # <<-- consumer: memoryview of the payload (no copy)
+    >>> ring.release(handle)
+
+    NB: Positions are logical byte counts (monotonically increasing); a payload never wraps around the end of
+        the buffer (the remainder of the buffer is skipped instead), so that it can be read as a single view
+    '''
+
+    def __init__(self, shm, owner=False):
+        self.shm       = shm
+        self.name      = shm.name
+        self.capacity  = shm.size - HEADER_SIZE
+        self.owner     = owner
+        self._head     = 0           # producer: next write position
+        self._tail     = 0           # consumer: start of the oldest unreleased payload
+        self._released = {}          # consumer: released payloads that are not yet at the tail, start -> end
+
+    @classmethod
+    def create(cls, size=DEFAULT_BUFFER_SIZE):
+        ''' New (zeroed) block with a data region of size bytes '''
+        shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + size)
+        _TAIL.pack_into(shm.buf, 0, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        ''' Existing block (e.g. in a worker process) '''
+        return cls( shared_memory.SharedMemory(name=name) )
+
+    def __repr__(self):
+        return f"RingBuffer(name={self.name}, capacity={self.capacity})"
+
+    # ---- Producer ----
+    def put(self, payload):
+        '''
+        Copy a payload (bytes-like) into the buffer
+
+        returns:
+        --------
+        handle: (name, start, offset, length), or None if there is not enough free space
+        '''
+        n     = len(payload)
+        pos   = self._head % self.capacity
+        pad   = self.capacity - pos if pos + n > self.capacity else 0
+        start = self._head
+        tail  = _TAIL.unpack_from(self.shm.buf, 0)[0]
+        # The new payload must not overlap the unreleased payloads (if any), [tail, start)
+        if n > self.capacity or (tail != start and start + pad + n - tail > self.capacity):
+            return None
+
+        offset = (start + pad) % self.capacity
+        self.shm.buf[HEADER_SIZE + offset:HEADER_SIZE + offset + n] = payload
+        self._head = start + pad + n
+        return (self.name, start, offset, n)
+
+    # ---- Consumer ----
+    def view(self, handle):
+        ''' memoryview of a payload (must be released, view.release(), before the buffer is closed) '''
+        _, _, offset, n = handle
+        return self.shm.buf[HEADER_SIZE + offset:HEADER_SIZE + offset + n]
+
+    def release(self, handle):
+        '''
+        Free the space of a payload
+         - Payloads can be released in any order: the tail only advances over contiguous released payloads
+        '''
+        _, start, offset, n = handle
+        self._released[start] = start + (offset - start) % self.capacity + n
+        while self._tail in self._released:
+            self._tail = self._released.pop(self._tail)
+        _TAIL.pack_into(self.shm.buf, 0, self._tail)
+
+    def close(self):
+        ''' Detach (& destroy the block, if this is the creating process) '''
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# -------------------------------------------------------------------
+# Worker-side
+# -------------------------------------------------------------------
+
+# The ring buffer of this (worker) process, see *attach_worker*
+_worker_buffer = None
+
+def attach_worker(names):
+    ''' ProcessPoolExecutor initializer: take the name of an unused ring buffer from the queue & attach to it '''
+    global _worker_buffer
+    _worker_buffer = RingBuffer.attach( names.get() )
+
+def send(doc):
+    '''
+    Place the numeric blocks of a (constructed) mpc_orb dict in the ring buffer of this worker
+
+    returns:
+    --------
+    (skeleton, codes, handle) (see binary.split & RingBuffer.put),
+    or the dict itself if this process has no buffer, the dict has no numeric blocks or the buffer is full
+    '''
+    if _worker_buffer is None:
+        return doc
+    skeleton, codes, values = binary.split(doc)
+    if not values:
+        return doc
+    handle = _worker_buffer.put( np.asarray(values, dtype='<f8').tobytes() )
+    return (skeleton, codes, handle) if handle is not None else doc
+
+
+# -------------------------------------------------------------------
+# Writer-side
+# -------------------------------------------------------------------
+
+class ResultTransport():
+    '''
+    The ring buffers of a pool of worker processes (owned by the writer / parent process)
+    E.g.
+    >>> transport = ResultTransport(n_workers)
+    >>> executor  = transport.executor()                # <<-- workers call send(doc) & return the result
+    >>> doc       = transport.receive( future.result() )
+    >>> transport.close()
+
+    inputs:
+    -------
+    n_workers: int
+    buffer_size: int, optional
+     - size of the data region of each ring buffer [bytes]
+    mp_context: multiprocessing context, optional
+    '''
+
+    def __init__(self, n_workers, buffer_size=None, mp_context=None):
+        self.n_workers  = n_workers
+        self.mp_context = mp_context if mp_context is not None else multiprocessing.get_context()
+        self.buffers    = {}
+        for _ in range(n_workers):
+            ring = RingBuffer.create(buffer_size if buffer_size else DEFAULT_BUFFER_SIZE)
+            self.buffers[ring.name] = ring
+        self.names = self.mp_context.Queue()
+        for name in self.buffers:
+            self.names.put(name)
+        self.stats = {'shared_memory': 0, 'pickled': 0}
+
+    def executor(self):
+        ''' ProcessPoolExecutor whose workers are each attached to one of the ring buffers '''
+        return concurrent.futures.ProcessPoolExecutor( max_workers=self.n_workers, mp_context=self.mp_context,
+                                                       initializer=attach_worker, initargs=(self.names,) )
+
+    def receive(self, result):
+        ''' The dict for a result returned by *send* (the values are read from the shared memory, which is then released) '''
+        if not (isinstance(result, tuple) and len(result) == 3 and result[2][0] in self.buffers):
+            self.stats['pickled'] += 1
+            return result
+
+        skeleton, codes, handle = result
+        ring = self.buffers[handle[0]]
+        view = ring.view(handle)
+        try:
+            values = np.frombuffer(view, dtype='<f8').tolist()
+        finally:
+            view.release()
+            ring.release(handle)
+        self.stats['shared_memory'] += 1
+        return binary.join(skeleton, codes, values)
+
+    def close(self):
+        ''' Destroy the ring buffers (after the executor has been shut down) '''
+        for ring in self.buffers.values():
+            ring.close()
+        self.buffers = {}
+        self.names.close()
@@ -13,75 +13,114 @@ import copy
 import json
 import sys, os
 import pprint
+import tempfile
 
-# MPC module imports
+# local imports
 # -----------------------
-sys.path.append('/sa/orbit_utils/')
-import create_output_dictionaries2023 as create_output
-
-from count_opps import count_opps
-
-
+#from . import construct
+from mpc_orb_creation import lazy
 from mpc_orb_creation import construct
+from mpc_orb_creation import backends
+from mpc_orb_creation import deadletter
+#from . import create_output_dictionariesNEW2022_03_XX as cod
 
-import orbfit_to_dict
-
-sys.path.append('/sa/python_libs'); import mpc_psql
-
+# NB: numpy-based (only imported on first use)
+residuals      = lazy.LazyModule('mpc_orb_creation.residuals', message="Could not import local module")
 
-# local imports
+# MPC module imports
 # -----------------------
-#from . import construct
-import utility_fetch_orbit_results as fetch  
-#from . import create_output_dictionariesNEW2022_03_XX as cod
+# NB: Only imported on first use (see lazy.py)
+create_output  = lazy.LazyModule('create_output_dictionaries2023', path='/sa/orbit_utils/')
+count_opps     = lazy.LazyModule('count_opps', path='/sa/orbit_utils/')
+orbfit_to_dict = lazy.LazyModule('orbfit_to_dict', path='/sa/python_libs')
+mpc_psql       = lazy.LazyModule('mpc_psql', path='/sa/python_libs')
 
 
 # -------------------------------------------------------------------------
 # Utility code to populate orbfit_result table with mpc_orb_json(b) results 
 # -------------------------------------------------------------------------
 
-def populate_orbfit_results( n_max = None ):
+def populate_orbfit_results( n_max = None , backend = None, designation_backend = None, dead_letter = None, retry_failed = False, clock = None, change_feed = None,
+                             retry_unchanged = False ):
     """
+    Loop through the designations in the orbfit_results table, constructing & inserting the mpc_orb json for each
+
+    backend: backends.OrbfitResultsBackend
+     - store of orbfit results to read from & write to (defaults to the postgres orbfit_results table)
+    designation_backend: backends.DesignationBackend
+     - designation-identifier used by construct (defaults to the postgres designation-identifier)
+    dead_letter: deadletter.DeadLetterQueue
+     - if supplied, failed designations are recorded (stage, exception, input hash) ...
+     - ... and removed again once they have been successfully processed (or no longer have any data)
+     - the input hash is that of the fetched orbfit row (see deadletter.orbfit_inputs)
+    retry_failed: bool
+     - if True, only the designations in the dead_letter queue are (re)processed ...
+     - ... & only those whose inputs have changed since the failure, unless retry_unchanged
+    retry_unchanged: bool
+     - if True, the retry also reprocesses the designations whose inputs are unchanged (e.g. after a fix to the code)
+    clock: function, datetime or str
+     - source of the mpcorb_creation_datetime (see construct.creation_datetime)
+    change_feed: changefeed.ChangeFeed
+     - if supplied, a change record (JSON patch against the stored document) is appended for each document that is written
+
+    returns:
+    --------
+    dict of counts: 'written', 'skipped' (unchanged documents that did not need to be written), 'failed'
     """
+    if backend is None:
+      backend = backends.PostgresOrbfitResultsBackend()
 
     # Get list of designations to process 
-    unpacked_desig_list = fetch.query_unpacked_orbfit_results(n_max=n_max )
+    if retry_failed:
+      if dead_letter is None:
+        raise Exception("retry_failed requires a dead_letter queue")
+      unpacked_desig_list = dead_letter.designations()[:n_max]
+    else:
+      unpacked_desig_list = backend.query_unpacked_orbfit_results(n_max=n_max )
     print(f'len(unpacked_desig_list)={len(unpacked_desig_list)}')
   
+    stats = {'written': 0, 'skipped': 0, 'failed': 0}
+
     # Loop through designations 
     for n, unpacked in enumerate(unpacked_desig_list):
       print(n, unpacked) 
 
+      stage = 'fetch'
+      inputs_hash = None
       try:
         # Get Data for Designation from Database
-        rwo_dict , mid_epoch_dict,  standard_epoch_dict, updated_at, ele220 = fetch.get_dictionaries( unpacked = unpacked )
+        rwo_dict , mid_epoch_dict,  standard_epoch_dict, updated_at, ele220 = backend.get_dictionaries( unpacked = unpacked )
 
         # Skip on to the next object if we do not have data to work with ...
-        if not (rwo_dict and mid_epoch_dict and mid_epoch_dict):
+        # ... (& there is then nothing to retry)
+        if not (rwo_dict and mid_epoch_dict and standard_epoch_dict):
+          if dead_letter is not None:
+            dead_letter.remove(unpacked)
           continue         
 
-        # "otherdict" to pass in assorted parameters ...
-        # NB: Because we are 'back-filling' from the database, some of these other params are going to be untrustworthy
-        # - E.g. the badtrk_params *may* NOT be the ones used at the time the orbit wasa evaluated
-        otherdict = {}
-        otherdict['orbfit_computation_type'] = 'EXTENSION'
-
-        # Use updated_at as the time of orbfit-run (close enough) 
-        otherdict['orbfit_run_datetime'] = updated_at.strftime("%Y/%m/%d_%H:%M:%S") if updated_at else ''
-
-        # collect number of oppositions from ele220
-        if ele220 is None:
- 
-          print('HERE: ele220=', ele220)
-          orbfit_to_dict.dict_to_rwo(rwo_dict,'2000NB21.rwo')
-          orbfit_to_dict.dict_to_fel(standard_epoch_dict,'2000NB21.fel')
-          otherdict['nopp'] = count_opps(rwofile='2000NB21.rwo' , elsfile='2000NB21.fel'  )
-        else:
-          otherdict['nopp'] = int(ele220[140:144].strip())
+        if dead_letter is not None:
+          inputs_hash = deadletter.input_hash( deadletter.orbfit_inputs(rwo_dict, mid_epoch_dict, standard_epoch_dict, updated_at, ele220) )
 
-        moid_dict={}
-        mpcorb_dict = construct.construct( mid_epoch_dict, standard_epoch_dict ,rwo_dict, moid_dict, otherdict  )
+          # Failures whose inputs are unchanged would fail again: leave them in the queue
+          if retry_failed and not retry_unchanged and not dead_letter.inputs_changed(unpacked, inputs_hash):
+            print('Inputs unchanged since the failure: not retried', unpacked)
+            continue
+
+        stage = 'otherdict'
+        otherdict = make_otherdict(rwo_dict, standard_epoch_dict, updated_at, ele220, quality_dict=backend.get_quality_dict(unpacked=unpacked))
 
+        # NB: construct returns an empty dict on failure: its failures are recorded against the hash of the fetched inputs
+        stage = 'construct'
+        moid_dict={}
+        failures = deadletter.FailureCollector()
+        mpcorb_dict = construct.construct( mid_epoch_dict, standard_epoch_dict ,rwo_dict, moid_dict, otherdict ,
+                                           designation_backend=designation_backend, dead_letter=failures, unpacked=unpacked, clock=clock )
+        if not mpcorb_dict:
+          stats['failed'] += 1
+          if dead_letter is not None:
+            for entry in failures.entries:
+              dead_letter.add( dict(entry, input_hash=inputs_hash) )
+          continue
 
 
 
@@ -91,35 +130,70 @@ def populate_orbfit_results( n_max = None ):
 
         # Insert binary form of json into database
         # NB: At point of insert, check data is unchanged 
-        insert_mpc_orb_dict(unpacked, updated_at, mpcorb_dict)
+        # NB: Documents that are semantically identical to the stored one are not re-written
+        stage = 'insert'
+        if backend.write_mpc_orb_dict(unpacked, updated_at, mpcorb_dict, change_feed=change_feed):
+          stats['written'] += 1
+        else:
+          stats['skipped'] += 1
+
+        if dead_letter is not None:
+          dead_letter.remove(unpacked)
 
       except Exception as e:
         print('Exception processing', n, unpacked )
         print(e)
         print()
+        stats['failed'] += 1
+        if dead_letter is not None:
+          dead_letter.record(unpacked, stage, e, inputs_hash=inputs_hash)
 
 
       # Clean up any unnecessary files 
       #os.system("rm *elements *oppfile.log *.clo *.err *.fel *.fga *.fop *.fou *.opp *.pro *.rms *.run *rwo fort.10 badtrkfile_*") 
 
-    return True 
+    print(f'populate_orbfit_results: {stats}')
+    return stats
+
+def make_otherdict(rwo_dict, standard_epoch_dict, updated_at, ele220, quality_dict=None):
+    """
+    "otherdict" to pass in assorted parameters to construct ...
+    NB: Because we are 'back-filling' from the database, some of these other params are going to be untrustworthy
+    - E.g. the badtrk_params *may* NOT be the ones used at the time the orbit wasa evaluated
+    NB: quality_dict is orbfit's quality output (the quality_json of orbfit_results), the source of score1 & score2
+    """
+    otherdict = {}
+    otherdict['orbfit_computation_type'] = 'EXTENSION'
+
+    # orbfit's quality output (see construct.populate_quality_scores)
+    otherdict['quality_dict'] = quality_dict or {}
+
+    # The parameters of the bad-tracklet identification (see construct.identify_bad_tracklets)
+    otherdict['bad_trk_params'] = dict(residuals.BAD_TRK_PARAMS)
+
+    # Use updated_at as the time of orbfit-run (close enough) 
+    otherdict['orbfit_run_datetime'] = updated_at.strftime("%Y/%m/%d_%H:%M:%S") if updated_at else ''
+
+    # collect number of oppositions from ele220
+    # NB: Otherwise count them from the observations, via files in a private temporary directory (so concurrent calls cannot collide)
+    if ele220 is None:
+
+      print('HERE: ele220=', ele220)
+      with tempfile.TemporaryDirectory(prefix='count_opps_') as tmpdir:
+        rwofile = os.path.join(tmpdir, '2000NB21.rwo')
+        elsfile = os.path.join(tmpdir, '2000NB21.fel')
+        orbfit_to_dict.dict_to_rwo(rwo_dict, rwofile)
+        orbfit_to_dict.dict_to_fel(standard_epoch_dict, elsfile)
+        otherdict['nopp'] = count_opps.count_opps(rwofile=rwofile , elsfile=elsfile )
+    else:
+      otherdict['nopp'] = int(ele220[140:144].strip())
+
+    return otherdict
 
 def insert_mpc_orb_dict(unpacked, updated_at, mpc_orb_dict):
-  ''' '''
+  ''' Insert mpc_orb_dict into the (postgres) orbfit_results table '''
   print('insert_mpc_orb_dict')
-  # Connect to db
-  cnx = mpc_psql.connect_to_vmsops()#database='vmsops',host='localhost')
-
-  # Dump dict to 
-  my_json = json.dumps(mpc_orb_dict)
-  print(f'type my_json = {type(my_json)}')
-  # Construct sql
-  sql_str = f"UPDATE orbfit_results SET mpc_orb_jsonb = '{my_json}' WHERE unpacked_primary_provisional_designation = '{unpacked}' and updated_at = '{updated_at}'; " 
-
-  # Execute
-  cursor = cnx.cursor()
-  cursor.execute(sql_str)
-  cnx.commit() 
+  backends.PostgresOrbfitResultsBackend().insert_mpc_orb_dict(unpacked, updated_at, mpc_orb_dict)
   print('DONE:insert_mpc_orb_dict')
 
 
@@ -127,10 +201,7 @@ def make_standard_dict(rwo_dict , mid_epoch_dict,  standard_epoch_dict):
   # Create the default input dictionary (just copied from *test_create_output_dict*, above)
   args = {       'neocp' : "N" ,
                                                                 'istrksub':"N" if ... else "Y" ,
-                                                                'bad_trk_dict':{'bad_obs_weight':5.0,
-                                                                                'fraction_bad':  0.5,
-                                                                                'bad_obs_threshhold':1.0
-                                                                                },
+                                                                'bad_trk_dict':dict(residuals.BAD_TRK_PARAMS),
            }
   arg_dict = {
       'packed_primary_provisional_designation_list' : ['K05SG8D'],
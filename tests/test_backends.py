@@ -0,0 +1,119 @@
+# standard imports
+import os, sys
+import pickle
+from datetime import datetime
+
+# local imports
+from mpc_orb_creation import backends
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+def make_sqlite_backend(db_path=':memory:'):
+  ''' SQLite orbfit_results table, populated with the sample standardized orbfit output '''
+  backend = backends.SQLiteOrbfitResultsBackend(db_path)
+  for fp in filepath_dict['test_pass_orbfit_standard']:
+    d = io.load_json(fp)
+    packed = os.path.basename(fp).split('.')[0]
+    backend.add_orbfit_result( d['eq1dict']['name'], packed, d['rwodict'], d['eq0dict'], d['eq1dict'],
+                               updated_at = datetime(2023, 3, 5, 12, 0, 0) )
+  return backend
+
+
+# functions to be tested
+# ------------------------
+def test_sqlite_orbfit_results_A():
+  ''' Round-trip of the orbfit dictionaries through the SQLite orbfit_results table '''
+  backend = make_sqlite_backend()
+
+  desigs = backend.query_unpacked_orbfit_results()
+  assert desigs == ['2005SD168']
+  assert backend.query_unpacked_orbfit_results(n_max=0) == []
+
+  rwo_dict , mid_epoch_dict,  standard_epoch_dict, updated_at, ele220 = backend.get_dictionaries( packed = 'K05SG8D' )
+  d = io.load_json(filepath_dict['test_pass_orbfit_standard'][0])
+  assert rwo_dict == d['rwodict']
+  assert mid_epoch_dict == d['eq0dict']
+  assert standard_epoch_dict == d['eq1dict']
+  assert updated_at == datetime(2023, 3, 5, 12, 0, 0)
+  assert ele220 is None
+
+  # Unknown designations return empty dicts
+  assert backend.get_dictionaries( packed = 'K99Z99Z' )[:3] == ({}, {}, {})
+
+  # orbfit's quality output ({} if none was stored)
+  assert backend.get_quality_dict( packed = 'K05SG8D' ) == {} and backend.get_quality_dict( packed = 'K99Z99Z' ) == {}
+  backend.add_orbfit_result( '2005SG8D', 'K05SG8Z', d['rwodict'], d['eq0dict'], d['eq1dict'], quality_json={'score1': 1.5} )
+  assert backend.get_quality_dict( unpacked = '2005SG8D' ) == {'score1': 1.5}
+
+
+def test_sqlite_insert_mpc_orb_dict_A():
+  ''' The mpc_orb dict is only written if updated_at is unchanged '''
+  backend = make_sqlite_backend()
+  unpacked = '2005SD168'
+  updated_at = backend.query_desig( unpacked = unpacked )['updated_at']
+
+  backend.insert_mpc_orb_dict(unpacked, datetime(2000, 1, 1), {'stale': True})
+  assert backend.query_desig( unpacked = unpacked )['mpc_orb_jsonb'] is None
+
+  backend.insert_mpc_orb_dict(unpacked, updated_at, {'fresh': True})
+  assert backend.query_desig( unpacked = unpacked )['mpc_orb_jsonb'] == {'fresh': True}
+
+
+def test_sqlite_designation_A():
+  ''' The designation stand-in returns results in the same form as the designation-identifier '''
+  backend = backends.SQLiteDesignationBackend()
+  backend.add_designation('2005SD168', {'unpacked_primary_provisional_designation': '2005 SD168'})
+
+  result = backend.get_ids('2005SD168')
+  assert result['status'] == 'Found'
+  assert result['results'] == {'unpacked_primary_provisional_designation': '2005 SD168'}
+  assert backend.get_ids('2099AA1')['status'] == 'Not Found'
+
+
+def test_sqlite_pickle_A(tmp_path):
+  ''' SQLite backends can be passed to worker processes (the connection is re-opened on first use) '''
+  db_path = str(tmp_path / 'orbfit_results.db')
+  backend = make_sqlite_backend(db_path)
+  clone = pickle.loads(pickle.dumps(backend))
+  assert clone.query_unpacked_orbfit_results() == ['2005SD168']
+
+
+def test_write_mpc_orb_dict_A():
+  ''' Writes are skipped if the stored document only differs in its volatile fields '''
+  backend = backends.SQLiteOrbfitResultsBackend()
+  d = io.load_json(filepath_dict['test_pass_orbfit_standard'][0])
+  backend.add_orbfit_result('2005 SD168', 'K05SG8D', d['rwodict'], d['eq0dict'], d['eq1dict'], updated_at='2023-03-05 12:00:00')
+  doc = {'software_data': {'mpcorb_creation_datetime': '2023-03-05 12:00:00', 'mpcorb_version': '0.1'}, 'moid_data': {'Earth': 0.1}}
+  assert backend.get_mpc_orb_hash('2005 SD168') is None
+
+  assert backend.write_mpc_orb_dict('2005 SD168', '2023-03-05 12:00:00', doc)
+  assert backend.get_mpc_orb_hash('2005 SD168') == io.semantic_hash(doc)
+
+  regenerated = {'software_data': dict(doc['software_data'], mpcorb_creation_datetime='2024-01-01 00:00:00'), 'moid_data': {'Earth': 0.1}}
+  assert io.semantic_hash(regenerated) == io.semantic_hash(doc) and io.content_hash(regenerated) != io.content_hash(doc)
+  assert not backend.write_mpc_orb_dict('2005 SD168', '2023-03-05 12:00:00', regenerated)
+  assert backend.get_mpc_orb_dict('2005 SD168') == doc
+
+  changed = dict(doc, moid_data={'Earth': 0.2})
+  assert backend.write_mpc_orb_dict('2005 SD168', '2023-03-05 12:00:00', changed)
+  assert backend.get_mpc_orb_dict('2005 SD168') == changed
+
+
+def test_write_mpc_orb_dict_B():
+  ''' Nothing is written (or reported as written) if updated_at has changed since the fetch '''
+  backend = backends.SQLiteOrbfitResultsBackend()
+  d = io.load_json(filepath_dict['test_pass_orbfit_standard'][0])
+  backend.add_orbfit_result('2005 SD168', 'K05SG8D', d['rwodict'], d['eq0dict'], d['eq1dict'], updated_at='2023-03-05 12:00:00')
+  doc = {'moid_data': {'Earth': 0.1}}
+
+  assert backend.insert_mpc_orb_dict('2005 SD168', '2023-03-04 12:00:00', doc) == 0
+  assert not backend.write_mpc_orb_dict('2005 SD168', '2023-03-04 12:00:00', doc)
+  assert backend.get_mpc_orb_dict('2005 SD168') is None and backend.get_mpc_orb_hash('2005 SD168') is None
+  assert backend.write_if_changed('UNKNOWN', '2023-03-05 12:00:00', doc, io.semantic_hash(doc)) == 0
+
+  assert backend.write_if_changed('2005 SD168', '2023-03-05 12:00:00', doc, io.semantic_hash(doc)) == 1
+  assert backend.write_if_changed('2005 SD168', '2023-03-05 12:00:00', doc, io.semantic_hash(doc)) == 0
+  assert backend.insert_mpc_orb_dict('2005 SD168', '2023-03-05 12:00:00', doc) == 1
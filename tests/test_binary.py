@@ -0,0 +1,127 @@
+# standard imports
+import os, sys
+import copy
+import json
+import math
+import pickle
+
+import numpy as np
+import pytest
+
+# local imports
+from mpc_orb_creation import binary
+from mpc_orb_creation import covariance
+from mpc_orb_creation import template
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+def assert_identical(a, b):
+  ''' Equal, with the same types & key order (json.dumps distinguishes 1 / 1.0 & preserves the order) '''
+  assert a == b
+  assert json.dumps(a) == json.dumps(b)
+
+def populated_template(numparams=6):
+  ''' The mpc_orb template with (random) floats in the numeric blocks, & nulls in the unused covariance entries '''
+  rng = np.random.default_rng(1)
+  doc = template.get_template_json()
+  for section in ['CAR', 'COM']:
+    for key in ['coefficient_values', 'coefficient_uncertainties', 'eigenvalues']:
+      doc[section][key] = rng.normal(size=numparams).tolist()
+    doc[section]['covariance'] = dict.fromkeys(binary.COVARIANCE_KEYS)
+    doc[section]['covariance'].update( zip(covariance.cov_keys(numparams), rng.normal(size=covariance.packed_size(numparams)).tolist()) )
+  doc['orbit_fit_statistics'].update( {'normalized_RMS': 0.5, 'U_param': None, 'score1': 2.5} )
+  return doc
+
+
+# functions to be tested
+# ------------------------
+def test_split_A():
+  ''' The numeric blocks are taken out of (a copy of) the document as a fixed layout of floats, & put back by join '''
+  doc  = populated_template(7)
+  orig = copy.deepcopy(doc)
+  skeleton, codes, values = binary.split(doc)
+  assert_identical( doc, orig )
+
+  # CAR & COM: 3 vectors of 7 values & a (template-form) covariance of 28 values; then the 6 SNRs & 3 of the 5 scalars
+  # (U_param is null)
+  assert list(codes) == [binary.VECTOR << 4 | 7] * 3 + [binary.COVARIANCE << 4 | 7] + \
+                        [binary.VECTOR << 4 | 7] * 3 + [binary.COVARIANCE << 4 | 7] + \
+                        [binary.VECTOR << 4 | 6] + [binary.SCALAR << 4] * 2 + [0] + [binary.SCALAR << 4] * 2
+  assert len(values) == binary.n_values(codes) == 2 * (3 * 7 + 28) + 6 + 4
+  assert values[21:49] == [ doc['CAR']['covariance'][_] for _ in covariance.cov_keys(7) ]
+  assert skeleton['CAR']['covariance'] is None and skeleton['orbit_fit_statistics']['U_param'] is None
+  assert list(skeleton['CAR']) == list(doc['CAR'])
+
+  assert_identical( binary.join(skeleton, codes, np.array(values).tolist()), doc )
+  with pytest.raises(Exception, match='describe'):
+    binary.join(*binary.split(doc)[:2], values[:-1])
+
+
+def test_split_B():
+  ''' Blocks that are not all floats, or whose covariance keys are not one of the known forms, are left in the skeleton '''
+  doc = {
+    'CAR' : {'coefficient_values'        : [1.0, None, 3.0],
+             'coefficient_uncertainties' : [1.0, 2, 3.0],
+             'eigenvalues'               : [],
+             'covariance'                : dict( zip(covariance.cov_keys(2), [1.0, -0.0, float('inf')]) )},
+    'COM' : {'coefficient_values'        : (1.0, 2.0),
+             'eigenvalues'               : [np.float64(1.0)],
+             'covariance'                : dict( zip(covariance.sequential_cov_keys(3), [1.0] * 6) )},
+    'orbit_fit_statistics' : {'sig_to_noise_ratio' : [0.5] * 16, 'score1': 1, 'score2': True, 'U_param': 2.0,
+                              'normalized_RMS': float('nan')},
+    'other' : {'covariance': {'cov00': 1.0}},
+  }
+  skeleton, codes, values = binary.split(doc)
+  assert [ (binary.LAYOUT[i], code) for i, code in enumerate(codes) if code ] == [
+    (('CAR', 'covariance'), binary.COVARIANCE_PACKED << 4 | 2),
+    (('COM', 'covariance'), binary.COVARIANCE_SEQUENTIAL << 4 | 3),
+    (('orbit_fit_statistics', 'normalized_RMS'), binary.SCALAR << 4),
+    (('orbit_fit_statistics', 'U_param'), binary.SCALAR << 4) ]
+  assert skeleton['CAR']['coefficient_values'] is doc['CAR']['coefficient_values']
+  decoded = binary.decode( binary.encode(doc) )
+  assert math.isnan( decoded['orbit_fit_statistics'].pop('normalized_RMS') )
+  doc['orbit_fit_statistics'].pop('normalized_RMS')
+  assert decoded == doc and math.copysign(1.0, decoded['CAR']['covariance']['cov01']) == -1.0
+  assert type(decoded['COM']['coefficient_values']) is tuple and type(decoded['COM']['eigenvalues'][0]) is np.float64
+
+  # Template-form covariances with a null inside the packed entries (or a float outside them) are not taken
+  for update in [{'cov33': None}, {'cov66': 1.0}, {'cov55': None, 'cov07': 1.0}, {'cov00': 1}]:
+    cov = populated_template(6)['CAR']['covariance']
+    cov.update(update)
+    assert binary.split({'CAR': {'covariance': cov}})[1][3] == 0
+
+
+def test_encode_A():
+  ''' Lossless round-trip of the mpc_orb template & of the sample mpc_orb documents, which are more compact than pickles '''
+  docs = [template.get_template_json(), populated_template(6), populated_template(10)] + \
+         [io.load_json(_) for _ in filepath_dict['test_pass_mpcorb']]
+  for doc in docs:
+    encoded = binary.encode(doc)
+    assert isinstance(encoded, bytes) and encoded[:4] == binary.MAGIC
+    assert_identical( binary.decode(encoded), doc )
+    assert len(encoded) < len(pickle.dumps(doc, protocol=pickle.HIGHEST_PROTOCOL))
+
+  # The values are little-endian float64s, aligned to 8 bytes, directly after the header
+  doc = populated_template(6)
+  values = binary.split(doc)[2]
+  encoded = binary.encode(doc)
+  assert np.frombuffer(encoded, dtype='<f8', count=len(values), offset=binary.HEADER_SIZE).tolist()[:6] == doc['CAR']['coefficient_values']
+  assert binary.HEADER_SIZE % 8 == 0
+
+
+def test_decode_A():
+  ''' Invalid input raises: bad magic number, version or layout hash, & truncated / trailing data '''
+  encoded = binary.encode( populated_template(6) )
+  n       = len(binary.MAGIC)
+  bad_hash = bytearray(encoded)
+  bad_hash[n + 1 + len(binary.LAYOUT)] ^= 0xff
+  for bad, match in [(b'XXXX' + encoded[4:], 'magic'), (encoded[:n] + bytes([binary.VERSION + 1]) + encoded[n + 1:], 'version'),
+                     (bytes(bad_hash), 'layout'), (encoded + b'\x00', 'bytes'), (encoded[:-1], 'bytes'), (encoded[:8], 'magic')]:
+    with pytest.raises(Exception, match=match):
+      binary.decode(bad)
+
+  with pytest.raises(Exception):
+    binary.encode([1.0])
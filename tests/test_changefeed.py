@@ -0,0 +1,148 @@
+# standard imports
+import os, sys
+import copy
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+# local imports
+from mpc_orb_creation import changefeed
+from mpc_orb_creation import backends
+from mpc_orb_creation import construct
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+def no_validation(mpcorb_dict, sections):
+  ''' Stand-in validator (mpc_orb is not required to run these tests) '''
+  pass
+
+def get_updated(doc):
+  ''' A re-computed version of an mpc_orb dict: new MOIDs, magnitude & rms, & a dropped key '''
+  new = copy.deepcopy(doc)
+  new['moid_data'] = {'Earth': 0.012345, 'Mars': None}
+  new['magnitude_data']['h'] += 0.1
+  new['COM']['rms'] = 0.5
+  new['system_data'].pop('eph')
+  return new
+
+
+# functions to be tested
+# ------------------------
+def test_diff_A():
+  ''' diff / apply round-trip on the sample mpc_orb documents: the patch is small & the original is not modified '''
+  for fp in filepath_dict['test_pass_mpcorb']:
+    old = io.load_json(fp)
+    new = get_updated(old)
+    snapshot = copy.deepcopy(old)
+
+    patch = changefeed.diff(old, new)
+    assert {op['op'] for op in patch} <= {'add', 'remove', 'replace'}
+    assert {'/moid_data', '/magnitude_data/h', '/COM/rms', '/system_data/eph'} == {op['path'] for op in patch}
+    assert changefeed.apply(old, patch) == new and old == snapshot
+    assert changefeed.diff(old, copy.deepcopy(old)) == []
+    assert len(json.dumps(patch)) < 0.1 * len(json.dumps(new))
+
+
+def test_diff_B():
+  ''' Pointer escaping, list changes, type changes (1 vs 1.0 vs True) & nan '''
+  old = {'a/b': 1, 'm~n': [1, 2, 3], 'x': [1, 2], 't': 1, 'nan': float('nan'), 'gone': None}
+  new = {'a/b': 2, 'm~n': [1, 5, 3], 'x': [1, 2, 3], 't': 1.0, 'nan': float('nan'), 'new': {'k': True}}
+  patch = changefeed.diff(old, new)
+  assert sorted( (op['op'], op['path']) for op in patch ) == sorted([
+    ('remove', '/gone'), ('replace', '/a~1b'), ('replace', '/m~0n/1'), ('replace', '/x'), ('replace', '/t'), ('add', '/new') ])
+  patched = changefeed.apply(old, patch)
+  assert json.dumps(patched, sort_keys=True) == json.dumps(new, sort_keys=True)
+
+
+def test_apply_A():
+  ''' The other RFC 6902 operations, & invalid patches raise '''
+  doc = {'a': [1, 2], 'b': {'c': 3}}
+  patch = [ {'op': 'add', 'path': '/a/-', 'value': 4}, {'op': 'add', 'path': '/a/0', 'value': 0},
+            {'op': 'test', 'path': '/a', 'value': [0, 1, 2, 4]},
+            {'op': 'copy', 'from': '/b', 'path': '/d'}, {'op': 'move', 'from': '/b/c', 'path': '/e'},
+            {'op': 'remove', 'path': '/a/1'} ]
+  assert changefeed.apply(doc, patch) == {'a': [0, 2, 4], 'b': {}, 'd': {'c': 3}, 'e': 3}
+  assert changefeed.apply(doc, [{'op': 'replace', 'path': '', 'value': [1]}]) == [1]
+
+  for op in [ {'op': 'remove', 'path': '/z'}, {'op': 'replace', 'path': '/a/2', 'value': 0}, {'op': 'add', 'path': 'a', 'value': 0},
+              {'op': 'test', 'path': '/b/c', 'value': 3.0}, {'op': 'move', 'from': '/b', 'path': '/b/x'}, {'op': 'swap', 'path': '/a'},
+              {'op': 'add', 'path': '/a/01', 'value': 0} ]:
+    with pytest.raises(Exception):
+      changefeed.apply(doc, [op])
+
+
+def test_change_feed_A(tmp_path):
+  ''' Versions per designation, replay & resumption from a seq; the versions are recovered when the feed is reopened '''
+  path = str(tmp_path / 'feed.jsonl')
+  feed = changefeed.ChangeFeed(path)
+  docs = [ io.load_json(fp) for fp in filepath_dict['test_pass_mpcorb'][:2] ]
+
+  first = feed.append('A', None, docs[0], written_at=datetime(2026, 1, 1))
+  assert first['version'] == 1 and first['base_hash'] is None and first['written_at'] == '2026-01-01 00:00:00'
+  assert changefeed.ChangeFeed(str(tmp_path / 'utc.jsonl')).append(
+    'A', None, docs[0], written_at=datetime(2026, 1, 1, 1, tzinfo=timezone(timedelta(hours=1))))['written_at'] == '2026-01-01 00:00:00'
+  feed.append('B', None, docs[1])
+  updated = get_updated(docs[0])
+  assert feed.append('A', docs[0], docs[0]) is None
+  feed.append('A', docs[0], updated)
+  assert len(feed) == 3 and feed.versions() == {'A': 2, 'B': 1}
+
+  reopened = changefeed.ChangeFeed(path)
+  assert len(reopened) == 3 and reopened.version('A') == 2 and reopened.version('C') == 0
+  assert reopened.replay('A') == updated and reopened.replay('B') == docs[1] and reopened.replay('C') is None
+
+  # A consumer that has seen the first two records applies the delta only
+  mirror = {'A': copy.deepcopy(docs[0]), 'B': docs[1]}
+  for record in reopened.records(since=2):
+    mirror[record['unpacked']] = changefeed.apply_record(mirror[record['unpacked']], record)
+  assert mirror['A'] == updated
+
+  # ... but not to the wrong base version
+  record = list(reopened.records(unpacked='A'))[-1]
+  with pytest.raises(Exception):
+    changefeed.apply_record(docs[1], record)
+  assert reopened.append('A', updated, docs[0])['version'] == 3
+
+
+def test_change_feed_B(tmp_path):
+  ''' Backend writes emit one record per written document (none for skipped, semantically identical, writes) '''
+  feed = changefeed.ChangeFeed(str(tmp_path / 'feed.jsonl'))
+  backend = backends.SQLiteOrbfitResultsBackend()
+  d = io.load_json(filepath_dict['test_pass_orbfit_standard'][0])
+  backend.add_orbfit_result('2005 SD168', 'K05SG8D', d['rwodict'], d['eq0dict'], d['eq1dict'], updated_at='2023-03-05 12:00:00')
+  doc = io.load_json(filepath_dict['test_pass_mpcorb'][0])
+
+  regenerated = dict(doc, software_data={'mpcorb_creation_datetime': '2026-01-01 00:00:00'})
+  doc = dict(doc, software_data={'mpcorb_creation_datetime': '2025-01-01 00:00:00'})
+  assert backend.write_mpc_orb_dict('2005 SD168', '2023-03-05 12:00:00', doc, change_feed=feed)
+  assert not backend.write_mpc_orb_dict('2005 SD168', '2023-03-05 12:00:00', regenerated, change_feed=feed)
+  updated = get_updated(regenerated)
+  assert backend.write_mpc_orb_dict('2005 SD168', '2023-03-05 12:00:00', updated, change_feed=feed)
+
+  # A write with a stale updated_at (the orbfit result has since been replaced) updates no row: nothing is appended
+  stale = dict(updated, moid_data={'Earth': 0.5, 'Mars': None})
+  assert not backend.write_mpc_orb_dict('2005 SD168', '2023-01-01 00:00:00', stale, change_feed=feed)
+  assert len(feed) == 2 and backend.get_mpc_orb_dict('2005 SD168') == updated
+
+  records = list(feed.records())
+  assert [ (r['unpacked'], r['version']) for r in records ] == [('2005 SD168', 1), ('2005 SD168', 2)]
+  assert feed.replay('2005 SD168') == backend.get_mpc_orb_dict('2005 SD168') == updated
+
+
+def test_change_feed_C(tmp_path):
+  ''' construct.update emits the patch of the recomputed sections only '''
+  feed = changefeed.ChangeFeed(str(tmp_path / 'feed.jsonl'))
+  existing = dict( io.load_json(filepath_dict['test_pass_mpcorb'][0]), moid_data={'Earth': 0.1, 'Mars': 0.2} )
+  updated = construct.update(existing, {'moidsdict': {'Earth': 0.05}}, validator=no_validation, change_feed=feed, unpacked='X')
+  record, = feed.records()
+  assert all( op['path'].startswith('/moid_data/') for op in record['patch'] )
+  assert changefeed.apply_record(existing, record) == updated
+
+  # The records are keyed by designation, so one must be given
+  with pytest.raises(Exception, match='unpacked'):
+    construct.update(existing, {'moidsdict': {'Earth': 0.05}}, validator=no_validation, change_feed=feed)
+  assert len(feed) == 1
@@ -0,0 +1,158 @@
+# standard imports
+import os, sys
+import json
+
+import numpy as np
+import pytest
+
+# local imports
+from mpc_orb_creation import covariance
+from mpc_orb_creation import transform
+from mpc_orb_creation import construct
+from mpc_orb_creation import template
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+def random_covariance(numparams, seed=0):
+  ''' Random symmetric positive-definite matrix '''
+  A = np.random.default_rng(seed).normal(size=(numparams, numparams))
+  return A @ A.T + numparams * np.eye(numparams)
+
+
+# functions to be tested
+# ------------------------
+def test_packed_covariance_A():
+  ''' The keyed-dict form of the sample orbfit output round-trips through the packed & square forms '''
+  eq1dict = io.load_json(filepath_dict['test_pass_orbfit_standard'][0])['eq1dict']
+  for coordtype in ['CAR', 'COM']:
+    cov = covariance.PackedCovariance.from_dict(eq1dict[coordtype])
+    assert cov.numparams == int(eq1dict[coordtype]['numparams'])
+
+    array = cov.to_array()
+    assert array.shape == (6, 6)
+    assert np.array_equal(array, array.T)
+    assert array[1, 4] == float(eq1dict[coordtype]['cov14'])
+
+    assert covariance.PackedCovariance.from_array(array) == cov
+    assert cov.to_dict() == {k: float(v) for k, v in eq1dict[coordtype].items() if k[:3] == 'cov'}
+    assert np.array_equal(cov.diagonal(), np.diag(array))
+
+
+def test_packed_covariance_B():
+  ''' Inferring numparams ignores the null entries in the template & rejects inconsistent sizes '''
+  cov_dict = covariance.PackedCovariance.from_array(random_covariance(7)).to_dict()
+  template_like = {'cov%d%d' % (i, j): None for i in range(10) for j in range(i, 10)}
+  template_like.update(cov_dict)
+  assert covariance.infer_numparams(template_like) == 7
+  assert covariance.PackedCovariance.from_dict(template_like).to_dict() == cov_dict
+
+  with pytest.raises(Exception):
+    covariance.PackedCovariance(np.zeros(20))
+  with pytest.raises(Exception):
+    covariance.cov_keys(11)
+
+
+def test_packed_covariance_C():
+  ''' The dict's numparams is used: the older sequential numbering is converted, & inconsistent keys raise '''
+  for fp in filepath_dict['test_pass_orbfit_general']:
+    d = io.load_json(fp)
+    for coordtype in ['CAR', 'COM']:
+      if d[coordtype]:
+        cov = covariance.PackedCovariance.from_dict(d[coordtype])
+        assert cov.numparams == int(d[coordtype]['numparams'])
+        assert np.allclose( np.sqrt(cov.diagonal()), np.array(d[coordtype]['rms'], dtype=float), rtol=1e-4 )
+
+  # e.g. 10199 (CAR) uses the sequential numbering: cov06 is the (1,1) element
+  d = io.load_json([_ for _ in filepath_dict['test_pass_orbfit_general'] if '10199' in _][0])['CAR']
+  assert covariance.is_sequential(d)
+  array = covariance.PackedCovariance.from_dict(d).to_array()
+  assert array[1, 1] == float(d['cov06']) and array[2, 2] == float(d['cov11']) and array[5, 5] == float(d['cov20'])
+  assert np.array_equal( covariance.PackedCovariance.from_dict(d, 3).to_array(), array[:3, :3] )
+
+  cov_dict = covariance.PackedCovariance.from_array(random_covariance(7)).to_dict()
+  for bad in [ dict(cov_dict, numparams=8), dict(cov_dict, numparams=6), dict(cov_dict, cov44=None) ]:
+    with pytest.raises(Exception):
+      covariance.PackedCovariance.from_dict(bad)
+  with pytest.raises(Exception):
+    covariance.PackedCovariance.from_dict(cov_dict, 8)
+
+
+def test_stack_A():
+  ''' Batched (N,p,p) <-> (N,p(p+1)/2) conversions '''
+  arrays = np.stack([random_covariance(6, seed=seed) for seed in range(5)])
+  packed = covariance.pack_stack(arrays)
+  assert packed.shape == (5, 21)
+  assert np.array_equal(covariance.unpack_stack(packed), arrays)
+  assert np.array_equal(covariance.stack([covariance.PackedCovariance(_) for _ in packed]), arrays)
+
+  with pytest.raises(Exception):
+    covariance.stack([covariance.PackedCovariance.from_array(random_covariance(n)) for n in (6, 7)])
+
+
+def test_check_stack_A():
+  ''' The sample orbfit covariances are consistent with their eigval & rms (COM eigval use radians) '''
+  eq1dict = construct.to_nums( io.load_json(filepath_dict['test_pass_orbfit_standard'][0])['eq1dict'] )
+  for coordtype in ['CAR', 'COM']:
+    C = covariance.PackedCovariance.from_dict(eq1dict[coordtype]).to_array()
+    checks = covariance.check_stack( [C], [eq1dict[coordtype]['eigval']], [eq1dict[coordtype]['rms']],
+                                     eigval_scale=transform.eigval_scale(coordtype, 6) )
+    assert set(checks) == {'finite', 'symmetric', 'positive_definite', 'eigval_consistent', 'rms_consistent', 'ok'}
+    assert checks['ok'].tolist() == [True]
+
+  # Without the radian scaling, the COM eigval do not match
+  C = covariance.PackedCovariance.from_dict(eq1dict['COM']).to_array()
+  assert not covariance.check_stack( [C], [eq1dict['COM']['eigval']] )['eigval_consistent'][0]
+
+
+def test_check_stack_B():
+  ''' Each kind of problem is flagged for the affected matrices only '''
+  good = np.stack([ random_covariance(6, seed=_) for _ in range(6) ])
+  eigval = np.sqrt( np.linalg.eigvalsh(good) )
+  rms    = np.sqrt( np.diagonal(good, axis1=1, axis2=2) )
+
+  stack = good.copy()
+  stack[1, 0, 1] += 1.0                                       # <<-- not symmetric
+  stack[2] = -stack[2]                                        # <<-- not positive-definite
+  stack[3, 2, 2] = np.nan                                     # <<-- not finite
+  eigval[4] *= 1.01                                           # <<-- eigval inconsistent
+  rms[5, 0] *= 1.01                                           # <<-- rms inconsistent
+
+  checks = covariance.check_stack(stack, eigval, rms)
+  assert checks['ok'].tolist() == [True, False, False, False, False, False]
+  assert [covariance.failed_checks(checks, n) for n in range(6)] == [ [], ['symmetric'], ['positive_definite', 'eigval_consistent', 'rms_consistent'],
+                                                                      ['finite', 'eigval_consistent', 'rms_consistent'], ['eigval_consistent'], ['rms_consistent'] ]
+
+  # Without reported values, only the matrices themselves are checked
+  assert covariance.check_stack(stack)['ok'].tolist() == [True, False, False, False, True, True]
+
+
+def test_check_covariance_A():
+  ''' Covariances that are inconsistent with the reported rms, or incomplete, are flagged (& are still copied into the document) '''
+  eq1dict = construct.to_nums( io.load_json(filepath_dict['test_pass_orbfit_standard'][0])['eq1dict'] )
+  assert construct.check_covariance(eq1dict['CAR'], 'CAR') == [] and construct.check_covariance(eq1dict['COM'], 'COM') == []
+
+  eq1dict['CAR']['rms'][3] *= 2
+  mpcorb = template.get_template_json()
+  construct.populate_CAR_COM( eq1dict, mpcorb )
+  assert construct.covariance_checks( eq1dict ) == ['CAR:rms_consistent']
+  assert mpcorb['CAR']['coefficient_uncertainties'][3] == eq1dict['CAR']['rms'][3]
+
+  # Incomplete covariances are copied as they are
+  eq1dict = construct.to_nums( io.load_json(filepath_dict['test_pass_orbfit_standard'][0])['eq1dict'] )
+  del eq1dict['COM']['cov33']
+  mpcorb = template.get_template_json()
+  construct.populate_CAR_COM( eq1dict, mpcorb )
+  assert construct.covariance_checks( eq1dict ) == ['COM:complete']
+  assert mpcorb['COM']['covariance']['cov34'] == eq1dict['COM']['cov34']
+
+
+def test_check_covariance_B():
+  ''' The general orbfit samples (incl. the older, sequential, covIJ numbering) pass the checks '''
+  for fp in filepath_dict['test_pass_orbfit_general']:
+    eq1dict = construct.to_nums( io.load_json(fp) )
+    for coordtype in ['CAR', 'COM']:
+      if coordtype in eq1dict and 'cov00' in eq1dict[coordtype]:
+        assert construct.check_covariance(eq1dict[coordtype], coordtype) == [], (fp, coordtype)
@@ -0,0 +1,76 @@
+# standard imports
+import os, sys
+import pickle
+from datetime import datetime, timedelta
+
+import pytest
+
+# local imports
+from mpc_orb_creation import deadletter
+from mpc_orb_creation import io
+
+
+# functions to be tested
+# ------------------------
+def test_record_A():
+  ''' Failures are recorded with structured error info '''
+  dlq = deadletter.DeadLetterQueue()
+  try:
+    {}['CAR']
+  except Exception as e:
+    dlq.record('2005SD168', 'populate', e, inputs=[{'a': 1}, {'b': 2}])
+
+  assert len(dlq) == 1 and '2005SD168' in dlq
+  entry, = dlq.entries()
+  assert entry['stage'] == 'populate'
+  assert entry['exception_type'] == 'KeyError'
+  assert entry['message'] == "'CAR'"
+  assert 'KeyError' in entry['traceback']
+  assert entry['input_hash'] == deadletter.input_hash([{'a': 1}, {'b': 2}])
+  assert entry['n_failures'] == 1
+  assert len(entry['failed_at']) == 19 and abs( datetime.fromisoformat(entry['failed_at']) - io.utc_now() ) < timedelta(minutes=1)
+
+
+def test_record_B():
+  ''' Repeated failures update the entry & count; entries can be filtered & removed '''
+  dlq = deadletter.DeadLetterQueue()
+  dlq.record('2005SD168', 'populate', KeyError('CAR'))
+  dlq.record('2005SD168', 'validate', AssertionError())
+  dlq.record('2000NB21',  'fetch',    ValueError('no data'))
+
+  assert dlq.designations() == ['2005SD168', '2000NB21']
+  assert dlq.designations(stage='fetch') == ['2000NB21']
+  entry = dlq.entries(stage='validate')[0]
+  assert entry['n_failures'] == 2 and entry['exception_type'] == 'AssertionError'
+
+  dlq.remove('2005SD168')
+  assert dlq.designations() == ['2000NB21']
+
+
+def test_input_hash_A():
+  ''' The input hash is independent of key-order, but sensitive to content '''
+  assert deadletter.input_hash({'a': 1, 'b': [1, 2]}) == deadletter.input_hash({'b': [1, 2], 'a': 1})
+  assert deadletter.input_hash({'a': 1}) != deadletter.input_hash({'a': 2})
+
+
+def test_inputs_changed_A():
+  ''' A retry is only needed if the inputs differ from those of the recorded failure (or are unknown) '''
+  dlq = deadletter.DeadLetterQueue()
+  inputs = deadletter.orbfit_inputs({'a': 1}, {'b': 2}, {'c': 3}, None, None)
+  dlq.record('2005SD168', 'populate', KeyError('CAR'), inputs=inputs)
+  dlq.record('2000NB21',  'fetch',    ValueError('no data'))
+
+  assert not dlq.inputs_changed('2005SD168', deadletter.input_hash(inputs))
+  assert dlq.inputs_changed('2005SD168', deadletter.input_hash(inputs[:-1] + [' '*140 + '   2']))
+  assert dlq.inputs_changed('2000NB21', deadletter.input_hash(inputs))
+  assert dlq.inputs_changed('UNKNOWN', deadletter.input_hash(inputs))
+
+
+def test_collector_A(tmp_path):
+  ''' Entries collected in a worker can be added to the (pickled-to-path) queue by the parent '''
+  collector = deadletter.FailureCollector()
+  collector.record('2005SD168', 'populate', ZeroDivisionError('x'))
+  dlq = pickle.loads(pickle.dumps(deadletter.DeadLetterQueue(str(tmp_path / 'dlq.db'))))
+  for entry in collector.entries:
+    dlq.add(entry)
+  assert dlq.designations() == ['2005SD168']
@@ -0,0 +1,58 @@
+# standard imports
+import os, sys
+import glob
+import json
+import subprocess
+
+# local imports
+from mpc_orb_creation import filepaths
+from mpc_orb_creation import template
+from mpc_orb_creation.filepaths import filepath_dict
+
+# directories...
+test_dir = os.path.dirname(os.path.realpath(__file__))
+src_dir  = os.path.join(os.path.dirname(test_dir), 'src')
+
+
+# ---- Tests ----
+def test_no_glob_on_import():
+  ''' Importing filepaths (or template) does not list any directories '''
+  code = ( "import glob, json\n"
+           "calls = []\n"
+           "_glob = glob.glob\n"
+           "glob.glob = lambda *a, **k: calls.append(a) or _glob(*a, **k)\n"
+           "from mpc_orb_creation import template\n"
+           "from mpc_orb_creation.filepaths import filepath_dict\n"
+           "n_import = len(calls)\n"
+           "filepath_dict['test_pass_mpcorb']; filepath_dict['test_pass_mpcorb']\n"
+           "print(json.dumps([n_import, len(calls)]))\n" )
+  env = dict(os.environ, PYTHONPATH=src_dir + os.pathsep + os.environ.get('PYTHONPATH', ''))
+  out = subprocess.run([sys.executable, '-c', code], env=env, check=True, stdout=subprocess.PIPE)
+  n_import, n_total = json.loads(out.stdout.decode().strip().splitlines()[-1])
+  assert n_import == 0
+  assert n_total == 1 # <<-- Globbed once on first access, then cached
+
+
+def test_registry_contents():
+  ''' The registry resolves to the same file-lists as a direct glob '''
+  assert set(filepath_dict['test_pass_mpcorb']) == set(glob.glob(filepaths.tj_dir + "/pass_mpcorb/*"))
+  assert set(filepath_dict['orbfit_defining_sample_general']) == set( glob.glob(filepaths.def_gen_dir + "/*str.json") + glob.glob(filepaths.def_gen_dir + "/*orig.json") )
+  assert len(filepath_dict['mpcorb_defining_sample']) == len(filepath_dict['orbfit_defining_sample_convert'])
+  assert os.path.isfile(filepath_dict['mpcorb_template'])
+  assert 'test_pass_orbfit_standard' in filepath_dict
+  assert len(dict(filepath_dict)) == len(filepath_dict)
+
+
+def test_find_json_dir(tmp_path, monkeypatch):
+  ''' The json directory can be relocated (e.g. for an installed wheel) '''
+  assert filepaths.find_json_dir() == os.path.join(filepaths.pack_dir, 'json_files')
+  monkeypatch.setenv('MPC_ORB_CREATION_JSON_DIR', str(tmp_path))
+  assert filepaths.find_json_dir() == str(tmp_path)
+
+
+def test_template_copy():
+  ''' The template is cached, but each call gets an independent copy '''
+  t1 = template.get_template_json()
+  t1['CAR']['coefficient_values'][0] = 99.0
+  t2 = template.get_template_json()
+  assert t2['CAR']['coefficient_values'][0] == 0.0
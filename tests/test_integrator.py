@@ -0,0 +1,113 @@
+# standard imports
+import os, sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+# local imports
+from mpc_orb_creation import integrator
+from mpc_orb_creation import template
+
+
+# utility functionalities
+# ---------------------
+def random_states(N, seed=0):
+  rng = np.random.default_rng(seed)
+  return np.concatenate([ rng.uniform(-3, 3, (N, 3)), rng.uniform(-0.01, 0.01, (N, 3)) ], axis=1)
+
+
+# functions to be tested
+# ------------------------
+def test_ecliptic_to_equatorial_A():
+  ''' The ecliptic pole maps to (0, -sin(eps), cos(eps)); lengths are preserved '''
+  eps = np.radians(integrator.OBLIQUITY_ARCSEC / 3600)
+  states = np.array([[0.0, 0.0, 1.0, 1.0, 0.0, 0.0]])
+  assert np.allclose( integrator.ecliptic_to_equatorial(states), [[0.0, -np.sin(eps), np.cos(eps), 1.0, 0.0, 0.0]] )
+
+  states = random_states(20)
+  rotated = integrator.ecliptic_to_equatorial(states.copy())
+  assert np.allclose( np.linalg.norm(rotated[:, :3], axis=1), np.linalg.norm(states[:, :3], axis=1) )
+  assert np.allclose( rotated[:, [0, 3]], states[:, [0, 3]] )
+
+
+def test_export_A():
+  ''' Objects are sorted by epoch into contiguous blocks, which are exported as views '''
+  states = random_states(7)
+  epoch  = [59000.0, 58000.0, 59000.0, 60000.0, 58000.0, 59000.0, 60000.0]
+  data = integrator.export(states, epoch, barycentric=True, timesystem='TDB', rotate_to_equatorial=False)
+
+  assert data['n_particles'] == 7 and data['n_var'] == 0
+  assert data['order'].tolist() == [1, 4, 0, 2, 5, 3, 6]
+  assert np.array_equal( data['instate_arr'], states[data['order']] )
+  assert data['instate_arr'].dtype == np.float64 and data['instate_arr'].flags['C_CONTIGUOUS']
+  assert [(t, s.start, s.stop) for t, s in data['epoch_groups']] == [(58000.0, 0, 2), (59000.0, 2, 5), (60000.0, 5, 7)]
+
+  group = integrator.epoch_group(data, 1)
+  assert group['tstart'] == 59000.0 and group['n_particles'] == 3 and (group['timesystem'], group['timeform']) == ('TDB', 'MJD')
+  assert np.shares_memory( group['instate_arr'], data['instate_arr'] ) and group['instate_arr'].flags['C_CONTIGUOUS']
+  assert np.array_equal( group['instate_arr'], states[[0, 2, 5]] )
+
+  # The input states are not modified (even when rotated / shifted)
+  copy = states.copy()
+  integrator.export(states, epoch, sun_state=np.ones(6))
+  assert np.array_equal( states, copy )
+
+
+def test_export_B():
+  ''' Variational particles (identity seeds) & barycentric shifts '''
+  states = random_states(4)
+  data = integrator.export(states, [2.0, 1.0, 1.0, 2.0], variational=True, rotate_to_equatorial=False, sun_state=np.arange(24.0).reshape(4, 6), timesystem='TDB')
+  assert data['n_var'] == 24 and data['invar'].shape == (24, 6) and data['invar_part'].shape == (24,)
+  assert np.array_equal( data['invar'][6:12], np.eye(6) ) and data['invar_part'][6:12].tolist() == [1] * 6
+  assert np.allclose( data['instate_arr'], states[data['order']] + np.arange(24.0).reshape(4, 6)[data['order']] )
+
+  group = integrator.epoch_group(data, 1)
+  assert group['n_var'] == 12 and group['invar_part'].tolist() == [0] * 6 + [1] * 6
+  assert np.shares_memory( group['invar'], data['invar'] )
+
+
+def test_export_catalogue_A():
+  ''' Export of mpc_orb dicts & parse.MPCORB(-like) objects: the system_data decides on the rotation '''
+  states = random_states(3)
+  docs = []
+  for n in range(3):
+    doc = template.get_template_json()
+    doc['CAR']['coefficient_values'] = states[n].tolist() + [None]
+    doc['epoch_data']['epoch'] = 59000.0 + n
+    docs.append(doc)
+
+  data = integrator.export_catalogue(docs, barycentric=True)
+  assert np.allclose( data['instate_arr'], integrator.ecliptic_to_equatorial(states.copy()) )
+  assert np.allclose( data['epoch'], integrator.to_tdb([59000.0, 59001.0, 59002.0], 'TDT') )     # <<-- template epochs are TDT
+
+  docs[0]['system_data']['refsys'] = 'Equatorial'
+  assert np.array_equal( integrator.export_catalogue(docs, barycentric=True)['instate_arr'], states )
+
+  mpcorbs = [ SimpleNamespace(CAR={'element_array': states[n]}, epoch_data=docs[n]['epoch_data'], system_data=docs[1]['system_data']) for n in range(3) ]
+  data = integrator.export_mpcorb(mpcorbs, sun_state=np.ones(6), variational=True)
+  assert np.allclose( data['instate_arr'], integrator.ecliptic_to_equatorial(states.copy()) + 1 ) and data['n_var'] == 18
+  assert integrator.export_catalogue([], barycentric=True)['n_particles'] == 0
+
+  # The epochs must share a time system
+  docs[2]['epoch_data']['timesystem'] = 'TDB'
+  with pytest.raises(Exception, match="more than one time system"):
+    integrator.export_catalogue(docs, barycentric=True)
+
+
+def test_export_C():
+  ''' Heliocentric states are refused without the state of the Sun; epochs are converted to TDB '''
+  states = random_states(2)
+  with pytest.raises(Exception, match="barycentric"):
+    integrator.export(states, [59000.0, 59000.0])
+  with pytest.raises(Exception, match="already barycentric"):
+    integrator.export(states, [59000.0, 59000.0], sun_state=np.ones(6), barycentric=True)
+  with pytest.raises(Exception, match="UTC"):
+    integrator.export(states, [59000.0, 59000.0], barycentric=True, timesystem='UTC')
+
+  # TDB - TT is periodic (annual), with an amplitude of ~1.7 ms
+  tt  = 51544.5 + np.linspace(0, 365.25, 1000)
+  dt  = (integrator.to_tdb(tt, 'TT') - tt) * 86400
+  assert 0.0016 < np.abs(dt).max() < 0.0017
+  assert np.array_equal( integrator.to_tdb(tt, 'TDB'), tt ) and np.array_equal( integrator.to_tdb(tt, 'tdt'), integrator.to_tdb(tt, 'TT') )
+  assert np.allclose( integrator.export(states, [59000.0, 59000.0], barycentric=True)['epoch'], integrator.to_tdb(59000.0, 'TDT'), rtol=0, atol=1e-12 )
@@ -0,0 +1,46 @@
+# standard imports
+import os, sys
+from datetime import datetime, timedelta, timezone
+
+# local imports
+from mpc_orb_creation import io
+from mpc_orb_creation import construct
+from mpc_orb_creation import template
+
+
+# functions to be tested
+# ------------------------
+def test_canonical_json_A():
+  ''' Key order does not affect the canonical json or the hash '''
+  a = {'b': [1, 2.5, None], 'a': {'y': True, 'x': 'str'}}
+  b = {'a': {'x': 'str', 'y': True}, 'b': [1, 2.5, None]}
+  assert io.canonical_json(a) == io.canonical_json(b) == '{"a":{"x":"str","y":true},"b":[1,2.5,null]}'
+  assert io.content_hash(a) == io.content_hash(b)
+  assert io.content_hash(a) != io.content_hash(dict(a, c=0))
+
+
+def test_creation_datetime_A():
+  ''' The creation time can be fixed (deterministic mode) or supplied by an injectable clock '''
+  fixed = datetime(2023, 3, 5, 12, 0, 0)
+  assert construct.creation_datetime(fixed) == '2023-03-05 12:00:00'
+  assert construct.creation_datetime(lambda: fixed) == '2023-03-05 12:00:00'
+  assert construct.creation_datetime('2023-03-05 12:00:00') == '2023-03-05 12:00:00'
+  assert len(construct.creation_datetime()) == 19
+
+  docs = []
+  for _ in range(2):
+    mpcorb = template.get_template_json()
+    construct.populate_software_data({'orbfit_run_datetime': '2023/03/05_11:00:00'}, mpcorb, clock=fixed)
+    docs.append(mpcorb)
+  assert docs[0]['software_data']['mpcorb_creation_datetime'] == '2023-03-05 12:00:00'
+  assert io.content_hash(docs[0]) == io.content_hash(docs[1])
+
+
+def test_timestamp_str_A():
+  ''' UTC timestamps, "%Y-%m-%d %H:%M:%S": aware datetimes are converted to UTC, naive ones are taken as UTC '''
+  assert io.timestamp_str( datetime(2026, 1, 1, 12) ) == '2026-01-01 12:00:00'
+  assert io.timestamp_str( datetime(2026, 1, 1, 12, tzinfo=timezone(timedelta(hours=2))) ) == '2026-01-01 10:00:00'
+  now = io.utc_now()
+  assert now.tzinfo is None and now.microsecond == 0
+  assert abs( now - datetime.now(timezone.utc).replace(tzinfo=None) ) < timedelta(minutes=1)
+  assert len(io.timestamp_str()) == 19
@@ -0,0 +1,59 @@
+# standard imports
+import os, sys
+import json
+import subprocess
+
+import pytest
+
+# local imports
+from mpc_orb_creation import lazy
+
+# directories...
+test_dir = os.path.dirname(os.path.realpath(__file__))
+src_dir  = os.path.join(os.path.dirname(test_dir), 'src')
+
+# modules that must *not* be imported as a side-effect of importing construct / utility_popn
+HEAVY_MODULES = ['requests', 'mpc_orb', 'designation_identifier', 'db_client', 'orbfit_to_dict', 'mpc_astro',
+                 'mpc_psql', 'psycopg2', 'count_opps', 'create_output_dictionaries2023', 'numpy']
+
+# import-time budget (seconds) for a fresh interpreter
+IMPORT_BUDGET = 0.5
+
+
+# utility functionalities
+# ---------------------
+def time_fresh_import(module_name):
+  ''' Import module_name in a fresh interpreter: return the import time & the heavy modules that got imported '''
+  code = ( "import sys, time, json\n"
+           "t0 = time.perf_counter()\n"
+           f"import {module_name}\n"
+           "dt = time.perf_counter() - t0\n"
+           f"print(json.dumps({{'dt':dt, 'heavy':[m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n" )
+  env = dict(os.environ, PYTHONPATH=src_dir + os.pathsep + os.environ.get('PYTHONPATH', ''))
+  out = subprocess.run([sys.executable, '-c', code], env=env, check=True, stdout=subprocess.PIPE)
+  return json.loads(out.stdout.decode().strip().splitlines()[-1])
+
+
+# functions to be tested
+# ------------------------
+@pytest.mark.parametrize('module_name', ['mpc_orb_creation.construct', 'mpc_orb_creation.utility_popn'])
+def test_import_budget_A(module_name):
+  ''' Importing does not pull in the heavy / internal modules, and stays within the import-time budget '''
+  result = time_fresh_import(module_name)
+  assert result['heavy'] == []
+  assert result['dt'] < IMPORT_BUDGET, f"import {module_name} took {result['dt']:.3f}s"
+
+
+def test_lazy_module_A():
+  ''' Modules are only imported on first attribute access '''
+  m = lazy.LazyModule('colorsys')
+  assert not m.is_loaded()
+  assert m.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+  assert m.is_loaded()
+
+
+def test_lazy_module_B():
+  ''' Missing modules only raise on first use '''
+  m = lazy.LazyModule('no_such_internal_mpc_module')
+  with pytest.raises(Exception, match='internal MPC'):
+    m.some_function
@@ -0,0 +1,71 @@
+# standard imports
+import os, sys
+
+import numpy as np
+
+# local imports
+from mpc_orb_creation import moid
+from mpc_orb_creation import transform
+from mpc_orb_creation import construct
+from mpc_orb_creation import template
+
+
+# utility functionalities
+# ---------------------
+def brute_force_moid(com, planet, n=1500):
+  ''' Minimum distance over a dense grid of points on both orbits '''
+  a, e, i, node, argperi = [np.atleast_1d(_) for _ in moid.planet_elements(planet)]
+  E     = np.linspace(0, 2 * np.pi, n, endpoint=False)[np.newaxis]
+  r_pl  = moid._planet_positions(a, e, transform._rotation_matrices(i, node, argperi), E)[0]
+  q, ecc = np.atleast_1d(com[0]), np.atleast_1d(com[1])
+  nu    = np.linspace(-1, 1, n)[np.newaxis] * moid._max_true_anomaly(q, ecc)[:, np.newaxis]
+  R     = transform._rotation_matrices(*[np.atleast_1d(np.radians(_)) for _ in com[2:5]])
+  r_obj = moid._object_positions(q * (1 + ecc), ecc, R, nu)[0]
+  return np.sqrt( ((r_obj[:, np.newaxis] - r_pl[np.newaxis])**2).sum(axis=-1).min() )
+
+
+# functions to be tested
+# ------------------------
+def test_compute_moids_A():
+  ''' MOIDs of a batch of random orbits agree with (and are never worse than) a brute-force search '''
+  rng = np.random.default_rng(0)
+  N   = 8
+  com = np.column_stack([ rng.uniform(0.5, 4.0, N), rng.uniform(0.0, 0.9, N), rng.uniform(0, 40, N),
+                          rng.uniform(0, 360, N), rng.uniform(0, 360, N), np.full(N, 59000.0) ])
+  com[-1, 1] = 1.3   # hyperbolic
+  moids = moid.compute_moids(com)
+  assert sorted(moids) == ['Earth', 'Jupiter', 'Mars', 'Venus']
+
+  for planet in ['Earth', 'Jupiter']:
+    assert moids[planet].shape == (N,)
+    brute = np.array([brute_force_moid(_, planet) for _ in com])
+    assert np.all( moids[planet] <= brute + 1e-8 )
+    assert np.all( moids[planet] >= brute - 2e-2 )
+
+
+def test_compute_moids_B():
+  ''' Simple geometries: an orbit identical to the Earth's & an orbit crossing the Earth's orbit at its node '''
+  a, e, i, node, argperi = moid.planet_elements('Earth')
+  earth_like = [a * (1 - e), e, np.degrees(i), np.degrees(node), np.degrees(argperi)]
+  assert moid.compute_moids([earth_like], planets=['Earth'])['Earth'][0] < 1e-8
+
+  # (Almost) coplanar orbits that cross
+  assert moid.compute_moids([[0.5, 0.6, 0.0, 0.0, 30.0]], planets=['Earth'])['Earth'][0] < 1e-5
+
+  # Coplanar, (almost) concentric orbits
+  assert abs( moid.compute_moids([[2.0, 0.0, 0.0, 0.0, 0.0]], planets=['Earth'])['Earth'][0] - (2.0 - a * (1 + e)) ) < 1e-6
+
+
+def test_populate_moid_data_A():
+  ''' Without external MOIDs, populate_moid_data computes them from the COM elements '''
+  mpcorb = template.get_template_json()
+  mpcorb['COM']['coefficient_values'] = [2.90121759134200, 0.076725613708698, 11.6729890707506, 1.9424999773844, 65.5903222864256, 57983.0073663538]
+  mpcorb['epoch_data']['epoch'] = 59600.0
+
+  construct.populate_moid_data({}, mpcorb)
+  assert all(isinstance(mpcorb['moid_data'][_], float) for _ in ['Venus', 'Earth', 'Mars', 'Jupiter'])
+  assert 1.5 < mpcorb['moid_data']['Earth'] < 2.0 and mpcorb['moid_data']['Jupiter'] > 1.5
+
+  # External MOIDs take precedence
+  construct.populate_moid_data({'Earth': 0.1}, mpcorb)
+  assert mpcorb['moid_data']['Earth'] == 0.1
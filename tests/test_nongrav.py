@@ -0,0 +1,92 @@
+# standard imports
+import os, sys
+
+import pytest
+
+# local imports
+from mpc_orb_creation import nongrav
+from mpc_orb_creation import construct
+from mpc_orb_creation import template
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+def get_eq1dict(filename):
+  ''' The CAR & COM blocks of one of the orbfit test files (numeric) '''
+  filepath, = [_ for _ in filepath_dict['test_pass_orbfit_general'] + filepath_dict['test_pass_orbfit_standard'] if os.path.basename(_) == filename]
+  d = io.load_json(filepath)
+  d = d.get('eq1dict', d)
+  return construct.to_nums( {k: d[k] for k in ['CAR','COM']} )
+
+def populate(eq1dict):
+  mpcorb = template.get_template_json()
+  construct.populate_CAR_COM(eq1dict, mpcorb)
+  return mpcorb
+
+
+# functions to be tested
+# ------------------------
+def test_lookup_A():
+  ''' Registered models resolve in one lookup; unexpected combinations raise '''
+  assert nongrav.lookup({'numparams': 6, 'nongrav_model': 0, 'nongrav_params': 0, 'nongrav_type': []}) is None
+
+  model = nongrav.lookup({'numparams': '7', 'nongrav_model': '1', 'nongrav_params': '2', 'nongrav_type': ['2']})
+  assert model.coefficient_names == ('yarkovski',) and model.value_indices == (1,) and model.uncertainty_indices == (6,)
+
+  model = nongrav.lookup({'numparams': 9, 'nongrav_model': 3, 'nongrav_params': 3, 'nongrav_type': [1, 2, 3]})
+  assert model.model_flags == ('yabushita',) and model.coefficient_names == ('A1', 'A2', 'A3')
+
+  for d in [ {'numparams': 8, 'nongrav_model': 1, 'nongrav_params': 2, 'nongrav_type': [2]},           # numparams inconsistent
+             {'numparams': 10, 'nongrav_model': 2, 'nongrav_params': 3, 'nongrav_type': [1, 2, 3, 4]},  # too many params
+             {'numparams': 7, 'nongrav_model': 0, 'nongrav_params': 0, 'nongrav_type': []} ]:
+    with pytest.raises(Exception):
+      nongrav.lookup(d)
+
+
+def test_register_nongrav_model_A():
+  ''' New models can be registered declaratively '''
+  key = (9, 1, (1,))
+  try:
+    nongrav.register_nongrav_model(9, 1, [1], ['marsden'], ['A1'])
+    assert nongrav.lookup({'numparams': 7, 'nongrav_model': 9, 'nongrav_params': 1, 'nongrav_type': [1]}).coefficient_names == ('A1',)
+  finally:
+    nongrav.NONGRAV_REGISTRY.pop(key, None)
+
+
+def test_populate_nongravs_A():
+  ''' Asteroidal non-gravs (srp & yarkovski) '''
+  eq1dict = get_eq1dict('1566fel_orig.json')
+  mpcorb  = populate(eq1dict)
+
+  assert mpcorb['non_grav_booleans']['non_gravs']
+  assert mpcorb['non_grav_booleans']['non_grav_model'] == {'marsden': False, 'srp': True, 'yabushita': False, 'yarkovski': True, 'yc': False}
+  for coordtype in ['CAR','COM']:
+    assert mpcorb[coordtype]['coefficient_names'][6:] == ['srp', 'yarkovski']
+    assert mpcorb[coordtype]['coefficient_values'][6:] == eq1dict[coordtype]['nongrav_vals']
+    assert mpcorb[coordtype]['coefficient_uncertainties'] == eq1dict[coordtype]['rms']
+
+
+def test_populate_nongravs_B():
+  ''' Cometary non-gravs (which used to fail with a TypeError) '''
+  eq1dict = get_eq1dict('K05SG8D.json')
+  for coordtype in ['CAR','COM']:
+    eq1dict[coordtype].update( {'numparams': 8, 'nongrav_model': 2, 'nongrav_params': 4, 'nongrav_type': [1, 2],
+                                'nongrav_vals': [1.0e-8, -2.0e-9, 0.0, 0.0]} )
+    eq1dict[coordtype]['rms'] = eq1dict[coordtype]['rms'] + [1.0e-10, 2.0e-10]
+  mpcorb = populate(eq1dict)
+
+  assert mpcorb['non_grav_booleans']['non_grav_model']['yc']
+  assert mpcorb['non_grav_booleans']['non_grav_coefficients'] == {'A1': True, 'A2': True, 'A3': False, 'DT': False, 'srp': False, 'yarkovski': False}
+  assert mpcorb['COM']['coefficient_names'] == ['q','e','i','node','argperi','peri_time','A1','A2']
+  assert mpcorb['COM']['coefficient_values'][6:] == [1.0e-8, -2.0e-9]
+  assert mpcorb['COM']['coefficient_uncertainties'][6:] == [1.0e-10, 2.0e-10]
+
+
+def test_populate_nongravs_C():
+  ''' No non-gravs: the template defaults are left alone '''
+  mpcorb = populate( get_eq1dict('K05SG8D.json') )
+  assert not mpcorb['non_grav_booleans']['non_gravs']
+  assert mpcorb['non_grav_booleans'] == template.get_template_json()['non_grav_booleans']
+  assert len(mpcorb['CAR']['coefficient_names']) == 6
@@ -0,0 +1,119 @@
+# standard imports
+import os, sys
+import copy
+
+import numpy as np
+
+# local imports
+from mpc_orb_creation import orbit_class
+from mpc_orb_creation import construct
+from mpc_orb_creation import template
+
+
+# utility functionalities
+# ---------------------
+def com_from_a(a, e, incl):
+  ''' q, e, i from a, e, i '''
+  return [a * (1 - e), e, incl]
+
+# (approximate) elements of some well-known objects & their expected MPC orbit types
+KNOWN_OBJECTS = [
+  ( com_from_a(0.741, 0.322, 25.6),  'Atira'                    ),   # (163693) Atira
+  ( com_from_a(0.922, 0.191, 3.3),   'Aten'                     ),   # (99942) Apophis
+  ( com_from_a(1.126, 0.204, 6.0),   'Apollo'                   ),   # (101955) Bennu
+  ( com_from_a(1.458, 0.223, 10.8),  'Amor'                     ),   # (433) Eros
+  ( com_from_a(2.14,  0.30,  5.0),   'Object with q < 1.665 AU' ),
+  ( com_from_a(1.944, 0.074, 22.5),  'Hungaria'                 ),   # (434) Hungaria
+  ( com_from_a(2.40,  0.25,  21.6),  'Phocaea'                  ),   # (25) Phocaea
+  ( com_from_a(2.77,  0.079, 10.6),  'MBA'                      ),   # (1) Ceres
+  ( com_from_a(3.97,  0.14,  7.8),   'Hilda'                    ),   # (153) Hilda
+  ( com_from_a(5.26,  0.024, 18.2),  'Jupiter Trojan'           ),   # (624) Hektor
+  ( com_from_a(13.7,  0.38,  6.9),   'Centaur'                  ),   # (2060) Chiron
+  ( com_from_a(30.3,  0.03,  1.3),   'Other Resonant TNO'       ),   # 2001 QR322 (Neptune Trojan)
+  ( com_from_a(39.5,  0.25,  17.1),  'Plutino'                  ),   # (134340) Pluto
+  ( com_from_a(44.6,  0.04,  2.4),   'Cubewano'                 ),   # (486958) Arrokoth
+  ( com_from_a(67.8,  0.44,  44.0),  'Scattered Disk'           ),   # (136199) Eris
+  ( [0.255, 1.20, 122.7],            'Hyperbolic'               ),   # 1I/'Oumuamua
+  ( [0.9,   1.0,  45.0],             'Parabolic'                ),
+  ( com_from_a(4.5,   0.1,   5.0),   'Other'                    ),   # <<-- no class: between the Hildas & the Trojans
+  ( com_from_a(1.9,   0.05,  5.0),   'Other'                    ),   # <<-- no class: a < 2 au, q > 1.665 au, not a Hungaria
+]
+
+def loop_classify(com, rules):
+  ''' Straightforward (one object & one rule at a time) first-match classification '''
+  q, e, incl = com[:3]
+  a = q / (1 - e) if e < 1 else np.inf
+  values = {'q': q, 'e': e, 'i': incl, 'a': a, 'Q': a * (1 + e) if e < 1 else np.inf}
+  for rule in rules:
+    if all( lo <= values[k] and (values[k] < hi or hi == np.inf) for k, (lo, hi) in rule[2].items() ):
+      return rule[0]
+  return orbit_class.UNCLASSIFIED[0]
+
+
+# functions to be tested
+# ------------------------
+def test_classify_A():
+  ''' Well-known objects are assigned the expected MPC orbit types '''
+  classes = orbit_class.classify( [_[0] for _ in KNOWN_OBJECTS] )
+  assert classes['orbit_type_str'].tolist() == [_[1] for _ in KNOWN_OBJECTS]
+  assert classes['orbit_type_int'][:4].tolist() == [0, 1, 2, 3] and classes['orbit_type_int'][7] == 11
+  assert classes['orbit_type_int'][-2:].tolist() == [22, 22] and orbit_class.UNCLASSIFIED == (22, 'Other')
+
+
+def test_classify_B():
+  ''' The vectorised first-match evaluation agrees with a per-object loop '''
+  rng = np.random.default_rng(41)
+  N   = 5000
+  com = np.stack([ 10**rng.uniform(-0.5, 2.0, N), rng.uniform(0.0, 1.1, N), rng.uniform(0.0, 60.0, N) ], axis=1)
+  classes = orbit_class.classify(com)
+  assert classes['orbit_type_int'].shape == (N,)
+  assert classes['orbit_type_int'].tolist() == [ loop_classify(_, orbit_class.ORBIT_CLASS_RULES) for _ in com ]
+
+
+def test_classify_C():
+  ''' Custom rule tables: moved boundaries, objects that match no rule (catch-all type) & unknown quantities '''
+  rules = copy.deepcopy(orbit_class.ORBIT_CLASS_RULES)
+  for n, rule in enumerate(rules):
+    if rule[0] == 9:
+      rules[n] = rule[:2] + ({'q': (1.3, 1.8)},)
+  com = [com_from_a(2.14, 0.15, 5.0)]                       # <<-- q = 1.82
+  assert orbit_class.classify(com)['orbit_type_str'][0] == 'MBA'
+  assert orbit_class.classify(com, rules=rules)['orbit_type_str'][0] == 'MBA'
+  assert orbit_class.classify([com_from_a(2.0, 0.15, 5.0)], rules=orbit_class.compile_rules(rules))['orbit_type_int'][0] == 9
+
+  assert orbit_class.classify(com, rules=[])['orbit_type_int'][0] == orbit_class.UNCLASSIFIED[0]
+  assert orbit_class.classes_for_object(orbit_class.classify(com, rules=[]), 0) == \
+         {'orbit_type_int': 22, 'orbit_type_str': 'Other', 'orbit_subtype_int': None, 'orbit_subtype_str': ''}
+  try:
+    orbit_class.compile_rules([(1, 'X', {'H': (0, 20)})])
+    raise AssertionError('expected an exception')
+  except Exception as e:
+    assert 'Unknown quantity' in str(e)
+
+
+def test_populate_categorization_A():
+  ''' Populates the (MPC) orbit type from the COM elements (unpopulated COM is skipped; no subtypes) '''
+  mpcorb = template.get_template_json()
+  construct.populate_categorization({}, mpcorb)
+  assert mpcorb['categorization']['orbit_type_int'] is None
+
+  mpcorb['COM']['coefficient_values'] = [2.90121759134200, 0.076725613708698, 11.6729890707506, 1.94249997, 65.5903222, 57983.00736]
+  mpcorb['categorization']['orbit_subtype_str'] = 'X'
+  construct.populate_categorization({}, mpcorb)
+  assert mpcorb['categorization']['orbit_type_int'] == 11 and mpcorb['categorization']['orbit_type_str'] == 'MBA'
+  assert mpcorb['categorization']['orbit_subtype_int'] is None and mpcorb['categorization']['orbit_subtype_str'] == ''
+
+
+def test_reclassify_catalogue_A():
+  ''' Catalogue-wide reclassification (the input documents are not modified) '''
+  docs = []
+  for com, _ in KNOWN_OBJECTS:
+    doc = template.get_template_json()
+    doc['COM']['coefficient_values']        = list(com) + [0.0, 0.0, 0.0]
+    doc['COM']['coefficient_uncertainties'] = [1e-6] * 6
+    docs.append(doc)
+
+  reclassified = orbit_class.reclassify_catalogue(docs)
+  assert [_['categorization']['orbit_type_str'] for _ in reclassified] == [_[1] for _ in KNOWN_OBJECTS]
+  assert all( _['categorization']['orbit_type_int'] is None for _ in docs )
+  assert orbit_class.reclassify_catalogue([]) == []
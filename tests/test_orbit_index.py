@@ -0,0 +1,100 @@
+# standard imports
+import os, sys
+
+import numpy as np
+import pytest
+
+# local imports
+from mpc_orb_creation import orbit_index
+from mpc_orb_creation import template
+
+
+# utility functionalities
+# ---------------------
+def random_com(N, seed=0):
+  ''' (N,6) cometary elements of main-belt-like orbits '''
+  rng = np.random.default_rng(seed)
+  return np.stack( [rng.uniform(1.8, 3.5, N), rng.uniform(0.0, 0.3, N), rng.uniform(0.0, 30.0, N),
+                    rng.uniform(0.0, 360.0, N), rng.uniform(0.0, 360.0, N), rng.uniform(59000.0, 60000.0, N)], axis=1 )
+
+def brute_force(com, catalogue_com, metric='D_SH'):
+  ''' (M,N) D-criteria by a linear scan '''
+  return np.array([ orbit_index.d_criterion(np.broadcast_to(_, catalogue_com.shape), catalogue_com, metric) for _ in com ])
+
+
+# functions to be tested
+# ------------------------
+def test_d_criterion_A():
+  ''' D_SH: zero for identical orbits, symmetric, invariant to the wrapping of the angles & correct for coplanar orbits '''
+  com = random_com(200)
+  other = random_com(200, seed=1)
+  assert np.allclose( orbit_index.d_criterion(com, com), 0.0, atol=1e-7 )
+  for metric in orbit_index.D_CRITERIA:
+    assert np.allclose( orbit_index.d_criterion(com, other, metric), orbit_index.d_criterion(other, com, metric) )
+
+  wrapped = other + [0, 0, 0, 360.0, -360.0, 0]
+  assert np.allclose( orbit_index.d_criterion(com, wrapped), orbit_index.d_criterion(com, other) )
+
+  # Coplanar (i = 0): I = 0 & PI is the difference of the longitudes of perihelion
+  a = np.array([[2.0, 0.1, 0.0,  40.0, 100.0, 0.0]])
+  b = np.array([[2.1, 0.2, 0.0, 350.0, 200.0, 0.0]])
+  expected = np.sqrt( 0.1**2 + 0.1**2 + (0.15 * 2 * np.sin(np.radians(410.0) / 2))**2 )
+  assert np.isclose( orbit_index.d_criterion(a, b)[0], expected )
+  assert np.isclose( orbit_index.d_criterion(a, b, 'D_H')[0], np.sqrt(expected**2 - 0.1**2 + (0.1 / 4.1)**2) )
+
+  # The embedding is a lower bound
+  d_embedded = np.linalg.norm( orbit_index.embed(com) - orbit_index.embed(other), axis=1 )
+  assert np.all( d_embedded <= orbit_index.d_criterion(com, other) + 1e-12 )
+
+  with pytest.raises(Exception):
+    orbit_index.d_criterion(com, other, 'D_X')
+
+
+def test_query_radius_A():
+  ''' Radius queries (scalar & per-query radii, both D-criteria) reproduce a linear scan '''
+  catalogue_com, com = random_com(3000), random_com(50, seed=2)
+  for metric in orbit_index.D_CRITERIA:
+    index = orbit_index.OrbitIndex(catalogue_com, metric=metric, leaf_size=16)
+    D = brute_force(com, catalogue_com, metric)
+    for r in [0.15, np.linspace(0.05, 0.3, 50)]:
+      pairs = index.query_radius(com, r)
+      expected_q, expected_p = np.nonzero( D <= np.broadcast_to(r, (50,))[:, np.newaxis] )
+      assert pairs['query'].size == expected_q.size > 0
+      assert set(zip(pairs['query'], pairs['index'])) == set(zip(expected_q, expected_p))
+      assert np.allclose( pairs['distance'], D[pairs['query'], pairs['index']] )
+      assert np.all( np.diff(pairs['query']) >= 0 )
+
+
+def test_query_A():
+  ''' k-nearest queries reproduce a linear scan (incl. k > N) '''
+  catalogue_com, com = random_com(2000), random_com(40, seed=3)
+  index = orbit_index.OrbitIndex(catalogue_com)
+  distance, idx = index.query(com, k=5)
+  D = brute_force(com, catalogue_com)
+  assert np.allclose( distance, np.sort(D, axis=1)[:, :5] )
+  assert np.allclose( D[np.arange(40)[:, np.newaxis], idx], distance )
+
+  small = orbit_index.OrbitIndex(catalogue_com[:3])
+  distance, idx = small.query(com[:2], k=5)
+  assert np.all( idx[:, 3:] == -1 ) and np.all( np.isinf(distance[:, 3:]) )
+  assert np.allclose( distance[:, :3], np.sort(D[:2, :3], axis=1) )
+
+
+def test_self_join_A():
+  ''' Bulk self-join finds the (perturbed) duplicates in a catalogue snapshot '''
+  com  = random_com(500)
+  dups = com[:20] + np.random.default_rng(4).normal(scale=[1e-4, 1e-5, 1e-3, 1e-3, 1e-3, 1.0], size=(20, 6))
+  docs = []
+  for n, elements in enumerate(np.concatenate([com, dups])):
+    doc = template.get_template_json()
+    doc['designation_data']['unpacked_primary_provisional_designation'] = f'2020 A{n}'
+    doc['COM']['coefficient_values'] = elements.tolist()
+    doc['COM']['coefficient_uncertainties'] = [0.0] * 6
+    docs.append(doc)
+
+  index = orbit_index.OrbitIndex.from_catalogue(docs)
+  assert len(index) == 520
+  pairs = index.self_join(0.005)
+  assert sorted(zip(pairs['i'], pairs['j'])) == [(n, 500 + n) for n in range(20)]
+  assert np.all( np.diff(pairs['distance']) >= 0 )
+  assert pairs['designation_j'][pairs['i'] == 3][0] == '2020 A503'
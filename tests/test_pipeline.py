@@ -0,0 +1,156 @@
+# standard imports
+import os, sys
+import asyncio
+import concurrent.futures
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+# local imports
+from mpc_orb_creation import backends
+from mpc_orb_creation import pipeline
+from mpc_orb_creation import deadletter
+from mpc_orb_creation import utility_popn
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+DESIGS = [f'2005SD{n}' for n in range(100, 112)]
+
+def make_sqlite_backend(db_path):
+  ''' SQLite orbfit_results table with copies of the sample orbfit output under a number of designations '''
+  backend = backends.SQLiteOrbfitResultsBackend(db_path)
+  d = io.load_json(filepath_dict['test_pass_orbfit_standard'][0])
+  for unpacked in DESIGS:
+    backend.add_orbfit_result( unpacked, unpacked, d['rwodict'], d['eq0dict'], d['eq1dict'],
+                               ele220 = ' '*140 + '   1', updated_at = datetime(2023, 3, 5, 12, 0, 0) )
+  return backend
+
+def fake_construct(eq0dict, eq1dict, rwodict, moidsdict, otherdict, VERBOSE=True, designation_backend=None, dead_letter=None, unpacked=None, clock=None):
+  ''' Stand-in for construct.construct (which needs the internal MPC modules) '''
+  if rwodict['optical_list'][0]['name'] == 'FAIL':
+    if dead_letter is not None:
+      dead_letter.record(unpacked, 'populate', ValueError('bad input'), inputs=[eq0dict, eq1dict])
+    return {}
+  return {'epoch': eq1dict['CAR']['epoch'], 'nopp': otherdict['nopp'], 'pid': os.getpid()}
+
+
+# functions to be tested
+# ------------------------
+def test_pipeline_A(tmp_path):
+  ''' All designations are fetched, constructed in worker processes & written back '''
+  backend = make_sqlite_backend(str(tmp_path / 'orbfit_results.db'))
+
+  stats = pipeline.populate_orbfit_results( backend=backend, construct_func=fake_construct, n_workers=2, queue_size=2 )
+  assert stats == {'fetched': len(DESIGS), 'constructed': len(DESIGS), 'written': len(DESIGS), 'skipped': 0, 'failed': 0}
+
+  for unpacked in DESIGS:
+    result = backend.query_desig(unpacked=unpacked)['mpc_orb_jsonb']
+    assert result['epoch'] == '59600.000000000'
+    assert result['nopp'] == 1
+    assert result['pid'] != os.getpid()
+
+
+def test_pipeline_B(tmp_path):
+  ''' Failed constructions are counted and not written; explicit designation lists & executors are respected '''
+  backend = make_sqlite_backend(str(tmp_path / 'orbfit_results.db'))
+  d = io.load_json(filepath_dict['test_pass_orbfit_standard'][0])
+  d['rwodict']['optical_list'][0]['name'] = 'FAIL'
+  backend.add_orbfit_result( 'FAIL', 'FAIL', d['rwodict'], d['eq0dict'], d['eq1dict'], ele220 = ' '*140 + '   1')
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+    stats = asyncio.run( pipeline.run_pipeline( backend, designations=DESIGS[:3] + ['FAIL', 'UNKNOWN'],
+                                                executor=executor, n_workers=2, construct_func=fake_construct ) )
+  assert stats == {'fetched': 4, 'constructed': 3, 'written': 3, 'skipped': 0, 'failed': 1}
+  assert backend.query_desig(unpacked='FAIL')['mpc_orb_jsonb'] is None
+  assert backend.query_desig(unpacked=DESIGS[3])['mpc_orb_jsonb'] is None
+
+
+def test_pipeline_dead_letter_A(tmp_path):
+  ''' Failures are recorded in the dead-letter queue, and a retry only reprocesses those '''
+  backend = make_sqlite_backend(str(tmp_path / 'orbfit_results.db'))
+  d = io.load_json(filepath_dict['test_pass_orbfit_standard'][0])
+  d['rwodict']['optical_list'][0]['name'] = 'FAIL'
+  backend.add_orbfit_result( 'FAIL', 'FAIL', d['rwodict'], d['eq0dict'], d['eq1dict'], ele220 = ' '*140 + '   1')
+  dlq = deadletter.DeadLetterQueue(str(tmp_path / 'dead_letters.db'))
+
+  stats = pipeline.populate_orbfit_results( backend=backend, construct_func=fake_construct, n_workers=2, dead_letter=dlq )
+  assert stats['written'] == len(DESIGS) and stats['failed'] == 1
+  entry, = dlq.entries()
+  assert entry['unpacked'] == 'FAIL' and entry['stage'] == 'populate' and entry['exception_type'] == 'ValueError'
+  row = backend.query_desig(unpacked='FAIL')
+  assert entry['input_hash'] == deadletter.input_hash( deadletter.orbfit_inputs(row['rwo_json'], row['mid_epoch_json'], row['standard_epoch_json'],
+                                                                                row['updated_at'], row['ele220']) )
+
+  # A retry with unchanged inputs does nothing (unless forced) ...
+  stats = pipeline.populate_orbfit_results( backend=backend, construct_func=fake_construct, n_workers=2, dead_letter=dlq, retry_failed=True )
+  assert stats['fetched'] == 0 and dlq.designations() == ['FAIL']
+  stats = pipeline.populate_orbfit_results( backend=backend, construct_func=fake_construct, n_workers=2, dead_letter=dlq, retry_failed=True, retry_unchanged=True )
+  assert stats['fetched'] == 1 and stats['failed'] == 1 and dlq.entries()[0]['n_failures'] == 2
+
+  # ... designations without any data are cleared from the queue ...
+  dlq.record('UNKNOWN', 'fetch', ValueError('no data'))
+  pipeline.populate_orbfit_results( backend=backend, construct_func=fake_construct, n_workers=2, dead_letter=dlq, retry_failed=True )
+  assert dlq.designations() == ['FAIL']
+
+  # ... & once the input is fixed, only the failures are retried
+  d['rwodict']['optical_list'][0]['name'] = '2005SD168'
+  backend.add_orbfit_result( 'FAIL', 'FAIL', d['rwodict'], d['eq0dict'], d['eq1dict'], ele220 = ' '*140 + '   1')
+  stats = pipeline.populate_orbfit_results( backend=backend, construct_func=fake_construct, n_workers=2, dead_letter=dlq, retry_failed=True )
+  assert stats == {'fetched': 1, 'constructed': 1, 'written': 1, 'skipped': 0, 'failed': 0}
+  assert len(dlq) == 0
+
+
+def test_pipeline_otherdict_A(tmp_path, monkeypatch):
+  ''' Without an ele220, the oppositions are counted by the workers (not the event loop), using private temporary files '''
+  backend = make_sqlite_backend(str(tmp_path / 'orbfit_results.db'))
+  d = io.load_json(filepath_dict['test_pass_orbfit_standard'][0])
+  for unpacked in ['NOELE1', 'NOELE2', 'NOELE3']:
+    backend.add_orbfit_result( unpacked, unpacked, d['rwodict'], d['eq0dict'], d['eq1dict'], ele220 = None )
+
+  calls = []
+  def fake_count_opps(rwofile=None, elsfile=None):
+    assert os.path.exists(rwofile) and os.path.exists(elsfile) and os.path.dirname(rwofile) != os.getcwd()
+    calls.append( (rwofile, threading.current_thread().name) )
+    return 7
+  def write_file(d, fp):
+    with open(fp, 'w') as fh:
+      fh.write('x')
+  monkeypatch.setattr(utility_popn, 'count_opps', SimpleNamespace(count_opps=fake_count_opps))
+  monkeypatch.setattr(utility_popn, 'orbfit_to_dict', SimpleNamespace(dict_to_rwo=write_file, dict_to_fel=write_file))
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='construct') as executor:
+    stats = asyncio.run( pipeline.run_pipeline( backend, designations=['NOELE1', 'NOELE2', 'NOELE3'], executor=executor,
+                                                n_workers=2, construct_func=fake_construct ) )
+  assert stats['written'] == 3
+  assert all( backend.query_desig(unpacked=_)['mpc_orb_jsonb']['nopp'] == 7 for _ in ['NOELE1', 'NOELE2', 'NOELE3'] )
+  assert len({fp for fp, _ in calls}) == 3 and not any( os.path.exists(fp) for fp, _ in calls )
+  assert all( name.startswith('construct') for _, name in calls )
+
+
+def test_pipeline_skip_unchanged_A(tmp_path):
+  ''' Re-running over unchanged inputs does not re-write the (semantically identical) documents '''
+  backend = make_sqlite_backend(str(tmp_path / 'orbfit_results.db'))
+  with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+    kwargs = dict(backend=backend, construct_func=fake_construct, executor=executor, n_workers=2)
+    assert pipeline.populate_orbfit_results(**kwargs)['written'] == len(DESIGS)
+    stats = pipeline.populate_orbfit_results(**kwargs)
+  assert stats['written'] == 0 and stats['skipped'] == len(DESIGS)
+
+
+def test_pipeline_shared_memory_A(tmp_path):
+  ''' The constructed dicts can be returned from the worker processes through shared memory '''
+  backend = make_sqlite_backend(str(tmp_path / 'orbfit_results.db'))
+  stats = pipeline.populate_orbfit_results( backend=backend, construct_func=fake_construct, n_workers=2, shared_memory=True, buffer_size=2**12 )
+  assert stats == {'fetched': len(DESIGS), 'constructed': len(DESIGS), 'written': len(DESIGS), 'skipped': 0, 'failed': 0}
+  for unpacked in DESIGS:
+    result = backend.query_desig(unpacked=unpacked)['mpc_orb_jsonb']
+    assert result['epoch'] == '59600.000000000' and result['pid'] != os.getpid()
+
+  with pytest.raises(Exception):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+      pipeline.populate_orbfit_results( backend=backend, construct_func=fake_construct, executor=executor, shared_memory=True )
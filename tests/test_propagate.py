@@ -0,0 +1,123 @@
+# standard imports
+import os, sys
+
+import numpy as np
+import pytest
+
+# local imports
+from mpc_orb_creation import propagate
+from mpc_orb_creation import transform
+from mpc_orb_creation import covariance
+from mpc_orb_creation import construct
+from mpc_orb_creation import template
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+def get_block(coordtype):
+  ''' Elements, epoch & covariance of a block of the sample orbfit output '''
+  d = construct.to_nums( io.load_json(filepath_dict['test_pass_orbfit_standard'][0])['eq1dict'][coordtype] )
+  return np.array([[d['element%d' % _] for _ in range(6)]]), d['epoch'], covariance.PackedCovariance.from_dict(d, d['numparams']).to_array()[np.newaxis]
+
+# A mix of elliptic, near-parabolic & hyperbolic orbits
+COM = np.array([
+  [2.5,  0.1,    10.0,  80.0, 150.0, 59500.0],
+  [0.9,  0.95,   45.0, 300.0,  10.0, 59590.0],
+  [3.0,  1.5,     5.0, 200.0,  90.0, 59550.0],
+  [40.0, 0.2,     2.0,  30.0, 330.0, 40000.0],
+  [1.1,  1.0002, 80.0, 120.0,  45.0, 59610.0],
+])
+
+def integrals(car, mu=transform.GM_SUN):
+  ''' Energy & angular momentum of (N,6) states '''
+  r, v = car[:, :3], car[:, 3:]
+  return 0.5 * np.sum(v**2, axis=1) - mu / np.linalg.norm(r, axis=1), np.cross(r, v)
+
+
+# functions to be tested
+# ------------------------
+def test_propagate_A():
+  ''' CAR propagation: consistent with the COM elements, conserves the two-body integrals & is reversible '''
+  epoch  = np.array([59600.0, 59650.0, 59500.0, 59000.0, 59620.0])
+  car    = transform.com_to_car(COM, epoch)
+  target = 60000.0
+
+  propagated = propagate.propagate(car, epoch, target, coordtype='CAR')
+  assert propagated.shape == (5, 6)
+  assert np.allclose( propagated, transform.com_to_car(COM, target), rtol=1e-9, atol=1e-10 )
+
+  energy, h = integrals(car)
+  new_energy, new_h = integrals(propagated)
+  assert np.allclose( new_energy, energy, rtol=1e-9 ) and np.allclose( new_h, h, rtol=1e-9, atol=1e-14 )
+
+  # Back again
+  assert np.allclose( propagate.propagate(propagated, target, epoch, coordtype='CAR'), car, rtol=1e-8, atol=1e-10 )
+
+  with pytest.raises(Exception):
+    propagate.propagate(car, epoch, target, coordtype='KEP')
+
+
+def test_propagate_B():
+  ''' COM propagation only moves the (elliptic) peri_time by whole periods, to the passage preceding the target epoch '''
+  target     = 61000.0
+  propagated = propagate.propagate(COM, 59600.0, target, coordtype='COM')
+  assert np.array_equal( propagated[:, :5], COM[:, :5] )
+  assert np.array_equal( propagated[[2, 4], 5], COM[[2, 4], 5] )               # <<-- unbound: unchanged
+
+  period = 2 * np.pi * np.sqrt( (COM[[0, 1, 3], 0] / (1 - COM[[0, 1, 3], 1]))**3 / transform.GM_SUN )
+  k      = (propagated[[0, 1, 3], 5] - COM[[0, 1, 3], 5]) / period
+  assert np.allclose( k, np.round(k) ) and np.all( k >= 0 )
+  assert np.all( (propagated[[0, 1, 3], 5] <= target) & (propagated[[0, 1, 3], 5] > target - period) )
+
+  # The same as propagating the CAR state & converting at the target epoch
+  assert np.allclose( propagated, transform.car_to_com(transform.com_to_car(COM, target), target), rtol=1e-9, atol=1e-6 )
+
+
+def test_propagate_C():
+  ''' Covariances: CAR & COM propagation agree (via the COM -> CAR transformation) & non-gravs are carried across '''
+  car, epoch, car_cov = get_block('CAR')
+  com, _, com_cov     = get_block('COM')
+  target = epoch + 3000.0
+
+  # Zero propagation leaves the covariance unchanged
+  _, same_cov = propagate.propagate(car, epoch, epoch, coordtype='CAR', covariance_stack=car_cov)
+  assert np.allclose( same_cov, car_cov, rtol=1e-5, atol=0 )
+
+  new_car, new_car_cov = propagate.propagate(car, epoch, target, coordtype='CAR', covariance_stack=car_cov)
+  new_com, new_com_cov = propagate.propagate(com, epoch, target, coordtype='COM', covariance_stack=com_cov)
+  _, expected = transform.transform(new_com, target, new_com_cov, 'COM', 'CAR')
+  assert np.allclose( np.sqrt(np.diagonal(new_car_cov[0])), np.sqrt(np.diagonal(expected[0])), rtol=1e-3 )
+
+  # The position uncertainty grows along-track
+  assert np.linalg.det(new_car_cov[0, :3, :3]) > 0
+  assert np.trace(new_car_cov[0, :3, :3]) > np.trace(car_cov[0, :3, :3])
+
+  # A non-grav parameter is carried across unchanged
+  elements7, cov7 = np.append(car, [[1.0e-12]], axis=1), np.zeros((1, 7, 7))
+  cov7[0, :6, :6], cov7[0, 6, 6] = car_cov[0], 4.0e-26
+  new7, new_cov7 = propagate.propagate(elements7, epoch, target, coordtype='CAR', covariance_stack=cov7)
+  assert new7[0, 6] == 1.0e-12 and new_cov7[0, 6, 6] == 4.0e-26
+  assert np.allclose( new7[:, :6], new_car )
+
+
+def test_propagate_catalogue_A():
+  ''' A catalogue snapshot (with different epochs) is propagated to a common (default: median) epoch '''
+  com, epoch, com_cov = get_block('COM')
+  docs = []
+  for n, shift in enumerate([-400.0, 0.0, 900.0]):
+    doc = template.get_template_json()
+    doc['epoch_data']['epoch'] = epoch + shift
+    doc['CAR']['coefficient_values'] = transform.com_to_car(com, epoch + shift)[0].tolist()
+    doc['CAR']['coefficient_uncertainties'] = [0.0] * 6
+    doc['CAR']['covariance'].update( covariance.PackedCovariance.from_array(np.eye(6) * 1e-12).to_dict() )
+    docs.append(doc)
+
+  out = propagate.propagate_catalogue(docs)
+  assert np.array_equal( out['epoch'], [epoch] * 3 ) and 'covariance' not in out
+  assert np.allclose( out['elements'], transform.com_to_car(com, epoch), rtol=1e-9, atol=1e-10 )
+
+  out = propagate.propagate_catalogue(docs, target_epoch=epoch + 100.0, include_covariance=True)
+  assert out['covariance'].shape == (3, 6, 6)
+  assert np.allclose( out['elements'], transform.com_to_car(com, epoch + 100.0), rtol=1e-9, atol=1e-10 )
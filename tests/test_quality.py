@@ -0,0 +1,189 @@
+# standard imports
+import os, sys
+import copy
+
+import numpy as np
+
+# local imports
+from mpc_orb_creation import quality
+from mpc_orb_creation import catalogue
+from mpc_orb_creation import covariance
+from mpc_orb_creation import backends
+from mpc_orb_creation import construct
+from mpc_orb_creation import template
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+def make_doc(elements, rms):
+  ''' mpc_orb-like dict (from the template) with the supplied CAR elements & uncertainties '''
+  doc = template.get_template_json()
+  doc['CAR']['coefficient_values']        = list(elements)
+  doc['CAR']['coefficient_uncertainties'] = list(rms)
+  return doc
+
+
+def loop_runoff(com, com_cov):
+  ''' Straightforward (one object at a time) version of the MPC runoff formula, with a numerical dP '''
+  q, e = com[0], com[1]
+  period_days = lambda q, e: 360.0 / quality.K0_DEG_PER_DAY * (q / (1 - e))**1.5
+  h = 1e-7
+  J = np.array([ (period_days(q + h, e) - period_days(q - h, e)) / (2 * h), (period_days(q, e + h) - period_days(q, e - h)) / (2 * h) ])
+  dP, dT, P = np.sqrt(J @ com_cov[:2, :2] @ J), np.sqrt(com_cov[5, 5]), (q / (1 - e))**1.5
+  return (dT * e + 10 * dP / P) * 3600 * 3 * quality.K0_DEG_PER_DAY / P
+
+def tp_only_covariance(dT):
+  ''' COM covariance with only a (tp) uncertainty '''
+  cov = np.zeros((6, 6))
+  cov[5, 5] = dT**2
+  return cov
+
+
+# functions to be tested
+# ------------------------
+def test_orbit_quality_metrics_A():
+  ''' Per-object metrics match the (one-object-at-a-time) definitions '''
+  elements = np.array([[3.0, -0.8, -0.2, 1.8e-3, 9.5e-3, 1.9e-3],
+                       [3.0, -0.8, -0.2, 1.8e-3, 9.5e-3, 1.9e-3],
+                       [3.0, -0.8, -0.2, 1.8e-3, 9.5e-3, 1.9e-3]])
+  rms      = np.array([[1e-6]*6,
+                       [1e-6]*5 + [1e-3],
+                       [1e-6]*5 + [1e-2]])
+  metrics = quality.orbit_quality_metrics(elements, rms)
+
+  assert np.allclose( metrics['sig_to_noise_ratio'], np.abs(elements) / rms )
+  assert metrics['snr_below_3'].tolist() == [False, True, True]
+  assert metrics['snr_below_1'].tolist() == [False, False, True]
+  assert metrics['orbit_quality'].tolist() == ['good', 'poor', 'unreliable']
+
+  # Changing the thresholds changes the grades, but not the (fixed) snr_below_N flags
+  metrics = quality.orbit_quality_metrics(elements, rms, thresholds={'poor': 1e4})
+  assert metrics['orbit_quality'].tolist() == ['poor', 'poor', 'unreliable']
+  assert metrics['snr_below_3'].tolist() == [False, True, True]
+
+
+def test_orbit_quality_metrics_B():
+  ''' The construct routine populates the metrics for the sample orbfit output '''
+  eq0dict = construct.to_nums( io.load_json(filepath_dict['test_pass_orbfit_standard'][0])['eq0dict'] )
+  mpcorb  = template.get_template_json()
+  construct.compute_and_populate_orbit_quality_metrics(eq0dict, mpcorb)
+
+  stats = mpcorb['orbit_fit_statistics']
+  assert np.allclose( stats['sig_to_noise_ratio'], [abs(eq0dict['CAR']['element%d' % _]) / eq0dict['CAR']['rms'][_] for _ in range(6)] )
+  assert isinstance(stats['sig_to_noise_ratio'][0], float) and isinstance(stats['snr_below_3'], bool)
+  assert stats['orbit_quality'] == 'good'
+
+
+def test_rescore_catalogue_A():
+  ''' A catalogue snapshot stored in a backend can be re-graded without going back through construct '''
+  backend = backends.SQLiteOrbfitResultsBackend()
+  d = io.load_json(filepath_dict['test_pass_orbfit_standard'][0])
+  for n, rms6 in enumerate([1e-6, 1e-3, 1e-2]):
+    unpacked = f'2005SD{n}'
+    backend.add_orbfit_result(unpacked, unpacked, d['rwodict'], d['eq0dict'], d['eq1dict'], updated_at='2023-03-05 12:00:00')
+    backend.insert_mpc_orb_dict(unpacked, '2023-03-05 12:00:00', make_doc([3.0, -0.8, -0.2, 1.8e-3, 9.5e-3, 1.9e-3, 1e-14], [1e-6]*5 + [rms6, 1e-15]))
+  backend.add_orbfit_result('NO_DOC', 'NO_DOC', d['rwodict'], d['eq0dict'], d['eq1dict'])
+
+  desigs, docs = catalogue.get_snapshot(backend)
+  assert desigs == ['2005SD0', '2005SD1', '2005SD2']
+  assert catalogue.to_arrays(docs)['elements'].shape == (3, 6)
+
+  rescored = quality.rescore_catalogue(docs)
+  assert [_['orbit_fit_statistics']['orbit_quality'] for _ in rescored] == ['good', 'poor', 'unreliable']
+  assert [_['orbit_fit_statistics']['orbit_quality'] for _ in docs] == ['good', 'good', 'good']
+  assert rescored[0]['CAR'] == docs[0]['CAR']
+  assert quality.rescore_catalogue([]) == []
+
+
+def test_uncertainty_parameter_A():
+  ''' The vectorised runoff agrees with a per-object calculation, and U follows the MPC binning '''
+  rng = np.random.default_rng(42)
+  N   = 50
+  com = np.stack([ rng.uniform(1.5, 4.0, N), rng.uniform(0.0, 0.5, N), rng.uniform(0, 30, N),
+                   rng.uniform(0, 360, N), rng.uniform(0, 360, N), rng.uniform(59000, 60000, N) ], axis=1)
+  A   = rng.normal(size=(N, 6, 6)) * 1e-4
+  cov = A @ np.transpose(A, (0, 2, 1))
+  scores = quality.uncertainty_parameter(com, cov)
+  assert np.allclose( scores['runoff'], [loop_runoff(c, C) for c, C in zip(com, cov)], rtol=1e-5 )
+
+  expected_U = np.clip( np.floor( np.log(scores['runoff']) / (np.log(648000.0) / 9) ) + 1, 0, 9 )
+  assert np.array_equal( scores['U_param'], expected_U )
+
+
+def test_uncertainty_parameter_B():
+  ''' U bins: runoffs of 648000^(k/9) arcsec/decade sit at the boundaries of the bins (& unbound orbits are nan / not written) '''
+  com   = [2.0, 0.5, 10.0, 0.0, 0.0, 59000.0]                    # <<-- a = 4 au, P = 8 yr
+  scale = 3600 * 3 * quality.K0_DEG_PER_DAY * 0.5 / 8.0            # <<-- runoff = scale * dT
+  for k in range(9):
+    for factor, U in [(0.99, k), (1.01, k + 1)]:
+      dT = factor * 648000.0**(k / 9) / scale
+      assert quality.uncertainty_parameter([com], [tp_only_covariance(dT)])['U_param'][0] == max(U, 0)
+  assert quality.uncertainty_parameter([com], [tp_only_covariance(1e9)])['U_param'][0] == 9
+  assert quality.uncertainty_parameter([com], [np.zeros((6, 6))])['U_param'][0] == 0
+
+  scores = quality.uncertainty_parameter([com, [1.0, 1.2, 0, 0, 0, 59000.0]], [np.eye(6)] * 2)
+  assert np.isnan( scores['U_param'][1] )
+  assert quality.scores_for_object(scores, 1) == {}
+  assert quality.scores_for_object(scores, 0)['U_param'] == scores['U_param'][0]
+
+
+def test_scores_for_object_A():
+  ''' score1 & score2 (& any U_param) come from orbfit's quality output (undefined values are left out, never None) '''
+  scores = quality.uncertainty_parameter([[2.0, 0.5, 10.0, 0.0, 0.0, 59000.0]], [tp_only_covariance(1e-3)])
+  assert quality.scores_for_object(scores, 0, quality_dict={'std_epoch': 'ok', 'score1': None}) == {'U_param': 0.0}
+  assert quality.scores_for_object(scores, 0, quality_dict={'score1': 1.5, 'score2': 7.0}) == {'U_param': 0.0, 'score1': 1.5, 'score2': 7.0}
+  assert quality.scores_for_object(scores, 0, quality_dict={'U_param': 2})['U_param'] == 2
+  assert quality.scores_for_object(None, 0) == {}
+
+
+def test_populate_quality_scores_A():
+  ''' The construct routine populates U_param for the sample orbfit output (& the scores from the quality output, if any) '''
+  d = construct.to_nums( io.load_json(filepath_dict['test_pass_orbfit_standard'][0]) )
+  mpcorb = template.get_template_json()
+  construct.populate_quality_scores(d['eq1dict'], {}, mpcorb)
+
+  stats = mpcorb['orbit_fit_statistics']
+  assert stats['U_param'] == 0.0 and isinstance(stats['U_param'], float)
+  assert stats['score1'] == 0.0 and stats['score2'] == 0.0
+
+  construct.populate_quality_scores(d['eq1dict'], {'quality_dict': {'score1': 0.25, 'score2': 3.5}}, mpcorb)
+  assert (stats['U_param'], stats['score1'], stats['score2']) == (0.0, 0.25, 3.5)
+
+
+def test_populate_quality_scores_B():
+  ''' Without a COM covariance, or for an unbound orbit, U_param is not computed (the template's 0.0 is kept, never None) '''
+  d = construct.to_nums( io.load_json(filepath_dict['test_pass_orbfit_standard'][0]) )
+  eq1dict = copy.deepcopy(d['eq1dict'])
+  for key in covariance.cov_keys(6):
+    del eq1dict['COM'][key]
+  mpcorb = template.get_template_json()
+  construct.populate_quality_scores(eq1dict, {}, mpcorb)
+  assert mpcorb['orbit_fit_statistics']['U_param'] == 0.0
+
+  eq1dict = copy.deepcopy(d['eq1dict'])
+  eq1dict['COM']['element1'] = 1.2
+  mpcorb = template.get_template_json()
+  mpcorb['orbit_fit_statistics']['U_param'] = 4.0
+  construct.populate_quality_scores(eq1dict, {}, mpcorb)
+  assert mpcorb['orbit_fit_statistics']['U_param'] == 4.0
+
+
+def test_uncertainty_catalogue_A():
+  ''' Catalogue-wide U_param (the input documents are not modified; documents without a COM covariance keep their U_param) '''
+  docs = []
+  for dT in [1e-3, 0.1, 1e4, None]:
+    doc = template.get_template_json()
+    doc['COM']['coefficient_values'] = [2.0, 0.5, 10.0, 0.0, 0.0, 59000.0]
+    if dT is not None:
+      doc['COM']['covariance'].update( covariance.PackedCovariance.from_array(tp_only_covariance(dT)).to_dict() )
+    else:
+      doc['COM']['covariance'] = {_: None for _ in doc['COM']['covariance']}
+      doc['orbit_fit_statistics']['U_param'] = 5.0
+    docs.append(doc)
+
+  scored = quality.uncertainty_catalogue(docs)
+  assert [_['orbit_fit_statistics']['U_param'] for _ in scored] == [0.0, 3.0, 9.0, 5.0]
+  assert [_['orbit_fit_statistics']['U_param'] for _ in docs] == [0.0, 0.0, 0.0, 5.0]
+  assert quality.uncertainty_catalogue([]) == []
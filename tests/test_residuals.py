@@ -0,0 +1,147 @@
+# standard imports
+import os, sys
+import copy
+
+import numpy as np
+import pytest
+
+# local imports
+from mpc_orb_creation import residuals
+from mpc_orb_creation import construct
+from mpc_orb_creation import template
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+def get_rwodict():
+  return io.load_json(filepath_dict['test_pass_orbfit_standard'][0])['rwodict']
+
+def get_orbfit_output():
+  return io.load_json(filepath_dict['test_pass_orbfit_standard'][0])
+
+def loop_tracklet_statistics(rwodict, params):
+  ''' Straightforward (per-observation loop) version of the per-tracklet statistics in residuals.py '''
+  results = {}
+  for obs in rwodict['optical_list']:
+    if obs['T'] == 'X':
+      continue
+    chi, w = float(obs['chisq']), 2.0 / (float(obs['ra_rms'])**2 + float(obs['dec_rms'])**2)
+    bad = obs['a_select'] == '0' or chi > params['bad_obs_weight']
+    r = results.setdefault(obs['trkid'], {'n': 0, 'nbad': 0, 'wsum': 0.0, 'wbad': 0.0, 'wchi': 0.0})
+    r['n'] += 1
+    r['nbad'] += bad
+    r['wsum'] += w
+    r['wbad'] += w * bad
+    r['wchi'] += w * chi
+  return { k: (r['n'], r['nbad'], r['nbad'] / r['n'], r['wbad'] / r['wsum'], r['wchi'] / r['wsum'],
+               r['wbad'] / r['wsum'] > params['fraction_bad'] and r['wchi'] / r['wsum'] > params['bad_obs_threshhold'])
+           for k, r in results.items() }
+
+
+# functions to be tested
+# ------------------------
+def test_optical_arrays_A():
+  ''' Columns are extracted as arrays (blanks -> nan; deleted observations dropped) '''
+  rwodict = get_rwodict()
+  rwodict['optical_list'][0]['mag_resid'] = ''
+  rwodict['optical_list'][1]['T'] = 'X'
+
+  columns = residuals.optical_arrays(rwodict)
+  assert columns['ra_resid'].shape == (46,) and columns['ra_resid'].dtype == np.float64
+  assert np.isnan(columns['mag_resid'][0])
+  assert columns['a_select'].all() and columns['m_select'].sum() == 34
+  assert residuals.optical_arrays(rwodict, include_deleted=True)['trkid'].shape == (47,)
+
+  # Values that are already numbers (i.e. after construct.to_nums) are fine too
+  assert np.array_equal( residuals.optical_arrays(construct.to_nums(rwodict))['chisq'], columns['chisq'] )
+
+
+def test_tracklet_statistics_A():
+  ''' The vectorised group-by agrees with a per-observation loop '''
+  rwodict = get_rwodict()
+  for n in [0, 1, 2, 10]:
+    rwodict['optical_list'][n]['chisq'] = '6.0'
+  rwodict['optical_list'][20]['a_select'] = '0'
+  for params in [None, {'bad_obs_weight': 0.5}, {'bad_obs_weight': 0.3, 'fraction_bad': 0.2, 'bad_obs_threshhold': 0.5}]:
+    expected = loop_tracklet_statistics(rwodict, dict(residuals.BAD_TRK_PARAMS, **(params or {})))
+    stats = residuals.tracklet_statistics( residuals.optical_arrays(rwodict), bad_trk_params=params )
+    assert sorted(stats['trkid'].tolist()) == sorted(expected)
+    for i, trkid in enumerate(stats['trkid']):
+      n, nbad, fraction_bad, weighted_fraction_bad, weighted_chi, bad = expected[trkid]
+      assert stats['nobs'][i] == n and stats['nobs_bad'][i] == nbad and stats['bad'][i] == bad
+      assert np.isclose(stats['fraction_bad'][i], fraction_bad) and np.isclose(stats['weighted_fraction_bad'][i], weighted_fraction_bad)
+      assert np.isclose(stats['weighted_chi'][i], weighted_chi)
+    assert residuals.bad_tracklets( residuals.optical_arrays(rwodict), bad_trk_params=params ) == sorted(k for k in expected if expected[k][-1])
+
+
+def test_identify_bad_tracklets_A():
+  ''' With the default parameters, no tracklets of K05SG8D are bad (as per orbfit's own identification) '''
+  orbfit_output = get_orbfit_output()
+  for otherdict in [{}, {'bad_trk_dict': orbfit_output['bad_trk_dict']}, {'bad_trk_params': dict(residuals.BAD_TRK_PARAMS)}]:
+    assert construct.identify_bad_tracklets(orbfit_output['rwodict'], otherdict) == \
+           {'bad_trk': orbfit_output['stats_dict']['bad_trk'], 'bad_trk_list_ids': orbfit_output['bad_trk_dict']['bad_trk_list_ids']}
+
+
+def test_identify_bad_tracklets_B():
+  ''' A tracklet whose observations are mostly outliers is bad; the parameters are taken from the otherdict '''
+  rwodict = get_rwodict()
+  for obs in rwodict['optical_list']:
+    if obs['trkid'] == '000005QEKF':
+      obs['chisq'] = '6.0'
+  assert construct.identify_bad_tracklets(rwodict, {}) == {'bad_trk': True, 'bad_trk_list_ids': ['000005QEKF']}
+  assert construct.identify_bad_tracklets(rwodict, {'bad_trk_params': {'bad_obs_weight': 10.0}})['bad_trk'] is False
+
+  # Observations without a trkid are never a bad tracklet
+  for obs in rwodict['optical_list']:
+    if obs['trkid'] == '000005QEKF':
+      obs['trkid'] = ''
+  assert construct.identify_bad_tracklets(rwodict, {})['bad_trk'] is False
+
+
+def test_residual_statistics_A():
+  ''' The normalised RMS of the selected observations reproduces orbfit's rmsast (& the photometric RMS, rmsmag) '''
+  rwodict = get_rwodict()
+  stats = residuals.residual_statistics( residuals.optical_arrays(rwodict) )
+  assert np.isclose( stats['normalized_RMS'], float(rwodict['rmsast']), rtol=1e-4 )
+  assert np.isclose( stats['photometric_RMS'], float(rwodict['rmsmag']), rtol=1e-2 )
+  assert stats['normalized_RMS'] == stats['normalized_RMS_all']     # <<-- all observations are a_select'd
+  assert set(stats['photometric_RMS_by_band']) == {'V', 'w'}
+
+
+def test_residual_statistics_B():
+  ''' The vectorised statistics agree with a per-observation loop '''
+  rwodict = get_rwodict()
+  rwodict['optical_list'][3]['a_select'] = '0'
+  rwodict['optical_list'][5]['T'] = 'X'
+  stats = residuals.residual_statistics( residuals.optical_arrays(rwodict) )
+
+  obs  = [_ for _ in rwodict['optical_list'] if _['T'] != 'X']
+  sel  = [_ for _ in obs if _['a_select'] != '0']
+  norm = lambda o: ((float(o['ra_resid'])/float(o['ra_rms']))**2 + (float(o['dec_resid'])/float(o['dec_rms']))**2) / 2
+  raw  = lambda o: (float(o['ra_resid'])**2 + float(o['dec_resid'])**2) / 2
+  assert np.isclose( stats['normalized_RMS'],         np.sqrt(sum(map(norm, sel)) / len(sel)) )
+  assert np.isclose( stats['not_normalized_RMS'],     np.sqrt(sum(map(raw, sel)) / len(sel)) )
+  assert np.isclose( stats['not_normalized_RMS_all'], np.sqrt(sum(map(raw, obs)) / len(obs)) )
+
+  for band, rms in stats['photometric_RMS_by_band'].items():
+    mags = [float(_['mag_resid']) for _ in obs if _['mag_band'].strip() == band and _['m_select'] == '1']
+    assert np.isclose( rms, np.sqrt(np.mean(np.square(mags))) )
+
+
+def test_populate_residual_statistics_A():
+  ''' Populates the topline RMS fields of orbit_fit_statistics '''
+  rwodict = get_rwodict()
+  mpcorb = template.get_template_json()
+  construct.populate_residual_statistics(rwodict, mpcorb)
+  assert np.isclose( mpcorb['orbit_fit_statistics']['normalized_RMS'], float(rwodict['rmsast']), rtol=1e-4 )
+  assert mpcorb['orbit_fit_statistics']['not_normalized_RMS'] > 0
+
+  # No usable residuals: falls back to orbfit's rmsast (& the template's not-normalized RMS)
+  rwodict['optical_list'] = []
+  mpcorb = template.get_template_json()
+  construct.populate_residual_statistics(rwodict, mpcorb)
+  assert mpcorb['orbit_fit_statistics']['normalized_RMS'] == rwodict['rmsast']
+  assert mpcorb['orbit_fit_statistics']['not_normalized_RMS'] == 0.0
+
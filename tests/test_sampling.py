@@ -0,0 +1,114 @@
+# standard imports
+import os, sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+# local imports
+from mpc_orb_creation import sampling
+from mpc_orb_creation import covariance
+from mpc_orb_creation import construct
+from mpc_orb_creation import template
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+def get_car():
+  ''' CAR elements & covariance of the sample orbfit output '''
+  car = construct.to_nums( io.load_json(filepath_dict['test_pass_orbfit_standard'][0])['eq1dict']['CAR'] )
+  return np.array([car['element%d' % _] for _ in range(6)]), covariance.PackedCovariance.from_dict(car).to_array()
+
+def random_stack(N, p, seed=0):
+  ''' (N,p,p) stack of random symmetric positive-definite matrices '''
+  A = np.random.default_rng(seed).normal(size=(N, p, p))
+  return A @ np.transpose(A, (0, 2, 1)) + p * np.eye(p)
+
+
+# functions to be tested
+# ------------------------
+def test_sample_A():
+  ''' The variants have the requested mean & covariance '''
+  elements, C = get_car()
+  variants = sampling.sample([elements, elements], [C, 4 * C], 20000, seed=44)
+  assert variants.shape == (2, 20000, 6) and variants.dtype == np.float64 and variants.flags['C_CONTIGUOUS']
+
+  for n, factor in enumerate([1, 4]):
+    sigma = np.sqrt(factor * np.diag(C))
+    assert np.all( np.abs(variants[n].mean(axis=0) - elements) < 5 * sigma / np.sqrt(20000) )
+    corr_expected = C / np.sqrt(np.outer(np.diag(C), np.diag(C)))
+    assert np.allclose( np.corrcoef(variants[n].T), corr_expected, atol=0.03 )
+    assert np.allclose( variants[n].std(axis=0) / sigma, 1.0, atol=0.03 )
+
+
+def test_sample_B():
+  ''' One RNG stream: reproducible, independent of the chunking & of how the stream is supplied '''
+  elements = np.random.default_rng(1).normal(size=(10, 4))
+  stack    = random_stack(10, 4)
+  variants = sampling.sample(elements, stack, 7, seed=3)
+  assert np.array_equal( variants, sampling.sample(elements, stack, 7, rng=np.random.default_rng(3)) )
+  assert not np.array_equal( variants, sampling.sample(elements, stack, 7, seed=4) )
+
+  chunk_size = sampling.CHUNK_SIZE
+  try:
+    sampling.CHUNK_SIZE = 3
+    assert np.allclose( variants, sampling.sample(elements, stack, 7, seed=3), rtol=1e-14, atol=0 )
+  finally:
+    sampling.CHUNK_SIZE = chunk_size
+
+  # The nominal orbit can be included as variant 0 (without changing the other variants)
+  with_nominal = sampling.sample(elements, stack, 7, seed=3, include_nominal=True)
+  assert np.array_equal( with_nominal[:, 0], elements )
+  assert np.array_equal( with_nominal[:, 1:], variants[:, 1:] )
+
+
+def test_square_roots_A():
+  ''' Semi-definite covariances fall back to an eigen-decomposition (only the matrices that need it) '''
+  stack = random_stack(3, 5)
+  v = np.arange(1.0, 6.0)
+  stack[1] = np.outer(v, v)                                # <<-- rank 1
+  L = sampling.square_roots(stack)
+  assert np.allclose( L @ np.transpose(L, (0, 2, 1)), stack )
+
+  # The other matrices keep their Cholesky (lower-triangular) factors
+  assert np.array_equal( L[[0, 2]], sampling.square_roots(stack[[0, 2]]) )
+  assert np.allclose( np.triu(L[0], 1), 0.0 ) and np.allclose( np.triu(L[2], 1), 0.0 )
+  assert not np.allclose( np.triu(L[1], 1), 0.0 )
+
+
+def test_sample_C():
+  ''' With a semi-definite covariance in the stack, the variants still do not depend on the chunking '''
+  elements = np.random.default_rng(1).normal(size=(10, 4))
+  stack    = random_stack(10, 4)
+  stack[6] = np.outer(np.arange(1.0, 5.0), np.arange(1.0, 5.0))
+  variants = sampling.sample(elements, stack, 7, seed=3)
+
+  chunk_size = sampling.CHUNK_SIZE
+  try:
+    sampling.CHUNK_SIZE = 3
+    assert np.allclose( variants, sampling.sample(elements, stack, 7, seed=3), rtol=1e-14, atol=0 )
+  finally:
+    sampling.CHUNK_SIZE = chunk_size
+  assert np.allclose( variants[[0, 1]], sampling.sample(elements, random_stack(10, 4), 7, seed=3)[[0, 1]], rtol=1e-14, atol=0 )
+
+
+def test_sample_catalogue_A():
+  ''' Variants from a catalogue snapshot & from (parse.MPCORB-like) objects; COM angles are wrapped '''
+  elements, C = get_car()
+  docs = []
+  for n in range(3):
+    doc = template.get_template_json()
+    doc['COM']['coefficient_values'] = [2.9, 0.08, 11.7, 359.9999, 0.0001 + n, 57983.0, None]
+    doc['COM']['covariance'].update( covariance.PackedCovariance.from_array(np.diag([1e-8, 1e-8, 1e-6, 1e-2, 1e-2, 1e-4])).to_dict() )
+    docs.append(doc)
+
+  variants = sampling.sample_catalogue(docs, 500, coordtype='COM', seed=5)
+  assert variants.shape == (3, 500, 6)
+  assert np.all( (variants[..., 3:5] >= 0) & (variants[..., 3:5] < 360) )
+  assert np.any( variants[0, :, 3] < 1 ) and np.any( variants[0, :, 3] > 359 )
+
+  mpcorbs = [ SimpleNamespace(CAR={'element_array': elements + n, 'covariance_array': C}) for n in range(2) ]
+  variants = sampling.sample_mpcorb(mpcorbs, 10, seed=6, include_nominal=True)
+  assert variants.shape == (2, 10, 6) and np.array_equal( variants[1, 0], elements + 1 )
@@ -0,0 +1,92 @@
+# standard imports
+import os, sys
+import json
+
+import numpy as np
+import pytest
+
+# local imports
+from mpc_orb_creation import transform
+from mpc_orb_creation import covariance
+from mpc_orb_creation import construct
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+def get_eq1dict():
+  ''' The (numeric) eq1dict of the sample orbfit output (which has both CAR & COM blocks) '''
+  return construct.to_nums( io.load_json(filepath_dict['test_pass_orbfit_standard'][0])['eq1dict'] )
+
+def get_elements_and_covariance(d):
+  return np.array([[d['element%d' % _] for _ in range(6)]]), covariance.PackedCovariance.from_dict(d, d['numparams']).to_array()[np.newaxis]
+
+
+# functions to be tested
+# ------------------------
+def test_convert_A():
+  ''' The conversions reproduce orbfit's CAR & COM blocks '''
+  eq1dict = get_eq1dict()
+  car, _ = get_elements_and_covariance(eq1dict['CAR'])
+  com, _ = get_elements_and_covariance(eq1dict['COM'])
+  epoch  = eq1dict['CAR']['epoch']
+
+  assert np.allclose( transform.com_to_car(com, epoch), car, rtol=0, atol=1e-9 )
+  assert np.allclose( transform.car_to_com(car, epoch), com, rtol=1e-9, atol=1e-6 )
+
+
+def test_convert_B():
+  ''' Elliptic, hyperbolic & parabolic orbits (in any mix) survive a COM -> CAR -> COM round-trip '''
+  com = np.array([
+    [2.5,  0.1,   10.0,  80.0, 150.0, 59500.0],
+    [0.9,  0.95,  45.0, 300.0,  10.0, 59590.0],
+    [1.2,  1.0,  120.0,  10.0, 250.0, 59610.0],
+    [3.0,  1.5,    5.0, 200.0,  90.0, 59550.0],
+    [40.0, 0.2,    2.0,  30.0, 330.0, 40000.0],
+  ])
+  car = transform.convert(com, 59600.0, 'COM', 'CAR')
+  assert car.shape == (5, 6)
+  assert np.allclose( transform.convert(car, 59600.0, 'CAR', 'COM'), com, rtol=1e-9, atol=1e-6 )
+
+  # Elliptic orbits are referred to the pericentre passage preceding the epoch
+  period = 2 * np.pi * np.sqrt( (0.9 / 0.05)**3 / transform.GM_SUN )
+  later  = com[1:2] + [0, 0, 0, 0, 0, 60.0]
+  assert np.isclose( transform.convert(transform.convert(later, 59600.0, 'COM', 'CAR'), 59600.0, 'CAR', 'COM')[0, 5], 59650.0 - period )
+
+  with pytest.raises(Exception):
+    transform.convert(com, 59600.0, 'COM', 'KEP')
+
+
+def test_transform_A():
+  ''' Propagated covariances (incl. a non-grav parameter) reproduce orbfit's uncertainties & eigval '''
+  eq1dict = get_eq1dict()
+  car, car_cov = get_elements_and_covariance(eq1dict['CAR'])
+  com, com_cov = get_elements_and_covariance(eq1dict['COM'])
+
+  elements, new_cov = transform.transform(com, eq1dict['COM']['epoch'], com_cov, 'COM', 'CAR')
+  assert np.allclose( np.sqrt(np.diagonal(new_cov[0])), eq1dict['CAR']['rms'], rtol=1e-4 )
+  assert np.allclose( transform.eigval(com_cov, 'COM')[0], eq1dict['COM']['eigval'], rtol=1e-4 )
+
+  # Add a non-grav parameter: it is carried across unchanged
+  cov7 = np.zeros((1, 7, 7))
+  cov7[0, :6, :6], cov7[0, 6, 6] = car_cov[0], 4.0e-26
+  _, new_cov7 = transform.transform(car, eq1dict['CAR']['epoch'], cov7, 'CAR', 'COM')
+  assert new_cov7[0, 6, 6] == 4.0e-26
+  assert np.allclose( np.sqrt(np.diagonal(new_cov7[0]))[:6], eq1dict['COM']['rms'], rtol=1e-4 )
+
+
+def test_fill_missing_coordtype_A():
+  ''' A missing COM block is filled in from the CAR block '''
+  eq1dict = get_eq1dict()
+  filled  = transform.fill_missing_coordtype( {k: v for k, v in eq1dict.items() if k != 'COM'} )
+
+  new, old = filled['COM'], eq1dict['COM']
+  assert new['element_order'] == ['q','e','i','node','argperi','peri_time']
+  assert np.allclose( [new['element%d' % _] for _ in range(6)], [old['element%d' % _] for _ in range(6)], rtol=1e-9, atol=1e-6 )
+  assert np.allclose( new['rms'], old['rms'], rtol=1e-4 )
+  assert np.allclose( new['eigval'], old['eigval'], rtol=1e-3 )
+  assert new['epoch'] == old['epoch'] and new['numparams'] == old['numparams']
+
+  # Nothing to do if both (or neither) blocks are present
+  assert transform.fill_missing_coordtype(eq1dict) is eq1dict
@@ -0,0 +1,86 @@
+# standard imports
+import os, sys
+
+import pytest
+
+# local imports
+from mpc_orb_creation import transport
+from mpc_orb_creation import binary
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+def worker_send(doc):
+  ''' Run in a worker process of a ResultTransport executor '''
+  return transport.send(dict(doc, pid=os.getpid())), os.getpid()
+
+
+# functions to be tested
+# ------------------------
+def test_ring_buffer_A():
+  ''' Payloads are read back as views; the space is reused once released (in any order) & a full buffer refuses payloads '''
+  ring = transport.RingBuffer.create(100)
+  try:
+    producer = transport.RingBuffer.attach(ring.name)
+    handles  = [ producer.put(bytes([n]) * 30) for n in range(3) ]
+    assert all(handles) and producer.put(b'x' * 11) is None          # <<-- 90 of 100 bytes used
+    assert producer.put(b'x' * 101) is None
+
+    for n, handle in enumerate(handles):
+      view = ring.view(handle)
+      assert bytes(view) == bytes([n]) * 30
+      view.release()
+
+    # Releasing the 2nd payload does not free any space (the 1st is still in use) ...
+    ring.release(handles[1])
+    assert producer.put(b'x' * 20) is None
+    # ... but releasing the 1st frees both: the next payload skips the 10 bytes at the end & wraps around
+    ring.release(handles[0])
+    handle = producer.put(b'y' * 50)
+    assert handle is not None and handle[2] == 0 and handle[1] == 90
+    assert producer.put(b'z' * 11) is None                             # <<-- 30 + 10 (skipped) + 50 in use
+    view = ring.view(handle)
+    assert bytes(view) == b'y' * 50
+    view.release()
+
+    for handle in [handles[2], handle]:
+      ring.release(handle)
+    assert producer.put(b'z' * 100) is not None
+    producer.close()
+  finally:
+    ring.close()
+
+
+def test_result_transport_A():
+  ''' Documents sent from worker processes are received losslessly; documents that do not fit fall back to pickling '''
+  doc = io.load_json(filepath_dict['test_pass_mpcorb'][0])
+  results = transport.ResultTransport(2, buffer_size=4 * 8 * len(binary.split(doc)[2]))
+  try:
+    with results.executor() as executor:
+      returned = list( executor.map(worker_send, [doc] * 20) )
+      # Only the numeric blocks go through the shared memory: the skeleton is returned with the handle
+      assert all( isinstance(handle, tuple) for handle, _ in returned[:2] )
+      skeleton, codes, handle = returned[0][0]
+      assert skeleton['CAR']['covariance'] is None and handle[3] == 8 * binary.n_values(codes)
+      received = [ results.receive(handle) for handle, _ in returned ]
+    assert [ r.pop('pid') for r in received ] == [ pid for _, pid in returned ]
+    assert all( r == doc for r in received )
+    assert results.stats['shared_memory'] > 0 and results.stats['pickled'] > 0
+    assert results.stats['shared_memory'] + results.stats['pickled'] == 20
+  finally:
+    results.close()
+
+  # No buffer in this process, or no numeric blocks: the dict is returned as it is
+  assert transport.send(doc) is doc
+  results = transport.ResultTransport(1)
+  try:
+    transport.attach_worker(results.names)
+    assert isinstance(transport.send(doc), tuple)
+    other = {'designation_data': {}}
+    assert transport.send(other) is other and results.receive(other) is other
+  finally:
+    transport._worker_buffer.close()
+    transport._worker_buffer = None
+    results.close()
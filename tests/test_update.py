@@ -0,0 +1,112 @@
+# standard imports
+import os, sys
+import copy
+
+import pytest
+
+# local imports
+from mpc_orb_creation import construct
+from mpc_orb_creation import backends
+from mpc_orb_creation import template
+from mpc_orb_creation import io
+from mpc_orb_creation.filepaths import filepath_dict
+
+
+# utility functionalities
+# ---------------------
+def no_validation(mpcorb_dict, sections):
+  ''' Stand-in validator (mpc_orb is not required to run these tests) '''
+  no_validation.sections = sections
+
+def get_inputs():
+  d = io.load_json(filepath_dict['test_pass_orbfit_standard'][0])
+  return {'eq1dict': d['eq1dict'], 'rwodict': d['rwodict'], 'moidsdict': {'Earth': 0.1, 'Mars': 0.2}}
+
+def get_designation_backend(object_type_int=0):
+  designation_backend = backends.SQLiteDesignationBackend()
+  designation_backend.add_designation('2005SD168', {'unpacked_primary_provisional_designation': '2005 SD168',
+                                                     'object_type': {'integer': object_type_int, 'key': 'MPC_ORB'}})
+  return designation_backend
+
+def get_existing():
+  ''' An mpcorb_dict with the sections that do not need the internal MPC modules populated '''
+  return construct.update( template.get_template_json(), get_inputs(),
+                           steps=['CAR_COM', 'designation_data', 'magnitude_data', 'epoch_data', 'moid_data'],
+                           designation_backend=get_designation_backend(), validator=no_validation )
+
+
+# functions to be tested
+# ------------------------
+def test_update_A():
+  ''' New MOIDs: only moid_data is recomputed & validated; all other sections are untouched (& shared) '''
+  existing = get_existing()
+  snapshot = copy.deepcopy(existing)
+  assert existing['moid_data']['Earth'] == 0.1 and existing['epoch_data']['epoch'] == 59600
+
+  updated = construct.update(existing, {'moidsdict': {'Earth': 0.05}}, validator=no_validation)
+  assert no_validation.sections == ['moid_data']
+  assert updated['moid_data']['Earth'] == 0.05 and updated['moid_data']['Mars'] is None
+  assert existing == snapshot
+  for section in existing:
+    if section != 'moid_data':
+      assert updated[section] is existing[section]
+
+
+def test_update_B():
+  ''' New designation cross-identification: designation_data is replaced & the categorization updated in place '''
+  existing = get_existing()
+  existing['categorization']['orbit_type_int'] = 10
+  assert existing['categorization']['object_type_int'] == 0
+
+  updated = construct.update(existing, {'rwodict': get_inputs()['rwodict']}, steps=['designation_data'],
+                             designation_backend=get_designation_backend(object_type_int=1), validator=no_validation)
+  assert no_validation.sections == ['designation_data', 'categorization']
+  assert updated['categorization']['object_type_int'] == 1 and updated['categorization']['orbit_type_int'] == 10
+  assert existing['categorization']['object_type_int'] == 0
+  assert 'object_type' not in updated['designation_data']
+
+
+def test_update_C():
+  ''' By default, only the steps whose inputs are all supplied are re-run; requested steps that need other inputs raise '''
+  assert construct.steps_for_inputs(['rwodict']) == ['designation_data']
+  assert construct.steps_for_inputs(['eq1dict']) == ['CAR_COM', 'magnitude_data', 'epoch_data', 'moid_data', 'categorization']
+  assert 'orbit_fit_statistics' in construct.steps_for_inputs(['eq0dict', 'eq1dict', 'rwodict', 'otherdict'])
+
+  existing = get_existing()
+  updated  = construct.update(existing, {'rwodict': get_inputs()['rwodict']},
+                              designation_backend=get_designation_backend(object_type_int=1), validator=no_validation)
+  assert no_validation.sections == ['designation_data', 'categorization']
+  assert updated['categorization']['object_type_int'] == 1 and updated['orbit_fit_statistics'] is existing['orbit_fit_statistics']
+
+  with pytest.raises(Exception, match='orbit_fit_statistics'):
+    construct.update(existing, {'rwodict': get_inputs()['rwodict']}, steps=['orbit_fit_statistics'], validator=no_validation)
+  with pytest.raises(Exception):
+    construct.update(existing, {'moids': {}}, validator=no_validation)
+
+
+def test_update_D():
+  ''' A new orbit (eq1dict) also re-computes the MOIDs (from the new COM elements), unless new external MOIDs are supplied '''
+  assert 'moid_data' in construct.steps_for_inputs(['eq1dict']) and 'moid_data' in construct.steps_for_inputs(['moidsdict'])
+  existing = get_existing()
+  eq1dict  = copy.deepcopy(get_inputs()['eq1dict'])
+  eq1dict['COM']['element0'] = 1.0
+
+  steps   = ['CAR_COM', 'epoch_data', 'moid_data']
+  updated = construct.update(existing, {'eq1dict': eq1dict}, steps=steps, validator=no_validation)
+  assert updated['COM']['coefficient_values'][0] == 1.0
+  assert updated['moid_data']['Earth'] not in (None, 0.1) and updated['moid_data']['Earth'] < 0.1 and updated['moid_data']['Mars'] is not None
+
+  updated = construct.update(existing, {'eq1dict': eq1dict, 'moidsdict': {'Earth': 0.3}}, steps=steps, validator=no_validation)
+  assert updated['moid_data']['Earth'] == 0.3
+
+
+def test_validate_sections_A():
+  ''' With a schema, only the named sections are validated '''
+  jsonschema = pytest.importorskip('jsonschema')
+  schema = {'type': 'object',
+            'properties': {'moid_data': {'type': 'object', 'properties': {'Earth': {'type': ['number', 'null']}}},
+                           'epoch_data': {'type': 'object', 'properties': {'epoch': {'type': 'string'}}}}}
+  existing = get_existing()
+  assert construct.validate_sections(existing, ['moid_data'], schema=schema)
+  with pytest.raises(jsonschema.ValidationError):
+    construct.validate_sections(existing, ['moid_data', 'epoch_data'], schema=schema)